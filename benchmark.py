@@ -24,6 +24,7 @@ class Benchmark (object):
     def __init__ (self, name = None, factor = None):
         self.name = name or type (self).__name__
         self.factor = factor or 1
+        self.notes = {}
 
     #--------------------------------------------------------------------------#
     # Interface                                                                #
@@ -41,6 +42,11 @@ class Benchmark (object):
         """Dispose benchmark
         """
 
+    def Note (self, name, value):
+        """Attach named note (i.g. measured memory usage) to benchmark results
+        """
+        self.notes [name] = value
+
     #--------------------------------------------------------------------------#
     # Execute                                                                  #
     #--------------------------------------------------------------------------#
@@ -153,6 +159,15 @@ class TextBenchmarkRunner (object):
         for line in lines:
             self.file.write (format.format (*line))
         self.file.write ('\n')
+
+        # notes
+        for bench in self.benchs:
+            notes = getattr (bench, 'notes', None)
+            if not notes:
+                continue
+            self.file.write ('  {}:\n'.format (bench.name))
+            for name, value in sorted (notes.items ()):
+                self.file.write ('    {:<24}{}\n'.format (name, value))
         self.file.flush ()
 
 #------------------------------------------------------------------------------#
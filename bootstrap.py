@@ -12,6 +12,9 @@ import inspect
 import pkgutil
 import importlib
 import pickle
+import hashlib
+import marshal
+import threading
 
 __all__ = ('Tomb', 'BootstrapSource', 'BootstrapBootstrap',)
 #------------------------------------------------------------------------------#
@@ -21,28 +24,83 @@ class Tomb (object):
     """Tomb importer
 
     Serializable importer. Capable to import all previously added modules.
+
+    In bytecode mode, marshaled code objects are serialized along with sources,
+    and are used instead of compiling sources if interpreter which loads tomb
+    has the same bytecode magic number.
+
+    In lazy mode, only top level modules and modules listed in ``lazy`` (with
+    their submodules) are serialized, all other modules are replaced with index
+    of their digests.
+    Such modules are fetched (with function installed by ``Fetcher``) when
+    they are imported for the first time.
     """
     TOMB_UUID = '1f43bbd9-36e0-4084-84e5-b7fb14fdb1bd'
 
-    def __init__ (self, containments = None):
+    cache_lock = threading.Lock ()
+    cache      = {}
+
+    def __init__ (self, containments = None, bytecode = False, lazy = None):
         self.containments = {} if containments is None else containments
+        self.bytecode = bytecode
+        self.lazy = tuple (lazy) if lazy else None
+        self.index = {}     # digest, file name and package flag of not fetched modules
+        self.fetcher = None
+        self.bytecodes = {} # marshaled code objects received with tomb
+        self.codes = {}     # compiled code objects
+        self.stamps = {}    # modification times of added files and directories
+        self.dumps = {}     # serialized forms, shared with unmodified copies
 
     #--------------------------------------------------------------------------#
     # Factory                                                                  #
     #--------------------------------------------------------------------------#
     @classmethod
-    def FromModules (cls, modules = None):
+    def FromModules (cls, modules = None, bytecode = False, lazy = None):
         """Create tomb from modules
 
-        If modules install add topmost package containing this module.
+        If modules install add topmost package containing this module. Tombs
+        are cached process-wide, and rebuilt only if any of their source files
+        have been changed.
         """
-
-        tomb = cls ()
-        if modules:
+        modules = modules or (__package__ or __name__.partition ('.') [0],)
+        lazy = tuple (lazy) if lazy else None
+        key = (cls, bytecode, lazy, tuple (getattr (module, '__name__', module) for module in modules))
+
+        with cls.cache_lock:
+            tomb = cls.cache.get (key)
+        if tomb is None or not tomb.stamps_valid ():
+            tomb = cls (bytecode = bytecode, lazy = lazy)
             for module in modules:
                 tomb.Add (module)
-        else:
-            tomb.Add (__package__ or __name__.partition ('.') [0])
+            with cls.cache_lock:
+                cls.cache [key] = tomb
+        return tomb.Copy ()
+
+    @classmethod
+    def Find (cls, name):
+        """Find module containment in process-wide cache of tombs
+
+        Returns source, file name and package flag tuple, or None.
+        """
+        with cls.cache_lock:
+            tombs = tuple (cls.cache.values ())
+        for tomb in tombs:
+            containment = tomb.containments.get (name)
+            if containment is not None:
+                return containment
+        return None
+
+    def Copy (self):
+        """Create copy of the tomb
+
+        Copy shares serialized forms with this tomb until it is modified.
+        """
+        tomb = type (self) (dict (self.containments), self.bytecode, self.lazy)
+        tomb.index = dict (self.index)
+        tomb.bytecodes = dict (self.bytecodes)
+        tomb.codes = dict (self.codes)
+        tomb.stamps = dict (self.stamps)
+        tomb.dumps = self.dumps
         return tomb
 
     #--------------------------------------------------------------------------#
@@ -73,12 +131,18 @@ class Tomb (object):
         # skip already imported packages
         if modname in self.containments:
             return
+        self.dumps = {}
 
         # check if loader is tomb
         loader  = pkgutil.get_loader (modname)
         if getattr (loader, 'TOMB_UUID', None) == self.TOMB_UUID:
             self.containments.update ((key, value) for key, value in loader.containments.items ()
                 if key.startswith (modname))
+            for key in tuple (loader.index):
+                if key.startswith (modname):
+                    try:
+                        self.containments [key] = loader.containment (key)
+                    except ImportError: pass
             return
 
         # find package file
@@ -91,11 +155,13 @@ class Tomb (object):
         if os.path.basename (filename).lower () == '__init__.py':
             root = os.path.dirname (filename)
             for path, dirs, files in os.walk (root):
+                self.stamps [path] = os.path.getmtime (path)
                 for file in files:
                     if not file.lower ().endswith ('.py'):
                         continue
 
                     filename = os.path.join (path, file)
+                    self.stamps [filename] = os.path.getmtime (filename)
                     source   = self.read_source (filename)
                     name     = modname if os.path.samefile (path, root) else \
                         '.'.join ((modname, os.path.relpath (path, root).replace ('/', '.')))
@@ -104,13 +170,28 @@ class Tomb (object):
                     else:
                         self.containments ['.'.join ((name, file [:-3]))] = source, filename, False
         else:
+            self.stamps [filename] = os.path.getmtime (filename)
             self.containments [modname] = self.read_source (filename), filename, False
 
     def AddSource (self, name, source, filename):
         """Add single file module by its source
         """
+        self.dumps = {}
+        self.codes.pop (name, None)
+        self.bytecodes.pop (name, None)
         self.containments [name] = source, filename, False
 
+    #--------------------------------------------------------------------------#
+    # Fetcher                                                                  #
+    #--------------------------------------------------------------------------#
+    def Fetcher (self, fetcher = None):
+        """Set function used to fetch source of not yet fetched module
+
+        Fetcher is called with module name and must return its source (or pair
+        of source and compiled code) or None.
+        """
+        self.fetcher = fetcher
+
     #--------------------------------------------------------------------------#
     # Install                                                                  #
     #--------------------------------------------------------------------------#
@@ -134,11 +215,17 @@ class Tomb (object):
             raise ValueError ('Initialization function must reside in added modules')
 
         wrap = lambda source: '\\\n'.join (textwrap.wrap (source, 78))
+
+        tomb_payload = self.dumps.get ('bootstrap')
+        if tomb_payload is None:
+            tomb_payload = self.tomb_payload.format (
+                bootstrap = BootstrapBootstrap ('_bootstrap'),
+                dump = wrap (binascii.b2a_base64 (self.ToBytes ()).strip ().decode ('utf-8')))
+            self.dumps ['bootstrap'] = tomb_payload
+
         return ''.join ((
             # tomb
-            self.tomb_payload.format (
-                bootstrap = BootstrapBootstrap ('_bootstrap'),
-                dump = wrap (binascii.b2a_base64 (self.ToBytes ()).strip ().decode ('utf-8'))),
+            tomb_payload,
             # init
             '' if init is None else self.init_payload.format (
                 wrap (binascii.b2a_base64 (pickle.dumps ((init, args, keys))).strip ().decode ('utf-8')))))
@@ -181,7 +268,11 @@ if init is not None:
     def find_module (self, name, path = None):
         """Find module by its name and path
         """
-        return self if name in self.containments else None
+        if name in self.containments:
+            return self
+        elif name in self.index and self.fetcher is not None:
+            return self
+        return None
 
     def load_module (self, name):
         """Load module by its name
@@ -189,11 +280,7 @@ if init is not None:
         module = sys.modules.get (name)
         if module is not None:
             return module
-
-        containment = self.containments.get (name)
-        if containment is None:
-            raise ImportError ('No such module: \'{}\''.format (name))
-        source, filename, ispkg = containment
+        source, filename, ispkg = self.containment (name)
 
         module = imp.new_module (name)
         module.__loader__ = self
@@ -207,7 +294,7 @@ if init is not None:
         module.__initializing__ = True
         sys.modules [name] = module
         try:
-            Exec (compile (source, module.__file__, 'exec'), module.__dict__)
+            Exec (self.get_code (name), module.__dict__)
             return module
         except Exception:
             sys.modules.pop (name, None)
@@ -218,25 +305,38 @@ if init is not None:
     def is_package (self, name):
         """Is module identified by name a package
         """
-        containment = self.containments.get (name)
-        if containment is None:
+        entry = self.containments.get (name) or self.index.get (name)
+        if entry is None:
             raise ImportError ('No such module: \'{}\''.format (name))
-        return containment [2]
+        return entry [2]
 
     def get_code (self, name):
         """Get code for module identified by name
+
+        Code is unmarshaled from received bytecode if available, otherwise it
+        is compiled from source. Code object is cached.
         """
-        containment = self.containments.get (name)
-        if containment is None:
-            raise ImportError ('No such module: \'{}\''.format (name))
-        return compile (containment [0], containment [1], 'exec')
+        code = self.codes.get (name)
+        if code is not None:
+            return code
+
+        containment = self.containment (name)
+        code = self.codes.get (name) # may be provided by fetcher
+        if code is not None:
+            return code
+
+        bytecode = self.bytecodes.pop (name, None)
+        if bytecode is None:
+            code = compile (containment [0], containment [1], 'exec')
+        else:
+            code = marshal.loads (binascii.a2b_base64 (bytecode.encode ('utf-8')))
+        self.codes [name] = code
+        return code
 
     def get_source (self, name):
         """Get source for module identified by name
         """
-        containment = self.containments.get (name)
-        if containment is None:
-            raise ImportError ('No such module: \'{}\''.format (name))
+        containment = self.containment (name)
         return (containment [0] if sys.version_info [0] > 2 else
                 containment [0].encode ('utf-8'))
 
@@ -245,24 +345,95 @@ if init is not None:
     #--------------------------------------------------------------------------#
     def ToBytes (self):
         """Save tomb as bytes
+
+        Result is deterministic, so it can be used as a cache key.
         """
-        return zlib.compress (json.dumps (self.containments, 2).encode ('utf-8'), 9)
+        data = self.dumps.get ('bytes')
+        if data is None:
+            containments, index = self.containments, dict (self.index)
+            if self.lazy:
+                containments = {}
+                for name, (source, filename, ispkg) in self.containments.items ():
+                    if '.' not in name or any (name == core or name.startswith (core + '.')
+                        for core in self.lazy):
+                        containments [name] = source, filename, ispkg
+                    else:
+                        index [name] = SourceDigest (source), filename, ispkg
+
+            state = {'containments': containments}
+            if index:
+                state ['index'] = index
+            if self.bytecode:
+                state ['magic'] = BytecodeMagic ()
+                state ['bytecodes'] = dict ((name, binascii.b2a_base64 (marshal.dumps (
+                    self.get_code (name))).strip ().decode ('utf-8')) for name in containments)
+            data = zlib.compress (json.dumps (state, skipkeys = True, sort_keys = True).encode ('utf-8'), 9)
+            self.dumps ['bytes'] = data
+        return data
 
     @classmethod
     def FromBytes (cls, data):
         """Load tomb from bytes
+
+        Bytecode is used only if it has been produced by compatible interpreter.
         """
-        return cls (json.loads (zlib.decompress (data).decode ('utf-8')))
+        state = json.loads (zlib.decompress (data).decode ('utf-8'))
+        tomb = cls (state ['containments'], 'bytecodes' in state)
+        tomb.index = state.get ('index', {})
+        if state.get ('magic') == BytecodeMagic ():
+            tomb.bytecodes = state ['bytecodes']
+        return tomb
 
     def __getstate__ (self):
         return self.ToBytes ()
 
     def __setstate__ (self, state):
-        self.containments = dict (Tomb.FromBytes (state).containments)
+        tomb = Tomb.FromBytes (state)
+        self.containments, self.bytecode = dict (tomb.containments), tomb.bytecode
+        self.bytecodes, self.codes = tomb.bytecodes, {}
+        self.lazy, self.index, self.fetcher = None, tomb.index, None
+        self.stamps, self.dumps = {}, {}
 
     #--------------------------------------------------------------------------#
     # Private                                                                  #
     #--------------------------------------------------------------------------#
+    def containment (self, name):
+        """Get containment of the module, fetch it if needed
+        """
+        containment = self.containments.get (name)
+        if containment is not None:
+            return containment
+
+        entry = self.index.get (name)
+        if entry is None or self.fetcher is None:
+            raise ImportError ('No such module: \'{}\''.format (name))
+        digest, filename, ispkg = entry
+
+        source, code = self.fetcher (name), None
+        if isinstance (source, tuple):
+            source, code = source
+        if source is None or SourceDigest (source) != digest:
+            raise ImportError ('Module has been changed since tomb creation: \'{}\''.format (name))
+        if code is not None:
+            self.codes [name] = code
+
+        containment = source, filename, ispkg
+        self.containments [name] = containment
+        self.index.pop (name, None)
+        self.dumps = {}
+        return containment
+
+    def stamps_valid (self):
+        """Check that none of added files and directories has been modified
+        """
+        try:
+            for path, mtime in self.stamps.items ():
+                if os.path.getmtime (path) != mtime:
+                    return False
+            return True
+        except OSError:
+            return False
+
     @staticmethod
     def read_source (filename):
         """Read source from file name
@@ -303,6 +474,22 @@ if init is not None:
         self.Dispose ()
         return False
 
+#------------------------------------------------------------------------------#
+# Source Digest                                                                #
+#------------------------------------------------------------------------------#
+def SourceDigest (source):
+    """Digest of module source
+    """
+    return hashlib.sha1 (source if isinstance (source, bytes) else source.encode ('utf-8')).hexdigest ()
+
+#------------------------------------------------------------------------------#
+# Bytecode Magic                                                               #
+#------------------------------------------------------------------------------#
+def BytecodeMagic ():
+    """Bytecode magic number of this interpreter (as string)
+    """
+    return binascii.hexlify (imp.get_magic ()).decode ('utf-8')
+
 #------------------------------------------------------------------------------#
 # Bootstrap                                                                    #
 #------------------------------------------------------------------------------#
@@ -398,6 +585,7 @@ def Usage ():
     usage_pattern = '''Usage: {name} [options] [<modules>]
     -h|?      : print this help message
     -m <file> : use file as main
+    -b        : include bytecode
     '''
     sys.stderr.write (usage_pattern.format (name = os.path.basename (sys.argv [0])))
 
@@ -410,19 +598,22 @@ def Main ():
     # Parse Options                                                            #
     #--------------------------------------------------------------------------#
     try:
-        opts, args = getopt.getopt (sys.argv [1:], '?hm:')
+        opts, args = getopt.getopt (sys.argv [1:], '?hm:b')
     except getopt.GetoptError as error:
         sys.stderr.write (':: error: {}\n'.format (error))
         Usage ()
         sys.exit (1)
 
     main_path = None
+    bytecode = False
     for o, a in opts:
         if o in ('-h', '-?'):
             Usage ()
             sys.exit (0)
         elif o == '-m':
             main_path = a
+        elif o == '-b':
+            bytecode = True
         else:
             assert False, 'Unhandled option: {}'.format (o)
 
@@ -430,7 +621,7 @@ def Main ():
     # Output                                                                   #
     #--------------------------------------------------------------------------#
     sys.stdout.write ('# -*- coding: utf-8 -*-\n' if main_path is None else '#! /usr/bin/env python\n')
-    sys.stdout.write (Tomb.FromModules (args or None).Bootstrap ())
+    sys.stdout.write (Tomb.FromModules (args or None, bytecode).Bootstrap ())
     sys.stdout.write ('\n')
 
     if main_path:
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
-from . import hub, proxy, conn
+from . import hub, proxy, conn, parallel
 
 from .hub import *
 from .proxy import *
 from .conn import *
+from .parallel import *
 
-__all__ = hub.__all__ + proxy.__all__ + conn.__all__
+__all__ = hub.__all__ + proxy.__all__ + conn.__all__ + parallel.__all__
 #------------------------------------------------------------------------------#
 # Load Test Protocol                                                           #
 #------------------------------------------------------------------------------#
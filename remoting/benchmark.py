@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
+import io
+import pickle
 import itertools
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None # python 2
 
-from ..async import Async, Future
+from ..async import Async, DummyAsync, Future
 from ..benchmark import Benchmark
+from ..bootstrap import Tomb
 from .conn import ForkConnection
+from .conn.conn import Connection
+from .conn.serializer import Serializer
+from .hub import Hub, ReceiverSenderPair
+from .expr import Code, CallExpr, GetAttrExpr, LoadArgExpr
+from .importer import ImporterCore
 
 #------------------------------------------------------------------------------#
 # Function Benchmark                                                           #
@@ -14,16 +26,29 @@ def fn ():
     """
     return next (fn_count)
 
+def code_interpret ():
+    """Make codes received by this process interpreted instead of compiled
+
+    Executed by remote peer of benchmarks measuring gain of code compilation.
+    """
+    Code.compiled = False
+
 class FuncBench (Benchmark):
     """Benchmark function call
+
+    If ``interpreted`` is set, remote peer interprets codes instead of
+    compiling them into closures (compare with non interpreted variant).
     """
-    def __init__ (self):
-        Benchmark.__init__ (self, 'remoting.func', 1)
+    def __init__ (self, interpreted = False):
+        Benchmark.__init__ (self, 'remoting.func_interpreted' if interpreted else 'remoting.func', 1)
+        self.interpreted = interpreted
         self.conn = None
 
     @Async
     def Init (self):
         self.conn = yield ForkConnection ()
+        if self.interpreted:
+            yield self.conn (code_interpret) ()
         self.func = self.conn (fn) ()
         if ((yield self.func), (yield self.func)) != (1, 2):
             raise ValueError ('Initialization test failed')
@@ -39,8 +64,9 @@ class FuncBench (Benchmark):
 class FuncAsyncBench (FuncBench):
     """Benchmark asynchronous function call
     """
-    def __init__ (self):
-        Benchmark.__init__ (self, 'remoting.func_async', 2048)
+    def __init__ (self, interpreted = False):
+        Benchmark.__init__ (self, 'remoting.func_async_interpreted' if interpreted else 'remoting.func_async', 2048)
+        self.interpreted = interpreted
         self.conn = None
 
     def Body (self):
@@ -56,16 +82,25 @@ class Remote (object):
     def Method (self):
         return next (self.count)
 
+    def Echo (self, value):
+        return value
+
 class MethodBench (Benchmark):
     """Benchmark proxy method call
+
+    If ``interpreted`` is set, remote peer interprets codes instead of
+    compiling them into closures (compare with non interpreted variant).
     """
-    def __init__ (self):
-        Benchmark.__init__ (self, 'remoting.method', 1)
+    def __init__ (self, interpreted = False):
+        Benchmark.__init__ (self, 'remoting.method_interpreted' if interpreted else 'remoting.method', 1)
+        self.interpreted = interpreted
         self.conn = None
 
     @Async
     def Init (self):
         self.conn  = yield ForkConnection ()
+        if self.interpreted:
+            yield self.conn (code_interpret) ()
         self.proxy = yield +self.conn (Remote) ()
         self.method = self.proxy.Method ()
         if ((yield self.method), (yield self.method)) != (1, 2):
@@ -85,13 +120,239 @@ class MethodBench (Benchmark):
 class MethodAsyncBench (MethodBench):
     """Benchmark asynchronous proxy method call
     """
-    def __init__ (self):
-        Benchmark.__init__ (self, 'remoting.method_async', 1024)
+    def __init__ (self, interpreted = False):
+        Benchmark.__init__ (self, 'remoting.method_async_interpreted' if interpreted else 'remoting.method_async', 1024)
+        self.interpreted = interpreted
         self.conn = None
 
     def Body (self):
         return Future.All ([self.method.Await () for _ in range (self.factor)])
 
+class MethodArgsBench (MethodBench):
+    """Benchmark asynchronous proxy method calls with varying arguments
+
+    New proxy is created for each call, so only shared code template and
+    arguments are sent.
+    """
+    def __init__ (self):
+        Benchmark.__init__ (self, 'remoting.method_args', 1024)
+        self.interpreted = False
+        self.conn = None
+
+    def Body (self):
+        return Future.All ([self.proxy.Echo (index).Await () for index in range (self.factor)])
+
+#------------------------------------------------------------------------------#
+# Code Benchmark                                                               #
+#------------------------------------------------------------------------------#
+class CodeBench (Benchmark):
+    """Benchmark method call code execution
+
+    Code is either compiled into closure, or interpreted.
+    """
+    def __init__ (self, name, compiled):
+        Benchmark.__init__ (self, name, 4096)
+        self.compiled = compiled
+
+    @DummyAsync
+    def Init (self):
+        self.target = Remote ()
+        self.code = Code.FromExpr (CallExpr (GetAttrExpr (LoadArgExpr (0), 'Method')))
+
+    @DummyAsync
+    def Body (self):
+        execute, target = self.code if self.compiled else self.code.interpret, self.target
+        for _ in range (self.factor):
+            execute (target)
+
+#------------------------------------------------------------------------------#
+# Serializer Benchmark                                                         #
+#------------------------------------------------------------------------------#
+class SerializerBench (Benchmark):
+    """Benchmark per message serialization overhead
+
+    Message is packed and unpacked the same way connection does it, either with
+    pickler and unpickler created per message or with connection serializer.
+    """
+    def __init__ (self, name, reuse, protocol = None):
+        Benchmark.__init__ (self, name, 4096)
+        self.reuse = reuse
+        self.protocol = Serializer.default_protocol if protocol is None else protocol
+        self.conn = None
+
+    @DummyAsync
+    def Init (self):
+        self.conn = Connection ()
+        self.conn.serializer.Protocol (self.protocol)
+        self.msg = (Code.FromExpr (CallExpr (GetAttrExpr (LoadArgExpr (0), 'Method'), 1)),
+            self.conn.sender, self.conn.sender.dst + self.conn.sender.dst)
+
+    @DummyAsync
+    def Body (self):
+        msg, conn = self.msg, self.conn
+        if self.reuse:
+            dump, load = conn.serializer.Dump, conn.serializer.Load
+            for _ in range (self.factor):
+                load (*dump (msg))
+            self.Note ('frame size (bytes)', len (dump (msg) [0]))
+        else:
+            pickler_type, unpickler_type = conn.pickler_type, conn.unpickler_type
+            for _ in range (self.factor):
+                stream = io.BytesIO ()
+                pickler_type (stream, self.protocol).dump (msg)
+                unpickler_type (io.BytesIO (stream.getvalue ())).load ()
+
+    def Dispose (self):
+        conn, self.conn = self.conn, None
+        if conn:
+            conn.Dispose ()
+
+#------------------------------------------------------------------------------#
+# Large Message Benchmark                                                      #
+#------------------------------------------------------------------------------#
+def large_message (size):
+    """Create large message used by benchmark
+    """
+    return b'\x00' * size
+
+class LargeMessageBench (Benchmark):
+    """Benchmark large message receiving
+
+    Peak memory allocated while single large message is in-flight is reported
+    relative to message size (requires tracemalloc). Message is passed either
+    via pipe or via shared memory ring.
+    """
+    def __init__ (self, name, size = None, shared = None):
+        Benchmark.__init__ (self, name, 1)
+        self.size = size or 1 << 24
+        self.shared = shared
+        self.conn = None
+
+    @Async
+    def Init (self):
+        self.conn = yield ForkConnection (shared = self.shared and self.size * 2)
+        self.message = self.conn (large_message) (self.size)
+        if len ((yield self.message)) != self.size:
+            raise ValueError ('Initialization test failed')
+
+    @Async
+    def Body (self):
+        if tracemalloc is None:
+            self.Note ('peak memory', 'tracemalloc is not available')
+            yield self.message
+            return
+
+        tracemalloc.start ()
+        try:
+            yield self.message
+            current, peak = tracemalloc.get_traced_memory ()
+        finally:
+            tracemalloc.stop ()
+
+        peak_max = max (peak, self.notes.get ('peak memory (bytes)', 0))
+        self.Note ('peak memory (bytes)', peak_max)
+        self.Note ('peak memory / size', '{:.2f}'.format (float (peak_max) / self.size))
+
+    def Dispose (self):
+        conn, self.conn = self.conn, None
+        if conn:
+            conn.Dispose ()
+
+#------------------------------------------------------------------------------#
+# Connect Benchmark                                                            #
+#------------------------------------------------------------------------------#
+class ConnectBench (Benchmark):
+    """Benchmark fork connection time-to-first-call
+
+    Modules are sent either as sources or precompiled (bytecode mode), all at
+    once or only required ones (lazy mode). Size of serialized tomb is noted.
+    """
+    def __init__ (self, name, bytecode = False, lazy = False):
+        Benchmark.__init__ (self, name, 1)
+        self.bytecode = bytecode
+        self.lazy = lazy
+
+    @DummyAsync
+    def Init (self):
+        tomb = Tomb.FromModules (bytecode = self.bytecode,
+            lazy = ImporterCore () if self.lazy else None)
+        self.Note ('tomb size (bytes)', len (tomb.ToBytes ()))
+
+    @Async
+    def Body (self):
+        with (yield ForkConnection (bytecode = self.bytecode, lazy = self.lazy)) as conn:
+            yield conn (fn) ()
+
+#------------------------------------------------------------------------------#
+# Hub Benchmark                                                                #
+#------------------------------------------------------------------------------#
+class HubSendBench (Benchmark):
+    """Benchmark hub message dispatch
+
+    Messages are sent directly with ``Hub.Send`` to destination with specified
+    number of handlers, no connection is involved.
+    """
+    def __init__ (self, name, handlers = 1):
+        Benchmark.__init__ (self, name, 1 << 16)
+        self.handlers = handlers
+        self.hub = None
+
+    @DummyAsync
+    def Init (self):
+        self.hub = Hub ()
+        self.dst = self.hub.Address ()
+        for _ in range (self.handlers):
+            self.hub.On (self.dst, lambda msg, src, dst: True)
+
+    @DummyAsync
+    def Body (self):
+        send, dst = self.hub.Send, self.dst
+        for msg in range (self.factor):
+            send (dst, msg, None)
+
+    def Dispose (self):
+        hub, self.hub = self.hub, None
+        if hub:
+            hub.Dispose ()
+
+class RequestMemoryBench (Benchmark):
+    """Benchmark memory used by in-flight requests
+
+    Requests are sent to receiver which never replies, memory allocated per
+    pending request is noted (requires tracemalloc).
+    """
+    def __init__ (self):
+        Benchmark.__init__ (self, 'remoting.request_memory', 1 << 14)
+        self.hub = None
+
+    @DummyAsync
+    def Init (self):
+        self.hub = Hub ()
+        receiver, self.sender = ReceiverSenderPair (hub = self.hub)
+        receiver.On (lambda msg, src, dst: True)
+
+    @DummyAsync
+    def Body (self):
+        if tracemalloc is None:
+            self.Note ('bytes per request', 'tracemalloc is not available')
+            return
+
+        futures = [None] * self.factor
+        tracemalloc.start ()
+        try:
+            for index in range (self.factor):
+                futures [index] = self.sender.Request (None)
+            current, peak = tracemalloc.get_traced_memory ()
+        finally:
+            tracemalloc.stop ()
+        self.hub.replies.clear ()
+        self.Note ('bytes per request', current // self.factor)
+
+    def Dispose (self):
+        hub, self.hub = self.hub, None
+        if hub:
+            hub.Dispose ()
+
 #------------------------------------------------------------------------------#
 # Load Benchmark Protocol                                                      #
 #------------------------------------------------------------------------------#
@@ -100,9 +361,27 @@ def load_bench (runner):
     """
     for bench in ((
         FuncBench (),
+        FuncBench (interpreted = True),
         FuncAsyncBench (),
+        FuncAsyncBench (interpreted = True),
         MethodBench (),
+        MethodBench (interpreted = True),
         MethodAsyncBench (),
+        MethodAsyncBench (interpreted = True),
+        MethodArgsBench (),
+        CodeBench ('remoting.code_compiled', True),
+        CodeBench ('remoting.code_interpreted', False),
+        SerializerBench ('remoting.serialize_fresh', False),
+        SerializerBench ('remoting.serialize_reuse', True),
+        SerializerBench ('remoting.serialize_reuse_highest', True, pickle.HIGHEST_PROTOCOL),
+        LargeMessageBench ('remoting.large_message'),
+        LargeMessageBench ('remoting.large_message_shared', shared = True),
+        ConnectBench ('remoting.connect_source'),
+        ConnectBench ('remoting.connect_bytecode', bytecode = True),
+        ConnectBench ('remoting.connect_lazy', lazy = True),
+        HubSendBench ('remoting.hub_send'),
+        HubSendBench ('remoting.hub_send_many', handlers = 4),
+        RequestMemoryBench (),
     )):
         runner.Add (bench)
 
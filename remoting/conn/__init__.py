@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
-from . import fork, shell, ssh
+from . import fork, shell, ssh, sock, pool, zygote
 
 from .fork import *
 from .shell import *
 from .ssh import *
+from .sock import *
+from .pool import *
+from .zygote import *
 
-__all__ = fork.__all__ + shell.__all__ + ssh.__all__
+__all__ = fork.__all__ + shell.__all__ + ssh.__all__ + sock.__all__ + pool.__all__ + zygote.__all__
 # vim: nu ft=python columns=120 :
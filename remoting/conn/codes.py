@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import sys
+import types
+import weakref
+import itertools
+import collections
+
+from ..expr import Code, OP_LDCONST
+
+__all__ = ('CodeCache', 'CodeCacheable',)
+#------------------------------------------------------------------------------#
+# Code Cache                                                                   #
+#------------------------------------------------------------------------------#
+class CodeCache (object):
+    """Connection scoped cache of code objects
+
+    Code object is assigned an id the first time it is sent, and only this id
+    is sent afterwards. Remote peer keeps least recently used decoded (and
+    thus compiled) code objects. Sender mirrors this least recently used list
+    of ids (regardless of sent code objects being collected), and sends bare
+    id only while it is in the mirror. Remote peer keeps twice as many codes
+    as the mirror does, so ids stay valid even if messages are dispatched
+    slightly out of order. Only codes with immutable constants are cached (see
+    ``CodeCacheable``), as remote peer executes the same code object every
+    time.
+    """
+    default_capacity = 1024
+
+    def __init__ (self, capacity = None):
+        self.capacity = capacity or self.default_capacity
+        self.cid = itertools.count (1)
+
+        self.sent = collections.OrderedDict ()      # code id -> (cid or None, code reference)
+        self.sent_cids = collections.OrderedDict () # mirror of cids kept by remote peer
+        self.sent_pending = False                   # codes are packed by frame being dumped
+        self.received = collections.OrderedDict ()  # cid -> code
+
+    #--------------------------------------------------------------------------#
+    # Pack                                                                     #
+    #--------------------------------------------------------------------------#
+    def Pack (self, code):
+        """Pack code object
+
+        Returns pair of code id and code operations (or None if remote peer
+        already has this code), or None if code cannot be cached.
+        """
+        key = id (code)
+        entry = self.sent.pop (key, None)
+        if entry is not None and entry [1] () is code:
+            self.sent [key] = entry
+            cid = entry [0]
+            if cid is None:
+                return None
+        else:
+            cid = next (self.cid) if CodeCacheable (code) else None
+            self.sent [key] = cid, weakref.ref (code, lambda _: self.sent.pop (key, None))
+            while len (self.sent) > self.capacity:
+                self.sent.popitem (last = False)
+            if cid is None:
+                return None
+
+        # mirror remote peer usage of the code
+        sent_cids = self.sent_cids
+        cached = sent_cids.pop (cid, False) is None
+        sent_cids [cid] = None
+        while len (sent_cids) > self.capacity:
+            sent_cids.popitem (last = False)
+        self.sent_pending = True
+        return (cid, None) if cached else (cid, list (code))
+
+    def Commit (self):
+        """Frame with packed codes has been dumped
+        """
+        self.sent_pending = False
+
+    def Rollback (self):
+        """Frame with packed codes has failed to dump
+
+        Mirror no longer matches remote peer, so all codes are sent again.
+        """
+        if self.sent_pending:
+            self.sent_cids.clear ()
+        self.sent_pending = False
+
+    #--------------------------------------------------------------------------#
+    # Unpack                                                                   #
+    #--------------------------------------------------------------------------#
+    def Unpack (self, cid, ops):
+        """Unpack code object by its id and operations
+        """
+        received = self.received
+        if ops is not None:
+            code = Code (ops)
+            received.pop (cid, None)
+            received [cid] = code
+            while len (received) > self.capacity * 2:
+                received.popitem (last = False)
+            return code
+
+        code = received.pop (cid, None)
+        if code is None:
+            raise ValueError ('Unknown code id: {}'.format (cid))
+        received [cid] = code
+        return code
+
+    def Received (self, cid):
+        """Whether code with this id has been received
+        """
+        return cid in self.received
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [sent:{} received:{}] at {}>'.format (type (self).__name__,
+            len (self.sent_cids), len (self.received), id (self))
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+#------------------------------------------------------------------------------#
+# Code Cacheable                                                               #
+#------------------------------------------------------------------------------#
+def CodeCacheable (code):
+    """Check if all constants of the code are immutable
+    """
+    for op, arg in code:
+        if op == OP_LDCONST and not const_immutable (arg):
+            return False
+    return True
+
+def const_immutable (const):
+    """Check if constant is immutable
+    """
+    if isinstance (const, immutable_types):
+        return True
+    elif isinstance (const, tuple):
+        return all (const_immutable (item) for item in const)
+    elif isinstance (const, Code):
+        return CodeCacheable (const)
+    return False
+
+# functions and types are pickled by reference, so they are immutable as well
+immutable_types = (type (None), bool, int, float, complex, bytes, str, type,
+    types.FunctionType, types.BuiltinFunctionType)
+if sys.version_info [0] < 3:
+    immutable_types += (long, unicode)
+
+# vim: nu ft=python columns=120 :
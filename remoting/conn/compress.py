@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import zlib
+
+__all__ = ('Compressor',)
+#------------------------------------------------------------------------------#
+# Compressor                                                                   #
+#------------------------------------------------------------------------------#
+class Compressor (object):
+    """Adaptive frame compressor
+
+    Frames smaller than ``threshold`` bytes are never compressed. If compressed
+    frame is larger than ``ratio`` of original size, compression is suspended
+    for ``backoff`` frames, and this period is doubled on each consecutive poor
+    result (up to ``backoff_max`` frames).
+    """
+    default_level       = 6
+    default_threshold   = 1 << 12
+    default_ratio       = 0.9
+    default_backoff     = 16
+    default_backoff_max = 1024
+
+    def __init__ (self, level = None, threshold = None, ratio = None, backoff = None):
+        self.level = self.default_level if level is None else level
+        self.threshold = threshold or self.default_threshold
+        self.ratio = ratio or self.default_ratio
+        self.backoff = backoff or self.default_backoff
+        self.enabled = False
+
+        self.suspend = 0      # number of frames left to skip
+        self.suspend_next = 0 # next suspend period
+
+        # counters
+        self.bytes_in = 0     # size of frames which were passed to compressor
+        self.bytes_out = 0    # size of these frames after compression
+        self.frames = 0       # number of compressed frames
+        self.frames_poor = 0  # number of frames with poor compression ratio
+        self.time = 0         # processor time spent (de)compressing frames
+
+    #--------------------------------------------------------------------------#
+    # Enable                                                                   #
+    #--------------------------------------------------------------------------#
+    def Enable (self, level = None):
+        """Enable compression with specified level
+        """
+        if level is not None:
+            self.level = level
+        self.enabled = True
+        self.suspend, self.suspend_next = 0, 0
+        return self
+
+    def Disable (self):
+        """Disable compression
+        """
+        self.enabled = False
+        return self
+
+    #--------------------------------------------------------------------------#
+    # Compress                                                                 #
+    #--------------------------------------------------------------------------#
+    def Compress (self, frame):
+        """Compress frame
+
+        Returns compressed frame, or None if frame must be sent as is.
+        """
+        if not self.enabled or len (frame) < self.threshold:
+            return None
+        elif self.suspend:
+            self.suspend -= 1
+            return None
+
+        start = timer ()
+        data = zlib.compress (frame, self.level)
+        self.time += timer () - start
+
+        self.bytes_in += len (frame)
+        if len (data) > len (frame) * self.ratio:
+            self.bytes_out += len (frame)
+            self.frames_poor += 1
+            self.suspend_next = min (self.suspend_next * 2 or self.backoff, self.default_backoff_max)
+            self.suspend = self.suspend_next
+            return None
+
+        self.bytes_out += len (data)
+        self.frames += 1
+        self.suspend_next = 0
+        return data
+
+    def Decompress (self, data):
+        """Decompress frame
+        """
+        start = timer ()
+        try:
+            return zlib.decompress (data if PY3 else data.tobytes ())
+        finally:
+            self.time += timer () - start
+
+    #--------------------------------------------------------------------------#
+    # Counters                                                                 #
+    #--------------------------------------------------------------------------#
+    @property
+    def Saved (self):
+        """Number of bytes saved by compression
+        """
+        return self.bytes_in - self.bytes_out
+
+    @property
+    def Time (self):
+        """Processor time (in seconds) spent compressing and decompressing frames
+        """
+        return self.time
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [enabled:{} level:{} saved:{} frames:{} poor:{} time:{:.3f}s] at {}>'.format (
+            type (self).__name__, self.enabled, self.level, self.Saved,
+            self.frames, self.frames_poor, self.time, id (self))
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+#------------------------------------------------------------------------------#
+# Helpers                                                                      #
+#------------------------------------------------------------------------------#
+PY3 = sys.version_info [0] > 2
+timer = getattr (time, 'process_time', None) or time.clock
+
+# vim: nu ft=python columns=120 :
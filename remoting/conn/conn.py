@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
-import io
 import sys
+import pickle
 from pickle import Pickler, Unpickler
 
+from .serializer import Serializer
+from .codes import CodeCache
 from ..hub import Hub, Sender, ReceiverSenderPair
 from ..result import Result, ResultPrintException
-from ..proxy import Proxy
-from ..expr import LoadConstExpr, LoadArgExpr
-from ...async import Async, AsyncReturn, DummyAsync, Core, StateMachine, StateMachineGraph
+from ..proxy import Proxy, ProxyBatch
+from ..expr import Code, CodeCall, LoadConstExpr, LoadArgExpr, GetAttrExpr, CallExpr
+from ...async import (Async, AsyncReturn, DummyAsync, Core, Event, Future, StateMachine,
+                      StateMachineGraph, SucceededFuture)
 from ...disposable import CompositeDisposable
 
 __all__ = ('Connection',)
@@ -23,6 +26,14 @@ class Connection (object):
     STATE_CONNED   = 'connected'
     STATE_DISPOSED = 'disposed'
 
+    # Size of bytes like objects starting from which they are carried out-of-band
+    # of the frame, if connection supports it.
+    buffer_threshold = None
+
+    # If set, proxy requests to this connection are postponed while connection
+    # is not ready (see ``Ready``). Must be set before connection is established.
+    ready_wait = False
+
     STATE_GRAPH = StateMachineGraph (STATE_INIT, {
         STATE_INIT:     (STATE_CONNING, STATE_DISPOSED),
         STATE_CONNING:  (STATE_CONNED, STATE_DISPOSED),
@@ -50,6 +61,11 @@ class Connection (object):
                 return self.unpack_name (modname, name)
         self.unpickler_type = unpickler_type
 
+        self.serializer = Serializer (pickler_type, unpickler_type)
+        self.codes = CodeCache ()
+        self.unpacking = 0       # number of dispatched but not yet unpacked messages
+        self.unpacked = Event () # fired once message is unpacked
+
     #--------------------------------------------------------------------------#
     # Call                                                                     #
     #--------------------------------------------------------------------------#
@@ -58,6 +74,11 @@ class Connection (object):
         """
         return Proxy (self.sender, LoadConstExpr (target))
 
+    def Batch (self):
+        """Create batch of proxy expressions evaluated by single request
+        """
+        return ProxyBatch (self.sender)
+
     #--------------------------------------------------------------------------#
     # Connect                                                                  #
     #--------------------------------------------------------------------------#
@@ -72,6 +93,8 @@ class Connection (object):
            self.receiver.On (self.handle)
            yield self.connect (target)
            self.state (self.STATE_CONNED)
+           if self.ready_wait:
+               self.hub.Gate (self.sender.dst, self.Ready)
        except Exception:
            self.Dispose ()
            raise
@@ -83,6 +106,13 @@ class Connection (object):
         """
         return self.state.State == self.STATE_CONNED
 
+    def Ready (self):
+        """Get future resolved once connection is ready to send more messages
+
+        Connection may be not ready when its outgoing traffic is too high.
+        """
+        return ready_future
+
     @DummyAsync
     def connect (self, target):
         """Connect implementation
@@ -92,17 +122,52 @@ class Connection (object):
         """Disconnect implementation
         """
 
+    #--------------------------------------------------------------------------#
+    # Negotiate                                                                #
+    #--------------------------------------------------------------------------#
+    @Async
+    def negotiate (self):
+        """Negotiate connection options with remote peer
+
+        Must be called by connection initiator once connection is established.
+        """
+        options = yield self.sender.Request (Code.FromExpr (CallExpr (
+            GetAttrExpr (LoadArgExpr (0), 'agree'), self.propose ())))
+        AsyncReturn (self.agree (options))
+
+    def propose (self):
+        """Connection options proposed to remote peer
+        """
+        return {'protocol': pickle.HIGHEST_PROTOCOL}
+
+    def agree (self, options):
+        """Agree on connection options proposed by remote peer
+
+        Returns agreed options.
+        """
+        protocol = self.serializer.Protocol (min (options.get ('protocol',
+            Serializer.default_protocol), pickle.HIGHEST_PROTOCOL))
+        return {'protocol': protocol}
+
     #--------------------------------------------------------------------------#
     # Marshal                                                                  #
     #--------------------------------------------------------------------------#
     PACK_ROUTE   = 0x1
     PACK_UNROUTE = 0x2
     PACK_PROXY   = 0x4
+    PACK_BUFFER  = 0x8
+    PACK_CODE    = 0x10
+    PACK_CALL    = 0x20
 
     def pack (self, target):
         """Pack target object
         """
-        if isinstance (target, Sender):
+        if isinstance (target, buffer_types):
+            if self.buffer_threshold and len (target) >= self.buffer_threshold:
+                return self.PACK_BUFFER, (self.serializer.BufferPut (target),
+                    isinstance (target, bytearray))
+
+        elif isinstance (target, Sender):
             if target.dst == self.sender.dst:
                 # This sender was previously received from this connection
                 # so it must not be routed again.
@@ -111,6 +176,16 @@ class Connection (object):
                 # Sender must be routed
                 return self.PACK_ROUTE, target.dst
 
+        elif isinstance (target, Code):
+            code = self.codes.Pack (target)
+            if code is not None:
+                return self.PACK_CODE, code
+
+        elif isinstance (target, CodeCall):
+            code = self.codes.Pack (target.code)
+            if code is not None:
+                return self.PACK_CALL, (code, target.args)
+
         elif not isinstance (target, type):
             proxify = getattr (target, 'Proxy', None)
             if proxify is not None:
@@ -130,9 +205,29 @@ class Connection (object):
             return Sender (self.hub, args if args else self.sender.dst)
         elif pack == self.PACK_PROXY:
             return args
+        elif pack == self.PACK_BUFFER:
+            index, mutable = args
+            buffer = self.serializer.BufferGet (index)
+            return bytearray (buffer) if mutable else buffer
+        elif pack == self.PACK_CODE:
+            return self.unpack_code (*args)
+        elif pack == self.PACK_CALL:
+            code, args = args
+            return CodeCall (self.unpack_code (*code), args)
         else:
             raise ValueError ('Unknown pack type: {}'.format (pack))
 
+    def unpack_code (self, cid, ops):
+        """Unpack code object
+
+        Code sent by its id only may still be unpacked by preceding message
+        (i.g. its unpacking imports a module), then unpacking is interrupted
+        until preceding messages are unpacked.
+        """
+        if ops is None and self.unpacking > 1 and not self.codes.Received (cid):
+            raise InterruptError ()
+        return self.codes.Unpack (cid, ops)
+
     def unpack_name (self, modname, name):
         """Unpack global object by its module and name
         """
@@ -151,64 +246,92 @@ class Connection (object):
     #--------------------------------------------------------------------------#
     def handle (self, msg, src, dst):
         """Handle message
+
+        Returns packed message and list of its out-of-band buffers.
         """
         # just send it to remote peer
-        stream = io.BytesIO ()
-        self.pickler_type (stream, -1).dump ((msg, src, dst))
-        return stream.getvalue ()
+        try:
+            frame = self.serializer.Dump ((msg, src, dst))
+        except Exception:
+            self.codes.Rollback ()
+            raise
+        self.codes.Commit ()
+        return frame
 
     @Async
-    def dispatch (self, msg):
+    def dispatch (self, frame, buffers = None):
         """Dispatch incoming (packed) message
-        """
 
-        # Detachment from  current coroutine is vital here because if handler
-        # tries to create nested core loop to resolve future synchronously
-        # (i.g. importer proxy) it can block dispatching coroutine.
-        yield self.core.Idle ()
-
-        while True:
-            src = None
-            try:
-                msg, src, dst = self.unpickler_type (io.BytesIO (msg)).load ()
-                dst = dst - 1 # strip remote connection address
-
-                if dst:
-                    # After striping remote connection address, destination is not empty
-                    # so it needs to be routed.
-                    self.hub.Send (dst, msg, src)
-
-                else:
-                    # Message target is connection itself, execute code object
-                    if msg is None:
-                        self.Dispose ()
-                        return
-
-                    def conn_cont (result, error):
-                        if src is not None:
-                            if error is None:
-                                src.Send (Result ().SetResult (result))
-                            else:
-                                src.Send (Result ().SetError (error))
-                        elif error is not None:
-                            ResultPrintException (*error)
-
-                    msg (self).Then (conn_cont)
-                break
-
-            except InterruptError:
-                # Required module is being imported. Postpone message dispatch.
-                yield self.hub
-
-            except Exception:
-                error = sys.exc_info ()
-                ResultPrintException (*error)
-                if src is not None:
-                    # Optimistically send result even though it may expect
-                    # different kind of object (usually it isn't), but at least
-                    # it avoids blocking in some cases.
-                    src.Send (Result ().SetError (error))
-                raise
+        Frame can be a memory view into receive buffer, it is unpacked in-place
+        and released once dispatching is completed.
+        """
+        self.unpacking += 1
+        unpacking = True
+        try:
+            # Detachment from  current coroutine is vital here because if handler
+            # tries to create nested core loop to resolve future synchronously
+            # (i.g. importer proxy) it can block dispatching coroutine.
+            yield self.core.Idle ()
+
+            while True:
+                src = None
+                try:
+                    msg, src, dst = self.serializer.Load (frame, buffers)
+                    self.unpacking -= 1
+                    unpacking = False
+                    if self.unpacking:
+                        self.unpacked () # resume messages waiting for its codes
+                    dst = dst - 1 # strip remote connection address
+
+                    if dst:
+                        # After striping remote connection address, destination is not empty
+                        # so it needs to be routed.
+                        self.hub.Send (dst, msg, src)
+
+                    else:
+                        # Message target is connection itself, execute code object
+                        if msg is None:
+                            self.Dispose ()
+                            return
+
+                        def conn_cont (result, error):
+                            if src is not None:
+                                if error is None:
+                                    src.Send (Result ().SetResult (result))
+                                else:
+                                    src.Send (Result ().SetError (error))
+                            elif error is not None:
+                                ResultPrintException (*error)
+
+                        self.hub.Pending (src, msg (self)).Then (conn_cont)
+                    break
+
+                except InterruptError:
+                    # Required module is being imported, or required code is being
+                    # unpacked by preceding message. Postpone message dispatch.
+                    yield Future.Any ((self.hub.Await (), self.unpacked.Await ()))
+
+                except Exception:
+                    error = sys.exc_info ()
+                    ResultPrintException (*error)
+                    if src is not None:
+                        # Optimistically send result even though it may expect
+                        # different kind of object (usually it isn't), but at least
+                        # it avoids blocking in some cases.
+                        src.Send (Result ().SetError (error))
+                    raise
+
+        finally:
+            if unpacking:
+                self.unpacking -= 1
+                if self.unpacking:
+                    self.unpacked () # failed, waiting messages must not wait forever
+            release = getattr (frame, 'release', None)
+            if release is not None:
+                try:
+                    release ()
+                except BufferError:
+                    pass # frame is still referenced (i.g. by traceback)
 
     #--------------------------------------------------------------------------#
     # Awaitable                                                                #
@@ -234,6 +357,7 @@ class Connection (object):
         """
         if self.state (self.STATE_DISPOSED):
             self.receiver.Off (self.handle)
+            self.hub.Gate (self.sender.dst, None)
             self.disconnect ()
             self.dispose.Dispose ()
 
@@ -270,6 +394,12 @@ class ConnectionProxy (Proxy):
         """
         return Proxy (self.sender, LoadConstExpr (target))
 
+#------------------------------------------------------------------------------#
+# Helpers                                                                      #
+#------------------------------------------------------------------------------#
+buffer_types = (bytes, bytearray)
+ready_future = SucceededFuture (None)
+
 #------------------------------------------------------------------------------#
 # Interrupt Error                                                              #
 #------------------------------------------------------------------------------#
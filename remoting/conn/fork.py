@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
+import mmap
 
 from .stream import StreamConnection
-from ..importer import ImporterInstall
+from .shared import SharedRingPair, SharedMemoryFile
+from ..importer import ImporterInstall, ImporterCore
 from ...bootstrap import Tomb
-from ...async import Async, Core, Pipe, BufferedFile
+from ...async import Async, Core, Pipe, BufferedFile, CloseOnExecFD
 from ...process import Process, PIPE
+from ...disposable import Disposable
 
 __all__ = ('ForkConnection',)
 #------------------------------------------------------------------------------#
@@ -14,12 +18,30 @@ __all__ = ('ForkConnection',)
 class ForkConnection (StreamConnection):
     """Fork connection
 
-    Connection with forked and exec-ed process via two pipes.
+    Connection with forked and exec-ed process via two pipes. If ``bytecode``
+    is set, modules are sent to forked process precompiled. If ``lazy`` is set,
+    only modules required to establish connection are sent, and all others are
+    fetched on demand. If ``shared`` (size in bytes, or True for default size)
+    is set, large frames and buffers are passed via shared memory rings of this
+    size (rounded up to page size) in each direction instead of pipes (see
+    ``StreamConnection``). Modules
+    received by forked process are cached in ``cache`` (see ``ImporterInstall``),
+    False disables caching.
     """
-    def __init__ (self, command = None, buffer_size = None, hub = None, core = None):
+    default_shared_size = 1 << 26
+
+    def __init__ (self, command = None, buffer_size = None, hub = None, core = None,
+        bytecode = None, lazy = None, shared = None, cache = None):
         StreamConnection.__init__ (self, hub, core)
 
         self.buffer_size = buffer_size
+        self.bytecode = bytecode
+        self.lazy = lazy
+        self.cache = cache
+        self.shared = self.default_shared_size if shared is True else shared
+        if self.shared:
+            # second ring (and its header) must be page aligned
+            self.shared = -(-self.shared // mmap.PAGESIZE) * mmap.PAGESIZE
         self.command = [sys.executable, '-'] if command is None else command
         self.process = None
 
@@ -44,10 +66,20 @@ class ForkConnection (StreamConnection):
         in_pipe = self.dispose.Add (Pipe (buffer_size = self.buffer_size, core = self.core))
         out_pipe = self.dispose.Add (Pipe (buffer_size = self.buffer_size, core = self.core))
 
+        # shared memory
+        shared_fd = None
+        if self.shared:
+            shared_fd = SharedMemoryFile (self.shared * 2)
+            self.dispose.Add (Disposable (lambda: os.close (shared_fd)))
+            self.shared_in, self.shared_out = SharedRingPair (shared_fd, self.shared, True)
+            self.dispose.Add (Disposable (self.shared_in.memory.close))
+
         # process
         def preexec ():
             in_pipe.DetachReader ()
             out_pipe.DetachWriter ()
+            if shared_fd is not None:
+                CloseOnExecFD (shared_fd, False)
 
         self.process = self.dispose.Add (Process (self.command, stdin = PIPE, preexec = preexec,
             kill_delay = -1, buffer_size = self.buffer_size, core = self.core))
@@ -59,26 +91,29 @@ class ForkConnection (StreamConnection):
         yield out_pipe.Writer.Dispose ()
 
         # send payload
-        yield self.process.Stdin.Write (Tomb.FromModules ()
-            .Bootstrap (ForkConnectionInit, in_fd, out_fd, self.buffer_size).encode ())
+        yield self.process.Stdin.Write (Tomb.FromModules (bytecode = bool (self.bytecode),
+            lazy = ImporterCore () if self.lazy else None)
+            .Bootstrap (ForkConnectionInit, in_fd, out_fd, self.buffer_size, shared_fd, self.shared).encode ())
         yield self.process.Stdin.Dispose ()
 
         out_pipe.Reader.CloseOnExec (True)
         in_pipe.Writer.CloseOnExec (True)
         yield StreamConnection.connect (self, (out_pipe.Reader, in_pipe.Writer))
+        yield self.negotiate ()
 
         # install importer
-        self.dispose.Add ((yield ImporterInstall (self)))
+        self.dispose.Add ((yield ImporterInstall (self, cache = self.cache)))
 
     def disconnect (self):
         """Fork disconnect implementation
         """
+        StreamConnection.disconnect (self)
         self.dispose.Dispose ()
 
 #------------------------------------------------------------------------------#
 # Connection Initializer                                                       #
 #------------------------------------------------------------------------------#
-def ForkConnectionInit (in_fd, out_fd, buffer_size):
+def ForkConnectionInit (in_fd, out_fd, buffer_size, shared_fd = None, shared_size = None):
     """Fork connection initialization function
     """
     with Core.Instance () as core:
@@ -86,6 +121,14 @@ def ForkConnectionInit (in_fd, out_fd, buffer_size):
         conn = StreamConnection (core = core)
         conn.dispose.Add (core)
 
+        # shared memory
+        if shared_fd is not None:
+            try:
+                conn.shared_in, conn.shared_out = SharedRingPair (shared_fd, shared_size, False)
+            finally:
+                os.close (shared_fd)
+            conn.dispose.Add (Disposable (conn.shared_in.memory.close))
+
         # connect
         in_stream  = BufferedFile (in_fd, buffer_size = buffer_size, core = core)
         in_stream.CloseOnExec (True)
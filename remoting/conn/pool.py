@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+
+from .fork import ForkConnection
+from ..proxy import Proxy
+from ..expr import LoadConstExpr
+from ...async import Async, AsyncReturn, Future
+from ...disposable import Disposable, CompositeDisposable
+
+__all__ = ('ConnectionPool',)
+#------------------------------------------------------------------------------#
+# Connection Pool                                                              #
+#------------------------------------------------------------------------------#
+class ConnectionPool (object):
+    """Pool of connections
+
+    Pool keeps ``size`` connections created by ``factory`` (forked workers by
+    default). Each request sent to the pool is delivered to its least loaded
+    member, that is member with the smallest number of in-flight requests.
+    Members which are disposed (i.g. worker process died) are replaced.
+    """
+    def __init__ (self, factory = None, size = None, hub = None, core = None):
+        self.factory = factory or (lambda: ForkConnection (hub = hub, core = core))
+        self.size = size or multiprocessing.cpu_count ()
+
+        self.members = []
+        self.sender = PoolSender (self)
+        self.dispose = CompositeDisposable ()
+
+    #--------------------------------------------------------------------------#
+    # Call                                                                     #
+    #--------------------------------------------------------------------------#
+    def __call__ (self, target):
+        """Create proxy object from provided pickle-able constant.
+        """
+        return Proxy (self.sender, LoadConstExpr (target))
+
+    #--------------------------------------------------------------------------#
+    # Connect                                                                  #
+    #--------------------------------------------------------------------------#
+    @Async
+    def Connect (self):
+        """Connect all members of the pool
+        """
+        try:
+            yield Future.All ([self.spawn () for _ in range (self.size - len (self.members))])
+        except Exception:
+            self.Dispose ()
+            raise
+        AsyncReturn (self)
+
+    @property
+    def Members (self):
+        """Connected members of the pool
+        """
+        return tuple (member.conn for member in self.members)
+
+    @Async
+    def spawn (self):
+        """Create, connect and add new member to the pool
+        """
+        conn = self.dispose.Add (self.factory ())
+        try:
+            yield conn
+        except Exception:
+            if not self.dispose.IsDisposed ():
+                self.dispose.Remove (conn)
+            raise
+        if self.dispose.IsDisposed ():
+            return
+
+        member = PoolMember (conn)
+        self.members.append (member)
+        conn.dispose.Add (Disposable (lambda: self.dead (member)))
+
+    def dead (self, member):
+        """Remove disposed member and spawn its replacement
+        """
+        if member not in self.members:
+            return
+        self.members.remove (member)
+
+        if not self.dispose.IsDisposed ():
+            self.dispose.Remove (member.conn)
+            self.spawn ().Traceback ('ConnectionPool::spawn')
+
+    #--------------------------------------------------------------------------#
+    # Balance                                                                  #
+    #--------------------------------------------------------------------------#
+    def Least (self):
+        """Least loaded member of the pool
+        """
+        if not self.members:
+            raise ValueError ('Connection pool has no connected members')
+        return min (self.members, key = lambda member: member.load)
+
+    #--------------------------------------------------------------------------#
+    # Awaitable                                                                #
+    #--------------------------------------------------------------------------#
+    def Await (self):
+        """Get awaiter
+        """
+        return self.Connect ()
+
+    #--------------------------------------------------------------------------#
+    # Disposable                                                               #
+    #--------------------------------------------------------------------------#
+    def Dispose (self):
+        """Dispose pool and all its members
+        """
+        self.dispose.Dispose ()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, et, eo, tb):
+        self.Dispose ()
+        return False
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [size:{} load:{}] at {}>'.format (type (self).__name__, self.size,
+            [member.load for member in self.members], id (self))
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+#------------------------------------------------------------------------------#
+# Pool Member                                                                  #
+#------------------------------------------------------------------------------#
+class PoolMember (object):
+    """Connection with number of its in-flight requests
+    """
+    __slots__ = ('conn', 'load',)
+
+    def __init__ (self, conn):
+        self.conn = conn
+        self.load = 0
+
+#------------------------------------------------------------------------------#
+# Pool Sender                                                                  #
+#------------------------------------------------------------------------------#
+class PoolSender (object):
+    """Pool sender
+
+    Sends each message to the least loaded member of the pool.
+    """
+    __slots__ = ('pool',)
+
+    dst = None
+
+    def __init__ (self, pool):
+        self.pool = pool
+
+    #--------------------------------------------------------------------------#
+    # Send                                                                     #
+    #--------------------------------------------------------------------------#
+    def Send (self, msg, src = None):
+        """Send message
+        """
+        if msg is None:
+            return # pool is disposed only explicitly
+        self.pool.Least ().conn.sender.Send (msg, src)
+
+    def Ready (self):
+        """Get future resolved once least loaded member is ready
+        """
+        return self.pool.Least ().conn.sender.Ready ()
+
+    #--------------------------------------------------------------------------#
+    # Request                                                                  #
+    #--------------------------------------------------------------------------#
+    def Request (self, msg, cancel = None, timeout = None):
+        """Request
+        """
+        member = self.pool.Least ()
+        future = member.conn.sender.Request (msg, cancel, timeout)
+        if not future.IsCompleted ():
+            member.load += 1
+            def request_cont (result, error):
+                member.load -= 1
+            future.Then (request_cont)
+        return future
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [pool:{}]>'.format (type (self).__name__, self.pool)
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+# vim: nu ft=python columns=120 :
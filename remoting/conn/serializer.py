@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import io
+import pickle
+
+__all__ = ('Serializer', 'FrameReader',)
+#------------------------------------------------------------------------------#
+# Serializer                                                                   #
+#------------------------------------------------------------------------------#
+class Serializer (object):
+    """Connection scoped serializer
+
+    Pickler and buffers are created once and reused for every message. Reentrant
+    calls (i.g. pickling is requested while another object is being pickled)
+    fall back to freshly created pickler or reader.
+
+    Large buffers can be carried out-of-band: pickler replaces them with index
+    returned by ``BufferPut``, and they are returned along with the frame by
+    ``Dump``. Buffers passed to ``Load`` are available with ``BufferGet``.
+    """
+    # Protocol used until peers agree on better one, understood by both python
+    # versions.
+    default_protocol = min (2, pickle.HIGHEST_PROTOCOL)
+
+    def __init__ (self, pickler_type, unpickler_type, protocol = None):
+        self.pickler_type = pickler_type
+        self.unpickler_type = unpickler_type
+        self.protocol = self.default_protocol if protocol is None else protocol
+
+        self.dump_stream = io.BytesIO ()
+        self.dump_pickler = None
+        self.dump_busy = False
+        self.dump_buffers = None
+
+        self.load_stream = FrameReader ()
+        self.load_busy = False
+        self.load_buffers = None
+
+    #--------------------------------------------------------------------------#
+    # Protocol                                                                 #
+    #--------------------------------------------------------------------------#
+    def Protocol (self, protocol = None):
+        """Get or set pickle protocol used by serializer
+        """
+        if protocol is None:
+            return self.protocol
+        elif protocol > pickle.HIGHEST_PROTOCOL:
+            raise ValueError ('Unsupported pickle protocol: {}'.format (protocol))
+
+        self.protocol = protocol
+        self.dump_pickler = None
+        return protocol
+
+    #--------------------------------------------------------------------------#
+    # Dump                                                                     #
+    #--------------------------------------------------------------------------#
+    def Dump (self, target):
+        """Serialize target object
+
+        Returns frame bytes and list of out-of-band buffers.
+        """
+        buffers, self.dump_buffers = self.dump_buffers, []
+        try:
+            if self.dump_busy:
+                stream = io.BytesIO ()
+                self.pickler_type (stream, self.protocol).dump (target)
+                return stream.getvalue (), self.dump_buffers
+
+            self.dump_busy = True
+            try:
+                stream, pickler = self.dump_stream, self.dump_pickler
+                if pickler is None:
+                    pickler = self.pickler_type (stream, self.protocol)
+                    self.dump_pickler = pickler
+
+                stream.seek (0)
+                stream.truncate ()
+                try:
+                    pickler.dump (target)
+                except Exception:
+                    # pickler state is unknown at this point
+                    self.dump_pickler = None
+                    raise
+                finally:
+                    pickler.clear_memo ()
+                return stream.getvalue (), self.dump_buffers
+
+            finally:
+                self.dump_busy = False
+
+        finally:
+            self.dump_buffers = buffers
+
+    def BufferPut (self, buffer):
+        """Carry buffer out-of-band of the frame being dumped
+
+        Returns index of the buffer.
+        """
+        self.dump_buffers.append (buffer)
+        return len (self.dump_buffers) - 1
+
+    #--------------------------------------------------------------------------#
+    # Load                                                                     #
+    #--------------------------------------------------------------------------#
+    def Load (self, data, buffers = None):
+        """Deserialize object from frame and its out-of-band buffers
+
+        Data can be any object supporting buffer protocol (i.g. memory view
+        into received batch), it is read in-place without being copied.
+
+        Unpickler is created per message, as unpickler memo cannot be reset
+        between messages for protocols with implicit memo indices (4 and above).
+        """
+        buffers, self.load_buffers = self.load_buffers, buffers
+        try:
+            if self.load_busy:
+                return self.unpickler_type (FrameReader (data)).load ()
+
+            self.load_busy = True
+            try:
+                stream = self.load_stream
+                stream.Reset (data)
+                return self.unpickler_type (stream).load ()
+            finally:
+                stream.Reset ()
+                self.load_busy = False
+
+        finally:
+            self.load_buffers = buffers
+
+    def BufferGet (self, index):
+        """Get out-of-band buffer of the frame being loaded
+        """
+        if not self.load_buffers or index >= len (self.load_buffers):
+            raise ValueError ('Out-of-band buffer is missing: {}'.format (index))
+        return self.load_buffers [index]
+
+#------------------------------------------------------------------------------#
+# Frame Reader                                                                 #
+#------------------------------------------------------------------------------#
+class FrameReader (object):
+    """Frame reader
+
+    Read only file-like object over memory view of the frame. Only requested
+    parts of the frame are copied, and with ``readinto`` large objects are
+    copied straight to their destination buffer.
+    """
+    __slots__ = ('view', 'offset',)
+
+    line_chunk = 128
+
+    def __init__ (self, data = None):
+        self.Reset (data)
+
+    def Reset (self, data = None):
+        """Reset reader with new frame data
+        """
+        self.view = None if data is None else memoryview (data)
+        self.offset = 0
+
+    #--------------------------------------------------------------------------#
+    # File Interface                                                           #
+    #--------------------------------------------------------------------------#
+    def read (self, size = -1):
+        """Read at most size bytes
+        """
+        offset = self.offset
+        if size < 0:
+            self.offset = len (self.view)
+            return self.view [offset:].tobytes ()
+        else:
+            data = self.view [offset:offset + size].tobytes ()
+            self.offset = offset + len (data)
+            return data
+
+    def readinto (self, buffer):
+        """Read bytes into pre-allocated buffer
+        """
+        offset = self.offset
+        size = min (len (buffer), len (self.view) - offset)
+        memoryview (buffer) [:size] = self.view [offset:offset + size]
+        self.offset = offset + size
+        return size
+
+    def readline (self):
+        """Read bytes until new line (inclusive)
+        """
+        start, end = self.offset, len (self.view)
+        offset = start
+        while offset < end:
+            chunk = self.view [offset:offset + self.line_chunk].tobytes ()
+            index = chunk.find (b'\n')
+            if index >= 0:
+                offset += index + 1
+                break
+            offset += len (chunk)
+        self.offset = offset
+        return self.view [start:offset].tobytes ()
+
+# vim: nu ft=python columns=120 :
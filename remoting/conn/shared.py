@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import mmap
+import struct
+import tempfile
+if sys.version_info [0] > 2:
+    data_view = memoryview
+else:
+    data_view = buffer # mmap of python 2 can not be written with bytearray
+
+__all__ = ('SharedRing', 'SharedRingPair', 'SharedMemoryFile',)
+#------------------------------------------------------------------------------#
+# Shared Ring                                                                  #
+#------------------------------------------------------------------------------#
+class SharedRing (object):
+    """Single producer single consumer ring buffer in shared memory
+
+    Ring occupies ``size`` bytes of memory map starting at ``offset``, header
+    holding consumer position is followed by data. Consumer learns about
+    written data from notifications sent by other means (i.g. pipe), so only
+    consumer position is shared, and producer keeps its position itself.
+    Data which does not fit into free space of the ring is not written, and
+    must be sent by other means.
+    """
+    header = struct.Struct ('Q') # consumer position
+
+    def __init__ (self, memory, offset, size):
+        if size <= self.header.size:
+            raise ValueError ('Shared ring is too small: {}'.format (size))
+
+        self.memory = memory
+        self.offset = offset
+        self.data_offset = offset + self.header.size
+        self.capacity = size - self.header.size
+        self.position = 0 # producer or consumer position
+
+    #--------------------------------------------------------------------------#
+    # Producer                                                                 #
+    #--------------------------------------------------------------------------#
+    def Write (self, data):
+        """Write data if it fits into free space of the ring
+
+        Returns True if data has been written.
+        """
+        size = len (data)
+        head, = self.header.unpack_from (self.memory, self.offset)
+        if size > self.capacity - (self.position - head):
+            return False
+
+        start = self.position % self.capacity
+        first = self.capacity - start
+        data = data_view (data)
+        self.memory.seek (self.data_offset + start)
+        if size <= first:
+            self.memory.write (data)
+        else:
+            self.memory.write (data [:first])
+            self.memory.seek (self.data_offset)
+            self.memory.write (data [first:])
+        self.position += size
+        return True
+
+    #--------------------------------------------------------------------------#
+    # Consumer                                                                 #
+    #--------------------------------------------------------------------------#
+    def Read (self, size):
+        """Read size bytes written by producer
+
+        Space of read data is released to producer.
+        """
+        start = self.data_offset + self.position % self.capacity
+        first = self.data_offset + self.capacity - start
+        if size <= first:
+            data = self.memory [start:start + size]
+        else:
+            data = self.memory [start:start + first] + self.memory [self.data_offset:self.data_offset + size - first]
+        self.position += size
+        self.header.pack_into (self.memory, self.offset, self.position)
+        return data
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [capacity:{} position:{}] at {}>'.format (type (self).__name__,
+            self.capacity, self.position, id (self))
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+#------------------------------------------------------------------------------#
+# Shared Ring Pair                                                             #
+#------------------------------------------------------------------------------#
+def SharedRingPair (fd, size, initiator):
+    """Map rings of both directions from shared memory file
+
+    File must be at least ``size * 2`` bytes long, first ring carries data of
+    initiator. Size must be a multiple of 8, so header of the second ring is
+    aligned. Returns incoming and outgoing rings, descriptor can be closed
+    once rings are created.
+    """
+    if size % SharedRing.header.size:
+        raise ValueError ('Shared ring size is not aligned: {}'.format (size))
+    memory = mmap.mmap (fd, size * 2)
+    first, second = SharedRing (memory, 0, size), SharedRing (memory, size, size)
+    return (second, first) if initiator else (first, second)
+
+def SharedMemoryFile (size):
+    """Create already unlinked file backing shared memory
+
+    File is created in memory file system if it is available. Returns its
+    descriptor.
+    """
+    fd, path = tempfile.mkstemp (prefix = 'pretzel-', dir = '/dev/shm' if os.path.isdir ('/dev/shm') else None)
+    try:
+        os.unlink (path)
+        os.ftruncate (fd, size)
+    except Exception:
+        os.close (fd)
+        raise
+    return fd
+
+# vim: nu ft=python columns=120 :
@@ -4,10 +4,11 @@ import os
 import sys
 import zlib
 import struct
+import hashlib
 import binascii
 
 from .stream import StreamConnection
-from ..importer import ImporterInstall
+from ..importer import ImporterInstall, ImporterCore
 from ...bootstrap import Tomb
 from ...async import Async, Core, CloseOnExecFD, BufferedFile
 from ...process import Process, PIPE
@@ -21,19 +22,29 @@ class ShellConnection (StreamConnection):
 
     Connection with process over standard output and input, error stream
     is untouched.
+
+    Bootstrap payload is cached by remote peer in per-user cache directory
+    under its content hash, and is only sent if remote peer has not cached it
+    yet (see ``Cached``). If ``lazy`` is set, payload contains only modules
+    required to establish connection, and all others are fetched on demand.
+    Modules received by remote peer are cached in ``cache`` (see
+    ``ImporterInstall``), False disables caching.
     """
     def __init__ (self, command = None, escape = None, py_exec = None,
-        buffer_size = None, hub = None, core = None):
+        buffer_size = None, hub = None, core = None, compress = None, lazy = None, cache = None):
 
-        StreamConnection.__init__ (self, hub, core)
+        StreamConnection.__init__ (self, hub, core, compress = compress)
 
         self.buffer_size = buffer_size
+        self.lazy = lazy
+        self.cache = cache
         self.py_exec = py_exec or sys.executable
         self.command = command or []
         self.command.extend ((self.py_exec, '-c',
             '\'{}\''.format (ShellConnectionTrampoline) if escape else ShellConnectionTrampoline))
 
         self.process = None
+        self.cached = None
 
     #--------------------------------------------------------------------------#
     # Process                                                                  #
@@ -42,6 +53,12 @@ class ShellConnection (StreamConnection):
     def Process (self):
         return self.process
 
+    @property
+    def Cached (self):
+        """Whether bootstrap payload was found in remote peer cache
+        """
+        return self.cached
+
     #--------------------------------------------------------------------------#
     # Protected                                                                #
     #--------------------------------------------------------------------------#
@@ -56,16 +73,22 @@ class ShellConnection (StreamConnection):
             kill_delay = -1, buffer_size = self.buffer_size, core = self.core))
 
         # send payload
-        payload = Tomb.FromModules ().Bootstrap (
+        payload = Tomb.FromModules (lazy = ImporterCore () if self.lazy else None).Bootstrap (
             ShellConnectionInit, self.buffer_size).encode ('utf-8')
-        yield self.process.Stdin.Write (struct.pack ('>I', len (payload)))
-        yield self.process.Stdin.Write (payload)
+        yield self.process.Stdin.Write (hashlib.sha256 (payload).digest ())
         yield self.process.Stdin.Flush ()
 
+        self.cached = (yield self.process.Stdout.ReadUntilSize (1)) == b'\x01'
+        if not self.cached:
+            yield self.process.Stdin.Write (struct.pack ('>I', len (payload)))
+            yield self.process.Stdin.Write (payload)
+            yield self.process.Stdin.Flush ()
+
         yield StreamConnection.connect (self, (self.process.Stdout, self.process.Stdin))
+        yield self.negotiate ()
 
         # install importer
-        self.dispose.Add ((yield ImporterInstall (self)))
+        self.dispose.Add ((yield ImporterInstall (self, cache = self.cache)))
 
 #------------------------------------------------------------------------------#
 # Connection Initializer                                                       #
@@ -98,17 +121,51 @@ def ShellConnectionInit (buffer_size):
 # Trampoline                                                                   #
 #------------------------------------------------------------------------------#
 trampoline_source = binascii.b2a_base64 (zlib.compress (b"""
-# load and execute payload
-import io, struct
-with io.open (0, "rb", buffering = 0, closefd = False) as stream:
-    size = struct.unpack (">I", stream.read (struct.calcsize (">I"))) [0]
+# load (from cache if possible) and execute payload
+import io, os, struct, hashlib
+def read (stream, size):
     data = io.BytesIO ()
     while size > data.tell ():
         chunk = stream.read (size - data.tell ())
         if not chunk:
             raise ValueError ("Payload is incomplete")
         data.write (chunk)
-exec (data.getvalue ().decode ("utf-8"))
+    return data.getvalue ()
+
+with io.open (0, "rb", buffering = 0, closefd = False) as stream:
+    digest = read (stream, 32)
+    cache = os.path.join (os.environ.get ("XDG_CACHE_HOME") or os.path.expanduser ("~/.cache"), "pretzel")
+    path = os.path.join (cache, binascii.hexlify (digest).decode ())
+    try:
+        with io.open (path, "rb") as file:
+            payload = file.read ()
+        if hashlib.sha256 (payload).digest () != digest:
+            payload = None
+        else:
+            os.utime (path, None)
+    except (IOError, OSError):
+        payload = None
+    os.write (1, b"\\x00" if payload is None else b"\\x01")
+
+    if payload is None:
+        payload = read (stream, struct.unpack (">I", read (stream, 4)) [0])
+        if hashlib.sha256 (payload).digest () != digest:
+            raise ValueError ("Payload is corrupted")
+        try:
+            if not os.path.isdir (cache):
+                os.makedirs (cache, 0o700)
+            temp = "{}.{}".format (path, os.getpid ())
+            with io.open (temp, "wb") as file:
+                file.write (payload)
+            os.rename (temp, path)
+            # keep only recently used payloads
+            entries = [os.path.join (cache, entry) for entry in os.listdir (cache)]
+            entries = [entry for entry in entries if os.path.isfile (entry)]
+            for entry in sorted (entries, key = os.path.getmtime) [:-16]:
+                os.unlink (entry)
+        except (IOError, OSError):
+            pass
+exec (payload.decode ("utf-8"))
 """)).strip ().decode ()
 
 ShellConnectionTrampoline = 'import zlib,binascii;exec(zlib.decompress(binascii.a2b_base64(b"{}")))'.format (trampoline_source)
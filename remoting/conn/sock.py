@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+import os
+import hmac
+import stat
+import errno
+import socket
+import hashlib
+
+from .stream import StreamConnection
+from ...async import (Async, AsyncReturn, Core, BufferedFile, CloseOnExecFD, FutureCanceled,
+                      POLL_READ, POLL_WRITE)
+from ...disposable import Disposable, CompositeDisposable
+
+__all__ = ('SocketConnection', 'SocketListener', 'SocketServe', 'SocketSecretPath',)
+#------------------------------------------------------------------------------#
+# Socket Connection                                                            #
+#------------------------------------------------------------------------------#
+class SocketConnection (StreamConnection):
+    """Socket connection
+
+    Connection with process serving socket listener (see ``SocketListener``).
+    Address is either a path of unix domain socket or a (host, port) pair of
+    tcp socket. Importer is not installed as server process is shared between
+    its clients, so modules of sent functions must be importable by server.
+    Peers of tcp connection authenticate each other with ``secret``, which is
+    read from the file created by listener (see ``SocketSecretPath``) if it is
+    not provided.
+    """
+    def __init__ (self, address, buffer_size = None, hub = None, core = None, secret = None, **keys):
+        StreamConnection.__init__ (self, hub, core, **keys)
+
+        self.address = address
+        self.buffer_size = buffer_size
+        self.secret = secret
+
+    #--------------------------------------------------------------------------#
+    # Protected                                                                #
+    #--------------------------------------------------------------------------#
+    @Async
+    def connect (self, target):
+        """Socket connect implementation
+        """
+        sock = socket.socket (socket_family (self.address), socket.SOCK_STREAM)
+        try:
+            sock.setblocking (False)
+            error = sock.connect_ex (self.address)
+            if error == errno.EINPROGRESS:
+                try:
+                    yield self.core.Poll (sock.fileno (), POLL_WRITE)
+                finally:
+                    self.core.Poll (sock.fileno (), None)
+                error = sock.getsockopt (socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise socket.error (error, os.strerror (error))
+            fd = os.dup (sock.fileno ())
+        finally:
+            sock.close ()
+
+        streams = socket_streams (fd, self.buffer_size, self.core, self.dispose)
+        secret = self.secret
+        if secret is None and socket_family (self.address) != socket.AF_UNIX:
+            with open (SocketSecretPath (self.address), 'rb') as file:
+                secret = file.read ()
+        if secret is not None:
+            yield socket_auth (streams, secret, False)
+
+        yield StreamConnection.connect (self, streams)
+        yield self.negotiate ()
+
+    def disconnect (self):
+        """Socket disconnect implementation
+        """
+        StreamConnection.disconnect (self)
+        self.dispose.Dispose ()
+
+#------------------------------------------------------------------------------#
+# Socket Listener                                                              #
+#------------------------------------------------------------------------------#
+class SocketListener (object):
+    """Socket listener
+
+    Accepts socket connections (see ``SocketConnection``) and serves each of
+    them in this process, so long-lived process can serve many short-lived
+    clients. Address is either a path of unix domain socket (accessible only
+    by its owner), or a (host, port) pair of tcp socket. Anyone who is able
+    to connect can execute arbitrary code, so tcp listener can only be bound
+    to loopback address (127.0.0.0/8 or ::1), and its peers must prove they
+    know ``secret``. If secret is not provided for tcp listener, random one
+    is generated and stored in the file accessible only by its owner (see
+    ``SocketSecretPath``), which is removed once listener is disposed.
+    """
+    default_backlog = 64
+    secret_size = 32
+
+    def __init__ (self, address, buffer_size = None, hub = None, core = None, backlog = None,
+        secret = None, **keys):
+
+        self.address = address
+        self.buffer_size = buffer_size
+        self.hub = hub
+        self.core = core or Core.Instance ()
+        self.backlog = backlog or self.default_backlog
+        self.secret = secret
+        self.keys = keys
+
+        self.sock = None
+        self.conns = []
+        self.dispose = CompositeDisposable ()
+
+    #--------------------------------------------------------------------------#
+    # Properties                                                               #
+    #--------------------------------------------------------------------------#
+    @property
+    def Address (self):
+        """Bound address (i.g. with actual port if port zero was requested)
+        """
+        return self.address if self.sock is None else self.sock.getsockname ()
+
+    @property
+    def Connections (self):
+        """Served connections
+        """
+        return tuple (self.conns)
+
+    #--------------------------------------------------------------------------#
+    # Listen                                                                   #
+    #--------------------------------------------------------------------------#
+    @Async
+    def Listen (self):
+        """Start listening
+        """
+        if self.sock is not None:
+            raise ValueError ('Listener is already listening')
+
+        family = socket_family (self.address)
+        if family != socket.AF_UNIX and not socket_loopback (self.address [0]):
+            raise ValueError ('Listener must be bound to loopback address: {}'.format (self.address [0]))
+
+        sock = socket.socket (family, socket.SOCK_STREAM)
+        try:
+            CloseOnExecFD (sock.fileno ())
+            if family == socket.AF_UNIX:
+                socket_unlink_stale (self.address)
+                umask = os.umask (0o177)
+                try:
+                    sock.bind (self.address)
+                finally:
+                    os.umask (umask)
+                self.dispose.Add (Disposable (self.unlink))
+            else:
+                sock.setsockopt (socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind (self.address)
+                if self.secret is None:
+                    self.secret = os.urandom (self.secret_size)
+                    path = SocketSecretPath (sock.getsockname ())
+                    socket_secret_store (path, self.secret)
+                    self.dispose.Add (Disposable (lambda: socket_unlink (path)))
+            sock.listen (self.backlog)
+            sock.setblocking (False)
+        except Exception:
+            sock.close ()
+            self.Dispose ()
+            raise
+
+        self.sock = sock
+        self.dispose.Add (Disposable (sock.close))
+        self.accept_coroutine ().Traceback ('SocketListener::accept_coroutine')
+        AsyncReturn (self)
+
+    @Async
+    def accept_coroutine (self):
+        """Accept incoming connections
+        """
+        fd = self.sock.fileno ()
+        try:
+            while self.sock is not None:
+                yield self.core.Poll (fd, POLL_READ)
+                while self.sock is not None:
+                    try:
+                        client, _ = self.sock.accept ()
+                    except socket.error as error:
+                        if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                            break
+                        elif error.errno in (errno.ECONNABORTED, errno.EINTR):
+                            continue
+                        raise
+                    try:
+                        client_fd = os.dup (client.fileno ())
+                    finally:
+                        client.close ()
+                    self.serve (client_fd).Traceback ('SocketListener::serve')
+
+        except FutureCanceled: pass
+        finally:
+            self.Dispose ()
+
+    @Async
+    def serve (self, fd):
+        """Serve accepted connection
+        """
+        conn = StreamConnection (self.hub, self.core, **self.keys)
+        self.dispose.Add (conn)
+        self.conns.append (conn)
+        def dispose ():
+            self.conns.remove (conn)
+            if not self.dispose.IsDisposed ():
+                self.dispose.Remove (conn)
+        conn.dispose.Add (Disposable (dispose))
+
+        streams = socket_streams (fd, self.buffer_size, self.core, conn.dispose)
+        if self.secret is not None:
+            try:
+                yield socket_auth (streams, self.secret, True)
+            except Exception:
+                conn.Dispose () # unauthenticated peer is silently dropped
+                return
+        yield conn.Connect (streams)
+
+    def unlink (self):
+        """Remove unix domain socket
+        """
+        socket_unlink (self.address)
+
+    #--------------------------------------------------------------------------#
+    # Awaitable                                                                #
+    #--------------------------------------------------------------------------#
+    def Await (self):
+        """Get awaiter
+        """
+        return self.Listen ()
+
+    #--------------------------------------------------------------------------#
+    # Disposable                                                               #
+    #--------------------------------------------------------------------------#
+    def Dispose (self):
+        """Stop listening and dispose served connections
+        """
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            self.core.Poll (sock.fileno (), None) # resolves accept coroutine
+        self.dispose.Dispose ()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, et, eo, tb):
+        self.Dispose ()
+        return False
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [addr:{} conns:{}] at {}>'.format (type (self).__name__,
+            self.Address, len (self.conns), id (self))
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+#------------------------------------------------------------------------------#
+# Socket Serve                                                                 #
+#------------------------------------------------------------------------------#
+def SocketServe (address, buffer_size = None, secret = None):
+    """Serve socket connections until process is terminated
+    """
+    with Core.Instance () as core:
+        listener = SocketListener (address, buffer_size = buffer_size, core = core, secret = secret)
+        listener.Listen ().Traceback ('SocketServe')
+        if not core.Disposed:
+            core ()
+
+#------------------------------------------------------------------------------#
+# Socket Secret                                                                #
+#------------------------------------------------------------------------------#
+def SocketSecretPath (address):
+    """Path of the file with secret of tcp listener bound to address
+
+    File is stored in per-user cache directory, so it is shared by listener
+    and connections of the same user.
+    """
+    host, port = address [:2]
+    return os.path.join (os.environ.get ('XDG_CACHE_HOME') or os.path.expanduser ('~/.cache'),
+        'pretzel', 'socket', '{}-{}'.format (host, port))
+
+def socket_secret_store (path, secret):
+    """Store secret in the file accessible only by its owner
+    """
+    dirname = os.path.dirname (path)
+    if not os.path.isdir (dirname):
+        os.makedirs (dirname, 0o700)
+    socket_unlink (path) # file of other owner or mode must not be reused
+    fd = os.open (path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen (fd, 'wb') as file:
+        file.write (secret)
+
+@Async
+def socket_auth (streams, secret, server):
+    """Mutual authentication of socket peers
+
+    Each peer sends random challenge, and proves that it knows secret with
+    HMAC of the challenge received from other peer. Raises ``ValueError`` if
+    other peer fails to prove it.
+    """
+    in_stream, out_stream = streams
+    size = hashlib.sha256 ().digest_size
+    def digest (role, challenge):
+        return hmac.new (secret, role + challenge, hashlib.sha256).digest ()
+
+    role, peer_role = (b'server', b'client') if server else (b'client', b'server')
+
+    challenge = os.urandom (size)
+    yield out_stream.Write (challenge)
+    yield out_stream.Flush ()
+
+    peer_challenge = yield in_stream.ReadUntilSize (size)
+    yield out_stream.Write (digest (role, peer_challenge))
+    yield out_stream.Flush ()
+
+    peer_digest = yield in_stream.ReadUntilSize (size)
+    if not hmac.compare_digest (peer_digest, digest (peer_role, challenge)):
+        raise ValueError ('Socket peer has failed to authenticate')
+
+#------------------------------------------------------------------------------#
+# Helpers                                                                      #
+#------------------------------------------------------------------------------#
+def socket_family (address):
+    """Socket family of address
+    """
+    return socket.AF_INET6 if isinstance (address, tuple) and ':' in address [0] else \
+           socket.AF_INET if isinstance (address, tuple) else socket.AF_UNIX
+
+def socket_loopback (host):
+    """Whether host is a numeric loopback address (127.0.0.0/8 or ::1)
+    """
+    try:
+        return socket.inet_pton (socket.AF_INET, host) [:1] == b'\x7f'
+    except (socket.error, ValueError, TypeError): pass
+    try:
+        return socket.inet_pton (socket.AF_INET6, host) == socket.inet_pton (socket.AF_INET6, '::1')
+    except (socket.error, ValueError, TypeError):
+        return False
+
+def socket_unlink (path):
+    """Remove file if it exists
+    """
+    try:
+        os.unlink (path)
+    except OSError: pass
+
+def socket_unlink_stale (path):
+    """Remove unix domain socket left by dead listener
+
+    Socket is removed only if connection to it is refused, otherwise address
+    in use error is raised as socket may be served by live listener.
+    """
+    try:
+        if not stat.S_ISSOCK (os.stat (path).st_mode):
+            return
+    except OSError:
+        return
+
+    probe = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.setblocking (False)
+        error = probe.connect_ex (path)
+    finally:
+        probe.close ()
+
+    if error == errno.ECONNREFUSED:
+        socket_unlink (path)
+    elif error != errno.ENOENT:
+        raise socket.error (errno.EADDRINUSE, '{}: {}'.format (os.strerror (errno.EADDRINUSE), path))
+
+def socket_streams (fd, buffer_size, core, dispose):
+    """Create input and output streams of connected socket descriptor
+    """
+    in_stream = dispose.Add (BufferedFile (fd, buffer_size = buffer_size, core = core))
+    in_stream.CloseOnExec (True)
+    out_stream = dispose.Add (BufferedFile (os.dup (fd), buffer_size = buffer_size, core = core))
+    out_stream.CloseOnExec (True)
+    return in_stream, out_stream
+
+# vim: nu ft=python columns=120 :
@@ -8,9 +8,14 @@ __all__ = ('SSHConnection',)
 #------------------------------------------------------------------------------#
 class SSHConnection (ShellConnection):
     """SSH Connection
+
+    If ``compress`` (zlib compression level) is set, large frames are compressed
+    in both directions. If ``lazy`` is set, only modules required to establish
+    connection are sent with bootstrap payload.
     """
     def __init__ (self, host, port = None, identity_file = None, ssh_exec = None,
-        py_exec = None, buffer_size = None, hub = None, core = None):
+        py_exec = None, buffer_size = None, hub = None, core = None, compress = None,
+        lazy = None):
 
         self.host = host
         self.port = port
@@ -27,6 +32,6 @@ class SSHConnection (ShellConnection):
         command.extend (('-i', self.identity_file) if self.identity_file else [])
         command.extend (('-p', self.port)          if self.port          else [])
 
-        ShellConnection.__init__ (self, command, True, py_exec, buffer_size, hub, core)
+        ShellConnection.__init__ (self, command, True, py_exec, buffer_size, hub, core, compress, lazy)
 
 # vim: nu ft=python columns=120 :
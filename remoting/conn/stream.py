@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
-from .conn import Connection
-from ...async import Async, DummyAsync, FutureCanceled, BrokenPipeError
+import struct
+
+from .compress import Compressor
+from .conn import Connection, ready_future
+from ...async import Async, DummyAsync, FutureSourcePair, FutureCanceled, BrokenPipeError
 
 __all__ = ('StreamConnection',)
 #------------------------------------------------------------------------------#
@@ -8,13 +11,64 @@ __all__ = ('StreamConnection',)
 #------------------------------------------------------------------------------#
 class StreamConnection (Connection):
     """Asynchronous stream based connected
+
+    Messages produced during single core iteration are coalesced into one batch
+    which is written to output stream and flushed at once. Batch is flushed
+    earlier if its size exceeds ``batch_size`` bytes. If ``batch_delay`` (in
+    seconds) is set, batch is held for this period of time instead of single
+    core iteration.
+
+    If ``compress`` level is set, connection initiator asks remote peer to
+    compress large frames (in both directions) with zlib.
+
+    Bytes like objects larger than ``buffer_threshold`` are written to output
+    stream out-of-band right after the batch containing their frame, so they
+    are neither copied into the frame nor into the batch.
+
+    Connection is not ready (see ``Ready``) once amount of data written but
+    not yet flushed to output stream reaches ``high_watermark`` bytes, until it
+    drops to ``low_watermark`` bytes.
+
+    If shared memory rings are set (see ``SharedRing``), frames larger than
+    ``shared_threshold`` bytes and out-of-band buffers are written to outgoing
+    ring (as long as they fit into it), and only their sizes are written to
+    output stream.
     """
-    def __init__ (self, hub = None, core = None):
+    buffer_threshold       = 1 << 18
+    shared_threshold       = 1 << 16
+    default_batch_size     = 1 << 16
+    default_batch_delay    = 0
+    default_high_watermark = 1 << 24
+    default_low_watermark  = 1 << 22
+
+    def __init__ (self, hub = None, core = None, batch_size = None, batch_delay = None,
+        compress = None, high_watermark = None, low_watermark = None):
         Connection.__init__ (self, hub, core)
 
         self.in_stream = None
         self.out_stream = None
 
+        # batch
+        self.batch = []
+        self.batch_length = 0
+        self.batch_size = batch_size or self.default_batch_size
+        self.batch_delay = batch_delay or self.default_batch_delay
+        self.batch_future = None
+
+        # compression
+        self.compress = compress
+        self.compressor = Compressor ()
+
+        # pressure
+        self.pending = 0
+        self.high_watermark = high_watermark or self.default_high_watermark
+        self.low_watermark = low_watermark or self.default_low_watermark
+        self.ready, self.ready_source = ready_future, None
+
+        # shared memory rings
+        self.shared_in = None
+        self.shared_out = None
+
     #--------------------------------------------------------------------------#
     # Implementation                                                           #
     #--------------------------------------------------------------------------#
@@ -32,13 +86,36 @@ class StreamConnection (Connection):
                 if self.in_stream.Disposed:
                     return
 
-                # Begin read next message before dispatching current one, as
+                # Begin read next batch before dispatching current one, as
                 # connection may be closed during dispatching and input stream
                 # became disposed.
-                msg_next = self.in_stream.BytesRead ()
+                batch_next = self.in_stream.BytesRead ()
                 while True:
-                    msg, msg_next = (yield msg_next), self.in_stream.BytesRead ()
-                    self.dispatch (msg)
+                    frames = []
+                    for flags, frame in BatchFrames ((yield batch_next)):
+                        buffers = None
+                        if flags & FRAME_BUFFERS:
+                            count, = buffer_struct.unpack_from (frame)
+                            frame = frame [buffer_struct.size:]
+                        if flags & FRAME_SHARED:
+                            # frame is read before its buffers, in order it was written to the ring
+                            frame = self.shared_in.Read (buffer_struct.unpack_from (frame) [0])
+                        if flags & FRAME_BUFFERS:
+                            # out-of-band buffers follow the batch
+                            buffers = []
+                            for _ in range (count):
+                                size, = buffer_struct.unpack ((yield self.in_stream.ReadUntilSize (buffer_struct.size)))
+                                if size & BUFFER_SHARED:
+                                    buffers.append (self.shared_in.Read (size & ~BUFFER_SHARED))
+                                else:
+                                    buffers.append ((yield self.in_stream.ReadUntilSize (size)))
+                        if flags & FRAME_COMPRESSED:
+                            frame = self.compressor.Decompress (frame)
+                        frames.append ((frame, buffers))
+
+                    batch_next = self.in_stream.BytesRead ()
+                    for frame, buffers in frames:
+                        self.dispatch (frame, buffers)
 
             except (FutureCanceled, BrokenPipeError): pass
             finally:
@@ -50,6 +127,10 @@ class StreamConnection (Connection):
     def disconnect (self):
         """Disconnect implementation
         """
+        self.flush ()
+        if self.ready_source is not None:
+            self.ready_source.TrySetResult (None)
+            self.ready, self.ready_source = ready_future, None
         if self.in_stream is not None:
             self.in_stream.Dispose ()
         if self.out_stream is not None:
@@ -58,8 +139,155 @@ class StreamConnection (Connection):
     def handle (self, msg, src, dst):
         """Send message implementation
         """
-        self.out_stream.BytesWriteBuffer (Connection.handle (self, msg, src, dst))
-        self.out_stream.Flush ()
+        (frame, buffers), flags = Connection.handle (self, msg, src, dst), 0
+        frame_compressed = self.compressor.Compress (frame)
+        if frame_compressed is not None:
+            frame, flags = frame_compressed, FRAME_COMPRESSED
+        if (self.shared_out is not None and len (frame) >= self.shared_threshold and
+            self.shared_out.Write (frame)):
+            frame, flags = buffer_struct.pack (len (frame)), flags | FRAME_SHARED
+
+        if buffers:
+            # frame is prefixed with number of buffers
+            count = buffer_struct.pack (len (buffers))
+            flags |= FRAME_BUFFERS
+            self.batch.append (frame_struct.pack (len (count) + len (frame), flags))
+            self.batch.extend ((count, frame))
+            self.flush (buffers)
+            return True
+
+        self.batch.append (frame_struct.pack (len (frame), flags))
+        self.batch.append (frame)
+        self.batch_length += frame_struct.size + len (frame)
+
+        if self.batch_length >= self.batch_size:
+            self.flush ()
+        elif self.batch_future is None:
+            self.batch_future = self.flush_deferred ()
         return True
 
+    #--------------------------------------------------------------------------#
+    # Pressure                                                                 #
+    #--------------------------------------------------------------------------#
+    def Ready (self):
+        """Get future resolved once connection is ready to send more messages
+
+        Connection is not ready while output stream has too much pending data.
+        """
+        return self.ready
+
+    @property
+    def Pending (self):
+        """Number of bytes written but not yet flushed to output stream
+        """
+        return self.pending
+
+    def pressure (self, size):
+        """Account size bytes as written (or flushed if negative)
+        """
+        self.pending += size
+        if self.ready_source is None:
+            if self.pending >= self.high_watermark:
+                self.ready, self.ready_source = FutureSourcePair ()
+        elif self.pending <= self.low_watermark:
+            source, self.ready, self.ready_source = self.ready_source, ready_future, None
+            source.TrySetResult (None)
+
+    #--------------------------------------------------------------------------#
+    # Negotiate                                                                #
+    #--------------------------------------------------------------------------#
+    def propose (self):
+        """Connection options proposed to remote peer
+        """
+        options = Connection.propose (self)
+        options ['compress'] = self.compress
+        return options
+
+    def agree (self, options):
+        """Agree on connection options proposed by remote peer
+        """
+        agreed = Connection.agree (self, options)
+
+        compress = options.get ('compress')
+        if compress is None:
+            self.compressor.Disable ()
+        else:
+            self.compressor.Enable (compress)
+        agreed ['compress'] = compress
+        return agreed
+
+    #--------------------------------------------------------------------------#
+    # Batch                                                                    #
+    #--------------------------------------------------------------------------#
+    def flush (self, buffers = None):
+        """Write pending batch to output stream and flush it
+
+        Out-of-band buffers (if any) are written right after the batch, each of
+        them prefixed with its size.
+        """
+        if not self.batch:
+            return
+
+        batch, self.batch, self.batch_length = self.batch, [], 0
+        if self.out_stream is None or self.out_stream.Disposed:
+            return
+
+        data = b''.join (batch)
+        size = len (data)
+        self.out_stream.BytesWriteBuffer (data)
+        for buffer in buffers or ():
+            if self.shared_out is not None and self.shared_out.Write (buffer):
+                self.out_stream.WriteBuffer (buffer_struct.pack (len (buffer) | BUFFER_SHARED))
+                size += buffer_struct.size
+                continue
+            self.out_stream.WriteBuffer (buffer_struct.pack (len (buffer)))
+            self.out_stream.WriteBuffer (buffer)
+            size += buffer_struct.size + len (buffer)
+
+        self.pressure (size)
+        self.out_stream.Flush ().Then (lambda result, error: self.pressure (-size))
+
+    @Async
+    def flush_deferred (self):
+        """Flush pending batch on next core iteration (or after batch delay)
+        """
+        try:
+            if self.batch_delay:
+                yield self.core.TimeDelay (self.batch_delay)
+            else:
+                yield self.core.Idle ()
+        except FutureCanceled:
+            pass
+        finally:
+            self.batch_future = None
+        self.flush ()
+
+#------------------------------------------------------------------------------#
+# Batch Frames                                                                 #
+#------------------------------------------------------------------------------#
+frame_struct = struct.Struct ('>IB') # size, flags
+buffer_struct = struct.Struct ('>Q') # out-of-band buffers count or size
+
+FRAME_COMPRESSED = 0x1
+FRAME_BUFFERS    = 0x2 # frame is followed by out-of-band buffers
+FRAME_SHARED     = 0x4 # frame is replaced by its size, and written to shared ring
+BUFFER_SHARED    = 1 << 63 # out-of-band buffer is written to shared ring
+
+def BatchFrames (batch):
+    """Iterate over frames of the batch
+
+    Batch is a sequence of frames each of them prefixed with its size and flags.
+    Yields flags and frame pairs, where frames are memory views into the batch,
+    so no data is copied.
+    """
+    view = memoryview (batch)
+    offset, batch_size = 0, len (view)
+    while offset < batch_size:
+        frame_size, frame_flags = frame_struct.unpack_from (batch, offset)
+        offset += frame_struct.size
+        if offset + frame_size > batch_size:
+            raise ValueError ('Batch is truncated')
+        yield frame_flags, view [offset:offset + frame_size]
+        offset += frame_size
+
 # vim: nu ft=python columns=120 :
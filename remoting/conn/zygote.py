@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import signal
+import socket
+import struct
+import traceback
+import collections
+
+from .stream import StreamConnection
+from .fork import ForkConnectionInit
+from ..importer import ImporterInstall
+from ...bootstrap import Tomb
+from ...async import (Async, AsyncReturn, Core, FutureSourcePair, FutureCanceled,
+                      BrokenPipeError, BufferedFile, CloseOnExecFD)
+from ...process import Process, PIPE
+from ...disposable import Disposable, CompositeDisposable
+
+__all__ = ('Zygote', 'ZygoteConnection',)
+#------------------------------------------------------------------------------#
+# Zygote                                                                       #
+#------------------------------------------------------------------------------#
+class Zygote (object):
+    """Zygote process
+
+    Process which is bootstrapped only once and has framework already imported.
+    It forks new workers on request, each worker is connected with its own
+    socket passed to zygote over control socket. So new connection costs only
+    fork and socket hand off instead of interpreter start and bootstrap.
+    """
+    def __init__ (self, command = None, buffer_size = None, core = None):
+        self.core = core or Core.Instance ()
+        self.buffer_size = buffer_size
+        self.command = [sys.executable, '-'] if command is None else command
+
+        self.process = None
+        self.control = None
+        self.control_stream = None
+        self.replies = collections.deque ()
+        self.dispose = CompositeDisposable ()
+
+    #--------------------------------------------------------------------------#
+    # Process                                                                  #
+    #--------------------------------------------------------------------------#
+    @property
+    def Process (self):
+        return self.process
+
+    #--------------------------------------------------------------------------#
+    # Connect                                                                  #
+    #--------------------------------------------------------------------------#
+    @Async
+    def Connect (self):
+        """Start zygote process
+        """
+        if self.process is not None:
+            raise ValueError ('Zygote is already started')
+
+        try:
+            control, remote = socket.socketpair (socket.AF_UNIX, socket.SOCK_STREAM)
+            self.dispose.Add (Disposable (control.close))
+            CloseOnExecFD (control.fileno ())
+            try:
+                def preexec ():
+                    CloseOnExecFD (remote.fileno (), False)
+
+                self.process = self.dispose.Add (Process (self.command, stdin = PIPE, preexec = preexec,
+                    kill_delay = -1, buffer_size = self.buffer_size, core = self.core))
+
+                # send payload
+                yield self.process.Stdin.Write (Tomb.FromModules ()
+                    .Bootstrap (ZygoteInit, remote.fileno (), self.buffer_size).encode ())
+                yield self.process.Stdin.Dispose ()
+
+            finally:
+                remote.close ()
+
+            self.control = control
+            self.control_stream = self.dispose.Add (BufferedFile (os.dup (control.fileno ()),
+                buffer_size = self.buffer_size, core = self.core))
+            self.control_stream.CloseOnExec (True)
+            self.reply_coroutine ().Traceback ('Zygote::reply_coroutine')
+
+        except Exception:
+            self.Dispose ()
+            raise
+
+        AsyncReturn (self)
+
+    #--------------------------------------------------------------------------#
+    # Fork                                                                     #
+    #--------------------------------------------------------------------------#
+    def Fork (self, fd):
+        """Fork new worker connected with provided socket descriptor
+
+        Returns future resolved with pid of the worker (or zero if zygote has
+        failed to fork).
+        """
+        if self.control is None:
+            raise ValueError ('Zygote is not started')
+
+        future, source = FutureSourcePair ()
+        SendFd (self.control, fd)
+        self.replies.append (source)
+        return future
+
+    def Connection (self, hub = None, **keys):
+        """Create new (not yet connected) connection with worker of this zygote
+        """
+        return ZygoteConnection (self, buffer_size = self.buffer_size,
+            hub = hub, core = self.core, **keys)
+
+    @Async
+    def reply_coroutine (self):
+        """Resolve fork requests with pids replied by zygote
+        """
+        try:
+            while True:
+                pid = pid_struct.unpack ((yield self.control_stream.ReadUntilSize (pid_struct.size))) [0]
+                self.replies.popleft ().SetResult (pid)
+
+        except (FutureCanceled, BrokenPipeError): pass
+        finally:
+            while self.replies:
+                self.replies.popleft ().TrySetCanceled ()
+            self.Dispose ()
+
+    #--------------------------------------------------------------------------#
+    # Awaitable                                                                #
+    #--------------------------------------------------------------------------#
+    def Await (self):
+        """Get awaiter
+        """
+        return self.Connect ()
+
+    #--------------------------------------------------------------------------#
+    # Disposable                                                               #
+    #--------------------------------------------------------------------------#
+    def Dispose (self):
+        """Dispose zygote
+
+        Zygote process exits once its control socket is closed, already forked
+        workers are not affected.
+        """
+        self.control = None
+        self.dispose.Dispose ()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, et, eo, tb):
+        self.Dispose ()
+        return False
+
+#------------------------------------------------------------------------------#
+# Zygote Connection                                                            #
+#------------------------------------------------------------------------------#
+class ZygoteConnection (StreamConnection):
+    """Zygote connection
+
+    Connection with worker forked by zygote via unix socket. Modules received
+    by worker are cached in ``cache`` (see ``ImporterInstall``), False disables
+    caching.
+    """
+    def __init__ (self, zygote, buffer_size = None, hub = None, core = None, cache = None, **keys):
+        StreamConnection.__init__ (self, hub, core or zygote.core, **keys)
+
+        self.zygote = zygote
+        self.buffer_size = buffer_size
+        self.cache = cache
+        self.pid = None
+
+    #--------------------------------------------------------------------------#
+    # Pid                                                                      #
+    #--------------------------------------------------------------------------#
+    @property
+    def Pid (self):
+        return self.pid
+
+    #--------------------------------------------------------------------------#
+    # Protected                                                                #
+    #--------------------------------------------------------------------------#
+    @Async
+    def connect (self, target):
+        """Zygote connect implementation
+        """
+        local, remote = socket.socketpair (socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.pid = yield self.zygote.Fork (remote.fileno ())
+            if not self.pid:
+                raise ValueError ('Zygote has failed to fork worker')
+            fd = os.dup (local.fileno ())
+        finally:
+            local.close ()
+            remote.close ()
+
+        in_stream = self.dispose.Add (BufferedFile (fd, buffer_size = self.buffer_size, core = self.core))
+        in_stream.CloseOnExec (True)
+        out_stream = self.dispose.Add (BufferedFile (os.dup (fd), buffer_size = self.buffer_size, core = self.core))
+        out_stream.CloseOnExec (True)
+
+        yield StreamConnection.connect (self, (in_stream, out_stream))
+        yield self.negotiate ()
+
+        # install importer
+        self.dispose.Add ((yield ImporterInstall (self, cache = self.cache)))
+
+    def disconnect (self):
+        """Zygote disconnect implementation
+        """
+        StreamConnection.disconnect (self)
+        self.dispose.Dispose ()
+
+#------------------------------------------------------------------------------#
+# Zygote Initializer                                                           #
+#------------------------------------------------------------------------------#
+def ZygoteInit (control_fd, buffer_size):
+    """Zygote initialization function
+
+    Plain blocking loop, which receives socket descriptors over control socket
+    and forks worker connected with each of them. Core must not be created
+    here, as it would be shared with all workers.
+    """
+    control = socket.fromfd (control_fd, socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close (control_fd)
+
+    # workers are not waited by zygote
+    signal.signal (signal.SIGCHLD, signal.SIG_IGN)
+
+    while True:
+        fd = RecvFd (control)
+        if fd is None:
+            break # master has closed control socket
+
+        try:
+            pid = os.fork ()
+        except OSError:
+            pid = -1
+
+        if pid == 0:
+            # worker
+            status = 0
+            try:
+                control.close ()
+                signal.signal (signal.SIGCHLD, signal.SIG_DFL)
+                ForkConnectionInit (fd, os.dup (fd), buffer_size)
+            except Exception:
+                traceback.print_exc ()
+                status = 1
+            finally:
+                os._exit (status)
+
+        os.close (fd)
+        control.sendall (pid_struct.pack (max (pid, 0)))
+
+#------------------------------------------------------------------------------#
+# Descriptor Passing                                                           #
+#------------------------------------------------------------------------------#
+pid_struct = struct.Struct ('>I')
+fd_struct = struct.Struct ('i')
+
+def SendFd (sock, fd):
+    """Send file descriptor over unix socket
+    """
+    if hasattr (sock, 'sendmsg'):
+        sock.sendmsg ([b'\x00'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fd_struct.pack (fd))])
+    else:
+        import _multiprocessing
+        _multiprocessing.sendfd (sock.fileno (), fd)
+
+def RecvFd (sock):
+    """Receive file descriptor from unix socket
+
+    Returns None if socket is closed by peer.
+    """
+    if hasattr (sock, 'recvmsg'):
+        data, ancdata, flags, addr = sock.recvmsg (1, socket.CMSG_LEN (fd_struct.size))
+        if not data:
+            return None
+        for level, kind, cdata in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                return fd_struct.unpack (cdata [:fd_struct.size]) [0]
+        raise ValueError ('File descriptor is missing')
+    else:
+        import _multiprocessing
+        try:
+            return _multiprocessing.recvfd (sock.fileno ())
+        except (OSError, EOFError):
+            return None
+
+# vim: nu ft=python columns=120 :
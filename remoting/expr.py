@@ -1,18 +1,21 @@
 # -*- coding: utf-8 -*-
 import io
 import sys
+import types
+import operator
 import itertools
+import collections
 if sys.version_info [0] > 2:
     string_type = io.StringIO
 else:
     string_type = io.BytesIO
 
-from ..async import Async, AsyncReturn
+from ..async import Async, AsyncReturn, SucceededFuture, FutureSourcePair
 
 __all__ = ('Expr', 'LoadArgExpr', 'LoadConstExpr', 'CallExpr',
            'GetAttrExpr', 'SetAttrExpr', 'GetItemExpr', 'SetItemExpr',
            'ReturnExpr', 'RaiseExpr', 'AwaitExpr', 'CmpExpr', 'IfExpr', 'WhileExpr',
-           'Code',)
+           'Code', 'CodeCompile', 'CodeTemplate', 'CodeCall',)
 
 #------------------------------------------------------------------------------#
 # Expression                                                                   #
@@ -337,7 +340,13 @@ opToName = {
 #------------------------------------------------------------------------------#
 class Code (list):
     """Code object
+
+    Code is compiled into closure (see ``CodeCompile``) on its first execution
+    and executed synchronously. Code which cannot be compiled (i.g. it awaits
+    or contains jumps) is interpreted.
     """
+    compiled = None # compiled closure, False if code must be interpreted
+
     #--------------------------------------------------------------------------#
     # Factory                                                                  #
     #--------------------------------------------------------------------------#
@@ -353,6 +362,7 @@ class Code (list):
     def Emit (self, op, arg = None, pos = None):
         """Emit opcode
         """
+        self.compiled = None
         if pos is None:
             self.append ((op, arg))
         else:
@@ -361,9 +371,28 @@ class Code (list):
     #--------------------------------------------------------------------------#
     # Execute                                                                  #
     #--------------------------------------------------------------------------#
-    @Async
     def __call__ (self, *args):
         """Execute code
+
+        Returns future resolved with result of the code.
+        """
+        compiled = self.compiled
+        if compiled is None:
+            compiled = CodeCompile (self) or False
+            self.compiled = compiled
+
+        if compiled is False:
+            return self.interpret (*args)
+        try:
+            return SucceededFuture (compiled (args))
+        except Exception:
+            future, source = FutureSourcePair ()
+            source.SetCurrentError ()
+            return future
+
+    @Async
+    def interpret (self, *args):
+        """Interpret code
         """
         pos   = 0
         stack = []
@@ -454,6 +483,14 @@ class Code (list):
 
         AsyncReturn (stack.pop () if stack else None)
 
+    #--------------------------------------------------------------------------#
+    # Pickle                                                                   #
+    #--------------------------------------------------------------------------#
+    def __reduce__ (self):
+        """Reduce code (compiled closure is never pickled)
+        """
+        return Code, (list (self),)
+
     #--------------------------------------------------------------------------#
     # To String                                                                #
     #--------------------------------------------------------------------------#
@@ -473,6 +510,225 @@ class Code (list):
         """
         return str (self)
 
+#------------------------------------------------------------------------------#
+# Code Template                                                                #
+#------------------------------------------------------------------------------#
+def CodeTemplate (code):
+    """Split code into template and its arguments
+
+    Constants of the code (except functions and types, which are pickled by
+    reference) are replaced with loads of arguments following the first one,
+    so template is executed with target followed by returned arguments (see
+    ``CodeCall``). Templates are shared between codes which differ only by
+    these constants. Returns code itself and empty arguments if code has no
+    such constants or uses arguments other than the first one.
+    """
+    ops, args = [], []
+    for op, arg in code:
+        if op == OP_LDCONST and not isinstance (arg, template_types):
+            args.append (arg)
+            ops.append ((OP_LDARG, len (args)))
+        elif op == OP_LDARG and arg != 0:
+            return code, ()
+        else:
+            ops.append ((op, arg))
+    if not args:
+        return code, ()
+
+    key = tuple (ops)
+    try:
+        template = templates.pop (key, None)
+    except TypeError:
+        return code, () # unhashable operation argument
+    if template is None:
+        template = Code (ops)
+        while len (templates) >= templates_capacity:
+            templates.popitem (last = False)
+    templates [key] = template
+    return template, tuple (args)
+
+template_types = (type, types.FunctionType, types.BuiltinFunctionType)
+templates = collections.OrderedDict ()
+templates_capacity = 1024
+
+class CodeCall (object):
+    """Call of code template with its arguments
+    """
+    __slots__ = ('code', 'args',)
+
+    def __init__ (self, code, args):
+        self.code = code
+        self.args = args
+
+    def __call__ (self, target):
+        """Execute template
+        """
+        return self.code (target, *self.args)
+
+    def __reduce__ (self):
+        return CodeCall, (self.code, self.args)
+
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [args:{}] {}>'.format (type (self).__name__, self.args, self.code)
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+#------------------------------------------------------------------------------#
+# Code Compile                                                                 #
+#------------------------------------------------------------------------------#
+def CodeCompile (code):
+    """Compile code into closure
+
+    Stack is resolved at compile time, so each value is computed by closure of
+    closures computing its operands. Returned function accepts tuple of
+    arguments and returns result of the code. Returns None if code cannot be
+    compiled: it awaits, jumps, or leaves values on stack which are evaluated
+    in order different from statements (such code is interpreted).
+    """
+    stack, body = [], []
+    for op, arg in code:
+        if op == OP_LDARG:
+            stack.append (compile_arg (arg))
+
+        elif op == OP_LDCONST:
+            stack.append (compile_const (arg))
+
+        elif op == OP_CALL:
+            a_count, kw_count = arg
+            kw = []
+            for _ in range (kw_count):
+                value, key = stack.pop (), stack.pop ()
+                kw.append ((key, value))
+            kw.reverse ()
+            a = [stack.pop () for _ in range (a_count)]
+            a.reverse ()
+            stack.append (compile_call (stack.pop (), a, kw))
+
+        elif op == OP_GETATTR:
+            stack.append (compile_getattr (stack.pop (), arg))
+
+        elif op == OP_GETITEM:
+            item = stack.pop ()
+            stack.append (compile_getitem (stack.pop (), item))
+
+        elif op == OP_COMPARE:
+            compare = compare_ops.get (arg)
+            if compare is None:
+                return None
+            second, first = stack.pop (), stack.pop ()
+            stack.append (compile_compare (compare, first, second))
+
+        elif op == OP_RETURN:
+            break
+
+        elif op in (OP_SETATTR, OP_SETITEM, OP_POP, OP_RAISE):
+            if op == OP_SETATTR:
+                target, value = stack.pop (), stack.pop ()
+                body.append (compile_setattr (target, arg, value))
+            elif op == OP_SETITEM:
+                item, target, value = stack.pop (), stack.pop (), stack.pop ()
+                body.append (compile_setitem (target, item, value))
+            elif op == OP_POP:
+                body.append (stack.pop ())
+            else:
+                body.append (compile_raise (stack.pop ()))
+
+            if stack:
+                return None # statement must not be executed before pending values
+            elif op == OP_RAISE:
+                break
+
+        else:
+            return None # await or jump
+
+    if len (stack) > 1:
+        return None
+    result = stack [0] if stack else compile_const (None)
+    if not body:
+        return result
+
+    def run (args):
+        for statement in body:
+            statement (args)
+        return result (args)
+    return run
+
+def compile_arg (index):
+    return lambda args: args [index]
+
+def compile_const (const):
+    return lambda args: const
+
+def compile_call (fn, a, kw):
+    if kw:
+        def call (args):
+            fn_value = fn (args)
+            a_values = [arg (args) for arg in a]
+            return fn_value (*a_values, **dict ((key (args), value (args)) for key, value in kw))
+    elif not a:
+        call = lambda args: fn (args) ()
+    elif len (a) == 1:
+        a0, = a
+        def call (args):
+            fn_value = fn (args)
+            return fn_value (a0 (args))
+    else:
+        def call (args):
+            fn_value = fn (args)
+            return fn_value (*[arg (args) for arg in a])
+    return call
+
+def compile_getattr (target, name):
+    return lambda args: getattr (target (args), name)
+
+def compile_getitem (target, item):
+    def getitem (args):
+        target_value = target (args)
+        return target_value [item (args)]
+    return getitem
+
+def compile_setattr (target, name, value):
+    def setattr_ (args):
+        value_value = value (args)
+        setattr (target (args), name, value_value)
+    return setattr_
+
+def compile_setitem (target, item, value):
+    def setitem (args):
+        value_value = value (args)
+        target_value = target (args)
+        target_value [item (args)] = value_value
+    return setitem
+
+def compile_compare (compare, first, second):
+    def compare_ (args):
+        first_value = first (args)
+        return compare (first_value, second (args))
+    return compare_
+
+def compile_raise (error):
+    def raise_ (args):
+        raise error (args)
+    return raise_
+
+compare_ops = {
+    '<'     : operator.lt,
+    '<='    : operator.le,
+    '=='    : operator.eq,
+    '!='    : operator.ne,
+    '>'     : operator.gt,
+    '>='    : operator.ge,
+    'in'    : lambda first, second: first in second,
+    'not in': lambda first, second: first not in second,
+    'is'    : operator.is_,
+    'is not': operator.is_not,
+}
+
 #------------------------------------------------------------------------------#
 # Helpers                                                                      #
 #------------------------------------------------------------------------------#
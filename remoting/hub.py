@@ -3,11 +3,11 @@ import sys
 import threading
 import itertools
 
-from .result import ResultSender
-from ..async import Event, FutureSourcePair
+from .result import Result, ResultSender
+from ..async import Core, Event, Future, FutureSourcePair, SucceededFuture
 from ..async.future.compat import Raise
 
-__all__ = ('Hub', 'HubError', 'Receiver', 'Sender', 'ReceiverSenderPair',)
+__all__ = ('Hub', 'HubError', 'Receiver', 'Sender', 'ReceiverSenderPair', 'RequestCancel',)
 #------------------------------------------------------------------------------#
 # Hub Errors                                                                   #
 #------------------------------------------------------------------------------#
@@ -27,7 +27,11 @@ class Hub (object):
     def __init__ (self):
         self.addr = itertools.count (1)
         self.handlers = {}
+        self.replies = {} # reply slots of pending requests by reply address
+        self.pending = {} # futures of received requests by their reply route
+        self.gates = {}
         self.any = Event ()
+        self.any_count = 0 # may exceed actual count if handler unsubscribes itself
 
     #--------------------------------------------------------------------------#
     # Instance                                                                 #
@@ -65,25 +69,108 @@ class Hub (object):
     # Sender                                                                   #
     #--------------------------------------------------------------------------#
     def Send (self, dst, msg, src):
+        """Send message to handlers subscribed on destination
+
+        Handlers returning False are unsubscribed. Common case of single handler
+        is dispatched without copying handlers, and ``any`` event is fired only
+        if it has subscribers. Messages to reply addresses resolve their reply
+        slots directly.
+        """
+        error = None
         handlers = self.handlers.get (dst, None)
         if not handlers:
-            raise HubError ('No receiver: src:{} dst:{} msg:{}'.format (src, dst, msg))
+            reply = self.replies.pop (dst [-1], None)
+            if reply is None:
+                if isinstance (msg, Result):
+                    return # late reply to canceled request
+                raise HubError ('No receiver: src:{} dst:{} msg:{}'.format (src, dst, msg))
+            try:
+                self.resolve (reply, msg)
+            except Exception:
+                error = sys.exc_info ()
 
-        error = None
-        for handler in tuple (handlers):
+        elif len (handlers) == 1:
+            handler, = handlers
             try:
                 if not handler (msg, src, dst):
                     handlers.discard (handler)
             except Exception:
                 error = sys.exc_info ()
-
-        if not handlers:
+        else:
+            for handler in tuple (handlers):
+                try:
+                    if not handler (msg, src, dst):
+                        handlers.discard (handler)
+                except Exception:
+                    error = sys.exc_info ()
+
+        if handlers is not None and not handlers:
             self.handlers.pop (dst, None)
 
-        self.any (msg, src, dst)
+        if self.any_count:
+            self.any (msg, src, dst)
         if error:
             Raise (*error)
 
+    #--------------------------------------------------------------------------#
+    # Reply                                                                    #
+    #--------------------------------------------------------------------------#
+    def Reply (self, source, result = False):
+        """Allocate reply address resolving future source with received message
+
+        Reply slot is freed once first message is received. If ``result`` is set,
+        received message must be a ``Result`` object and its value is used.
+        """
+        rid = next (self.addr)
+        self.replies [rid] = source, result
+        return Address ((rid,))
+
+    def ReplyFree (self, addr):
+        """Free reply slot without resolving it
+
+        Returns future source of the slot, or None if slot is already freed.
+        """
+        reply = self.replies.pop (addr [-1], None)
+        return None if reply is None else reply [0]
+
+    def Pending (self, src, future):
+        """Register future of request received from src
+
+        Pending future is canceled once requester cancels request. Returns
+        provided future.
+        """
+        if src is None or future.IsCompleted ():
+            return future
+
+        route = tuple (src.dst)
+        self.pending [route] = future
+        def pending_cont (result, error):
+            if self.pending.get (route) is future:
+                del self.pending [route]
+        future.Then (pending_cont)
+        return future
+
+    def Cancel (self, src):
+        """Cancel pending request received from src
+        """
+        future = self.pending.pop (tuple (src.dst), None)
+        if future is not None:
+            future.Cancel ()
+
+    def resolve (self, reply, msg):
+        """Resolve reply slot with received message
+        """
+        source, result = reply
+        if not result:
+            source.SetResult (msg)
+            return
+        try:
+            value = msg ()
+        except Exception:
+            source.SetCurrentError ()
+        else:
+            source.SetResult (value)
+
     #--------------------------------------------------------------------------#
     # Receiver                                                                 #
     #--------------------------------------------------------------------------#
@@ -91,6 +178,7 @@ class Hub (object):
         """Subscribe handler on messages with specified destination
         """
         if dst is None:
+            self.any_count += 1
             return self.any.On (handler)
 
         handlers = self.handlers.get (dst)
@@ -104,7 +192,10 @@ class Hub (object):
         """Unsubscribe handler from message with specified destination
         """
         if dst is None:
-            return self.any.Off (handler)
+            if not self.any.Off (handler):
+                return False
+            self.any_count -= 1
+            return True
 
         handlers = self.handlers.get (dst)
         if handlers is None:
@@ -118,6 +209,29 @@ class Hub (object):
         except KeyError:
             return False
 
+    #--------------------------------------------------------------------------#
+    # Gate                                                                     #
+    #--------------------------------------------------------------------------#
+    def Gate (self, dst, gate = None):
+        """Install gate for specified destination
+
+        Gate is a function returning future which is resolved once destination
+        is ready to accept more messages. If gate is None, installed gate is
+        removed.
+        """
+        if gate is None:
+            self.gates.pop (dst, None)
+        else:
+            self.gates [dst] = gate
+
+    def Ready (self, dst):
+        """Get future resolved once destination is ready to accept more messages
+
+        Returns None if destination has no gate installed.
+        """
+        gate = self.gates.get (dst)
+        return None if gate is None else gate ()
+
     #--------------------------------------------------------------------------#
     # Awaitable                                                                #
     #--------------------------------------------------------------------------#
@@ -127,7 +241,12 @@ class Hub (object):
         Wait for the end of processing next message (or current message if
         awaiter is created inside current message handler) to any destination.
         """
-        return self.any.Await ()
+        self.any_count += 1
+        def await_cont (result, error):
+            self.any_count -= 1
+        future = self.any.Await ()
+        future.Then (await_cont)
+        return future
 
     #--------------------------------------------------------------------------#
     # Disposable                                                               #
@@ -218,6 +337,13 @@ class Sender (object):
         """
         self.hub.Send (self.dst, msg, src)
 
+    def Ready (self):
+        """Get future resolved once destination is ready to accept more messages
+
+        Returns None if destination does not limit incoming messages.
+        """
+        return self.hub.Ready (self.dst)
+
     #--------------------------------------------------------------------------#
     # Call                                                                     #
     #--------------------------------------------------------------------------#
@@ -227,34 +353,48 @@ class Sender (object):
         Return future object for returned message.
         """
         future, source = FutureSourcePair ()
-        src = self.hub.Address ()
-
-        def call_handler (msg, src, dst):
-            source.SetResult (msg)
-            return False
-        self.hub.On (src, call_handler)
-
-        self.Send (msg, Sender (self.hub, src))
+        src = self.hub.Reply (source)
+        try:
+            self.Send (msg, Sender (self.hub, src))
+        except Exception:
+            self.hub.ReplyFree (src)
+            raise
         return future
 
     #--------------------------------------------------------------------------#
     # Request | Response                                                       #
     #--------------------------------------------------------------------------#
-    def Request (self, msg):
+    def Request (self, msg, cancel = None, timeout = None):
         """Request
-        """
-        future, source = FutureSourcePair ()
-        src = self.hub.Address ()
 
-        def request_handler (result, src, dst):
-            try:
-                source.SetResult (result ())
-            except Exception:
-                source.SetCurrentError ()
-            return False
-        self.hub.On (src, request_handler)
+        Reply is received by reply slot of the hub, so pending request costs
+        only its future and slot entry.
 
-        self.Send (msg, Sender (self.hub, src))
+        Request is canceled once ``cancel`` future is resolved or ``timeout``
+        (in seconds) has elapsed. Canceled request frees its reply slot, its
+        future is canceled, and destination is asked to cancel execution of
+        the request (see ``RequestCancel``).
+        """
+        future, source = FutureSourcePair ()
+        src = self.hub.Reply (source, True)
+        try:
+            self.Send (msg, Sender (self.hub, src))
+        except Exception:
+            self.hub.ReplyFree (src)
+            raise
+
+        if timeout is not None:
+            timer = Core.Instance ().TimeDelay (timeout, future)
+            cancel = timer if cancel is None else Future.Any ((cancel, timer))
+        if cancel is not None and not future.IsCompleted ():
+            def cancel_cont (result, error):
+                if self.hub.ReplyFree (src) is None:
+                    return # reply has already been received
+                source.TrySetCanceled ()
+                try:
+                    self.Send (RequestCancel (Sender (self.hub, src)))
+                except HubError: pass # destination is gone
+            cancel.Await ().Then (cancel_cont)
         return future
 
     def Response (self):
@@ -288,6 +428,32 @@ class Sender (object):
         """
         return str (self)
 
+#------------------------------------------------------------------------------#
+# Request Cancel                                                               #
+#------------------------------------------------------------------------------#
+class RequestCancel (object):
+    """Request cancel message
+
+    Sent to destination of canceled request instead of code, and executed the
+    same way. Cancels pending execution of the request identified by its reply
+    sender (see ``Hub.Pending``).
+    """
+    __slots__ = ('src',)
+
+    def __init__ (self, src):
+        self.src = src
+
+    def __call__ (self, target):
+        """Cancel request
+        """
+        self.src.hub.Cancel (self.src)
+        return cancel_future
+
+    def __reduce__ (self):
+        return RequestCancel, (self.src,)
+
+cancel_future = SucceededFuture (None)
+
 #------------------------------------------------------------------------------#
 # Receiver                                                                     #
 #------------------------------------------------------------------------------#
@@ -2,6 +2,8 @@
 import os
 import sys
 import imp
+import ast
+import marshal
 import inspect
 import pkgutil
 
@@ -9,17 +11,22 @@ from .result import ResultSender
 from .hub import ReceiverSenderPair
 from .expr import Code, SetItemExpr, GetAttrExpr, LoadArgExpr
 from ..async import Core, Async, AsyncReturn
+from ..bootstrap import Tomb, SourceDigest, BytecodeMagic
 from ..async.future.compat import Exec
 
-__all__ = ('Importer', 'ImporterLoader',)
+__all__ = ('Importer', 'ImporterLoader', 'ImporterCache', 'ImporterCore',)
 #------------------------------------------------------------------------------#
 # Importer Proxy                                                               #
 #------------------------------------------------------------------------------#
 class ImporterProxy (object):
     """Importer proxy
+
+    If ``cache`` is set, digests of modules found in it are sent along with
+    request, and loaders of unchanged modules are restored from it.
     """
-    def __init__ (self, sender):
+    def __init__ (self, sender, cache = None):
         self.sender = sender
+        self.cache = cache
         self.loaders = {}
 
     #--------------------------------------------------------------------------#
@@ -36,6 +43,11 @@ class ImporterProxy (object):
         else:
             sys.meta_path.insert (index, self)
 
+        # lazy tombs fetch their modules with this importer
+        for finder in sys.meta_path:
+            if getattr (finder, 'TOMB_UUID', None) == Tomb.TOMB_UUID:
+                finder.Fetcher (self.fetch)
+
     #--------------------------------------------------------------------------#
     # Finder                                                                   #
     #--------------------------------------------------------------------------#
@@ -45,13 +57,24 @@ class ImporterProxy (object):
 
         loader = self.loaders.get (name, False)
         if loader is False:
-            # Function find_module must be synchronous, so we must execute core
-            # until request is fulfilled.
-            loader = self.sender.Request (name)
-            for _ in Core.Instance ():
-                if loader.IsCompleted ():
-                    loader = loader.Result ()
-                    break
+            digests = None if self.cache is None else self.cache.Digests (name)
+            loaders = self.request ((name, digests) if digests else name) or (None,)
+            if self.cache is not None:
+                self.cache.Evict () # entries stored since previous response
+            for index, loader in enumerate (loaders):
+                if loader is None:
+                    continue
+                if loader.source is None and not self.cache.Load (loader):
+                    # cache entry has been removed since digests were collected
+                    loader = (self.request (loader.name) or (None,)) [0]
+                    loaders [index] = loader
+                if loader is not None:
+                    loader.cache = self.cache
+
+            # requested loader is followed by prefetched ones
+            loader = loaders [0]
+            for prefetched in loaders [1:]:
+                self.loaders.setdefault (prefetched.name, prefetched)
             self.loaders [name] = loader
 
         if loader is None:
@@ -59,6 +82,23 @@ class ImporterProxy (object):
 
         return loader
 
+    def fetch (self, name):
+        """Fetch source and code of the module by its name
+        """
+        loader = self.find_module (name)
+        return None if loader is None else (loader.get_source (name), loader.get_code (name))
+
+    def request (self, msg):
+        """Send request and wait for its result
+        """
+        # Function find_module must be synchronous, so we must execute core
+        # until request is fulfilled.
+        future = self.sender.Request (msg)
+        for _ in Core.Instance ():
+            if future.IsCompleted ():
+                break
+        return future.Result ()
+
     #--------------------------------------------------------------------------#
     # Equality                                                                 #
     #--------------------------------------------------------------------------#
@@ -84,7 +124,7 @@ class ImporterProxy (object):
     def __reduce__ (self):
         """Get proxy to this importer
         """
-        return ImporterProxy, (self.sender,)
+        return ImporterProxy, (self.sender, self.cache)
 
     #--------------------------------------------------------------------------#
     # Disposable                                                               #
@@ -95,9 +135,15 @@ class ImporterProxy (object):
         if self in sys.meta_path:
             sys.meta_path.remove (self)
 
+        for finder in sys.meta_path:
+            if getattr (finder, 'fetcher', None) == self.fetch:
+                finder.Fetcher (None)
+
         sender, self.sender = self.sender, None
         if sender is not None:
             sender.Send (None)
+        if self.cache is not None:
+            self.cache.Evict ()
 
     def __enter__ (self):
         return self
@@ -124,14 +170,17 @@ class ImporterProxy (object):
 # Importer Loader                                                              #
 #------------------------------------------------------------------------------#
 class ImporterLoader (object):
-    __slots__ = ('name', 'pkg', 'ispkg', 'filename', 'source',)
+    __slots__ = ('name', 'pkg', 'ispkg', 'filename', 'source', 'digest', 'code', 'cache',)
 
-    def __init__ (self, name, pkg, ispkg, filename, source):
+    def __init__ (self, name, pkg, ispkg, filename, source, digest = None):
         self.name = name
         self.pkg = pkg
         self.ispkg = ispkg
         self.filename = filename
         self.source = source
+        self.digest = digest
+        self.code = None
+        self.cache = None
 
     #--------------------------------------------------------------------------#
     # Loader                                                                   #
@@ -161,7 +210,7 @@ class ImporterLoader (object):
         module.__initializing__ = True
         sys.modules [name] = module
         try:
-            Exec (compile (self.source, module.__file__, 'exec'), module.__dict__)
+            Exec (self.get_code (name), module.__dict__)
             return module
         except Exception:
             sys.modules.pop (name, None)
@@ -185,7 +234,19 @@ class ImporterLoader (object):
     def get_code (self, name):
         if name != self.name:
             raise ImportError ('loader cannot handle {}'.format (name))
-        return compile (self.source, self.filename, 'exec')
+        if self.code is None:
+            self.code = compile (self.source, self.filename, 'exec')
+            if self.cache is not None:
+                self.cache.Store (self)
+        return self.code
+
+    #--------------------------------------------------------------------------#
+    # Pickle                                                                   #
+    #--------------------------------------------------------------------------#
+    def __reduce__ (self):
+        """Compiled code and cache are never sent
+        """
+        return ImporterLoader, (self.name, self.pkg, self.ispkg, self.filename, self.source, self.digest)
 
     #--------------------------------------------------------------------------#
     # To String                                                                #
@@ -201,57 +262,311 @@ class ImporterLoader (object):
         """
         return str (self)
 
+#------------------------------------------------------------------------------#
+# Importer Cache                                                               #
+#------------------------------------------------------------------------------#
+class ImporterCache (object):
+    """Persistent cache of received modules
+
+    Source and compiled code of each module are stored in per-user cache
+    directory under module name and source digest. Least recently used entries
+    are removed by ``Evict`` once size of the cache exceeds ``limit`` bytes.
+    Cache is created by master, but its directory is resolved by remote peer.
+    """
+    default_limit = 1 << 26
+
+    def __init__ (self, path = None, limit = None):
+        self.path = path
+        self.limit = limit or self.default_limit
+        self.root = None
+        self.digests = None
+        self.stored = False
+
+    #--------------------------------------------------------------------------#
+    # Path                                                                     #
+    #--------------------------------------------------------------------------#
+    @property
+    def Path (self):
+        """Cache directory
+        """
+        if self.root is None:
+            self.root = self.path or os.path.join (os.environ.get ('XDG_CACHE_HOME') or
+                os.path.expanduser ('~/.cache'), 'pretzel', 'import')
+        return self.root
+
+    def entry (self, name, digest):
+        """Path of the cache entry
+        """
+        return os.path.join (self.Path, '{}-{}'.format (name, digest))
+
+    #--------------------------------------------------------------------------#
+    # Digests                                                                  #
+    #--------------------------------------------------------------------------#
+    def Digests (self, name):
+        """Digests of cached modules of the same top level package as name
+
+        Returns dictionary of module names and digests of their sources, if
+        cache contains several versions of a module, most recent one is used.
+        """
+        if self.digests is None:
+            self.digests = {}
+            for mtime, size, entry in self.entries ():
+                module, _, digest = os.path.basename (entry).rpartition ('-')
+                if module and len (digest) == 40:
+                    self.digests [module] = digest
+
+        top = name.partition ('.') [0]
+        return dict ((module, digest) for module, digest in self.digests.items ()
+            if module == top or module.startswith (top + '.'))
+
+    #--------------------------------------------------------------------------#
+    # Load                                                                     #
+    #--------------------------------------------------------------------------#
+    def Load (self, loader):
+        """Restore source and code of the loader from cache
+
+        Returns False if module is not cached. Cached code is used only if it
+        has been compiled by interpreter with the same bytecode magic.
+        """
+        path = self.entry (loader.name, loader.digest)
+        try:
+            with open (path, 'rb') as file:
+                magic, source, code = marshal.load (file)
+            os.utime (path, None)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return False
+
+        if SourceDigest (source) != loader.digest:
+            return False
+        loader.source = source
+        loader.code = code if magic == BytecodeMagic () else None
+        return True
+
+    #--------------------------------------------------------------------------#
+    # Store                                                                    #
+    #--------------------------------------------------------------------------#
+    def Store (self, loader):
+        """Store source and compiled code of the loader
+        """
+        if loader.digest is None or loader.code is None:
+            return
+
+        path = self.entry (loader.name, loader.digest)
+        try:
+            if not os.path.isdir (self.Path):
+                os.makedirs (self.Path, 0o700)
+            temp = '{}.{}'.format (path, os.getpid ())
+            with open (temp, 'wb') as file:
+                marshal.dump ((BytecodeMagic (), loader.source, loader.code), file)
+            os.rename (temp, path)
+        except (IOError, OSError, ValueError):
+            return
+
+        if self.digests is not None:
+            self.digests [loader.name] = loader.digest
+        self.stored = True
+
+    #--------------------------------------------------------------------------#
+    # Evict                                                                    #
+    #--------------------------------------------------------------------------#
+    def Evict (self):
+        """Remove least recently used entries exceeding size limit
+
+        Cache directory is only listed if entries have been stored since
+        previous eviction.
+        """
+        if not self.stored:
+            return
+        self.stored = False
+
+        size = 0
+        for mtime, entry_size, entry in reversed (self.entries ()):
+            size += entry_size
+            if size > self.limit:
+                try:
+                    os.unlink (entry)
+                except OSError: pass
+
+    def entries (self):
+        """Modification time, size and path of cache entries (oldest first)
+        """
+        entries = []
+        try:
+            for entry in os.listdir (self.Path):
+                entry = os.path.join (self.Path, entry)
+                entries.append ((os.path.getmtime (entry), os.path.getsize (entry), entry))
+        except OSError: pass
+        entries.sort ()
+        return entries
+
+    #--------------------------------------------------------------------------#
+    # Pickle                                                                   #
+    #--------------------------------------------------------------------------#
+    def __reduce__ (self):
+        """Cache directory must be resolved by remote peer
+        """
+        return ImporterCache, (self.path, self.limit)
+
 #------------------------------------------------------------------------------#
 # Importer                                                                     #
 #------------------------------------------------------------------------------#
-def Importer (hub = None):
+def Importer (hub = None, prefetch = None, cache = None):
     """Create importer proxy object
+
+    Each response contains loader of requested module followed by loaders of
+    (at most ``prefetch``) modules of the same top level package it imports,
+    directly or indirectly. Loaders are never sent twice.
+
+    Request may carry digests of modules cached by remote peer (see
+    ``ImporterCache``), loaders of unchanged modules are sent without source.
     """
     receiver, sender = ReceiverSenderPair (hub = hub)
+    prefetch = importer_prefetch if prefetch is None else prefetch
+    sent = set ()
 
     def importer_handler (name, src, dst):
         with ResultSender (src) as send:
             if name is None:
                 return False # dispose importer
 
-            module = sys.modules.get (name, False)
-            if module is None:
-                send (None) # Module is cached as not found (python 2)
+            digests = None
+            if isinstance (name, tuple):
+                name, digests = name
 
-            loader = pkgutil.get_loader (name)
-            if loader is None or not hasattr (loader, 'get_source'):
+            loader = ImporterLoaderFind (name)
+            if loader is None:
                 send (None)
 
-            source = loader.get_source (name)
-            if source is None:
-                send (None)
+            loaders, queue = [loader], [loader]
+            sent.add (name)
+            while queue and len (loaders) <= prefetch:
+                for dep in ImporterLoaderDeps (queue.pop (0)):
+                    if dep in sent:
+                        continue
+                    parent = sys.modules.get (dep.rpartition ('.') [0])
+                    if parent is None:
+                        if Tomb.Find (dep) is None:
+                            continue # do not import anything just to prefetch it
+                    elif not hasattr (parent, '__path__'):
+                        continue # name of an object defined by module
+                    sent.add (dep)
+                    try:
+                        dep_loader = ImporterLoaderFind (dep)
+                    except Exception:
+                        continue # not a module
+                    if dep_loader is not None:
+                        loaders.append (dep_loader)
+                        queue.append (dep_loader)
+                        if len (loaders) > prefetch:
+                            break
+
+            if digests:
+                loaders = [ImporterLoader (loader.name, loader.pkg, loader.ispkg, loader.filename, None, loader.digest)
+                    if digests.get (loader.name) == loader.digest else loader for loader in loaders]
+            send (loaders)
+        return True
+
+    receiver.On (importer_handler)
+    return ImporterProxy (sender, cache)
+
+importer_prefetch = 64
+
+def ImporterLoaderFind (name):
+    """Find module by its name and create its loader
+
+    Returns None if module cannot be found or its source is not available.
+    """
+    module = sys.modules.get (name, False)
+    if module is None:
+        return None # Module is cached as not found (python 2)
+
+    # Module may be requested by lazy tomb, so it must be sent exactly
+    # as it is stored in tomb.
+    containment = Tomb.Find (name)
+    if containment is not None:
+        source, filename, ispkg = containment
+        return ImporterLoader (name, name if ispkg else name.rpartition ('.') [0],
+            ispkg, filename, source, SourceDigest (source))
+
+    loader = pkgutil.get_loader (name)
+    if loader is None or not hasattr (loader, 'get_source'):
+        return None
+
+    source = loader.get_source (name)
+    if source is None:
+        return None
+
+    ispkg = loader.is_package (name)
+    if module and hasattr (module, '__package__'):
+        pkg = module.__package__
+    else:
+        pkg = name if ispkg else name.rpartition ('.') [0]
+
+    try:
+        filename = (inspect.getfile (loader.get_code (name)) if not module else
+                    inspect.getfile (module))
+    except TypeError:
+        filename = '<unknown>'
+
+    return ImporterLoader (name, pkg, ispkg, filename, source, SourceDigest (source))
+
+def ImporterLoaderDeps (loader):
+    """Names of modules of the same top level package imported by loader module
 
-            ispkg = loader.is_package (name)
-            if module and hasattr (module, '__package__'):
-                pkg = module.__package__
+    Names are guessed from import statements, so some of them may be names of
+    other objects instead of modules.
+    """
+    try:
+        tree = ast.parse (loader.source)
+    except SyntaxError:
+        return
+
+    top = loader.name.partition ('.') [0] + '.'
+    package = (loader.name if loader.ispkg else loader.name.rpartition ('.') [0]).split ('.')
+    for node in ast.walk (tree):
+        if isinstance (node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance (node, ast.ImportFrom):
+            if node.level:
+                if node.level > len (package):
+                    continue
+                base = '.'.join (package [:len (package) - node.level + 1])
+                module = '{}.{}'.format (base, node.module) if node.module else base
             else:
-                pkg = name if ispkg else name.rpartition ('.') [0]
+                module = node.module
+            names = [module]
+            names.extend ('{}.{}'.format (module, alias.name) for alias in node.names if alias.name != '*')
+        else:
+            continue
 
-            try:
-                filename = (inspect.getfile (loader.get_code (name)) if not module else
-                            inspect.getfile (module))
-            except TypeError:
-                filename = '<unknown>'
+        for name in names:
+            if name.startswith (top):
+                yield name
 
-            send (ImporterLoader (name, pkg, ispkg, filename, source))
-        return True
+#------------------------------------------------------------------------------#
+# Importer Core                                                                #
+#------------------------------------------------------------------------------#
+def ImporterCore ():
+    """Names of modules required by remote peer to establish connection
 
-    receiver.On (importer_handler)
-    return ImporterProxy (sender)
+    Lazy tomb sends only these modules, all other modules are fetched with
+    importer once they are imported.
+    """
+    package = __package__.partition ('.') [0]
+    return tuple ('{}.{}'.format (package, name) for name in
+        ('async', 'remoting', 'bootstrap', 'disposable', 'process', 'observer'))
 
 #------------------------------------------------------------------------------#
 # Importer Install                                                             #
 #------------------------------------------------------------------------------#
 @Async
-def ImporterInstall (conn, index = None):
+def ImporterInstall (conn, index = None, cache = None):
     """Create and install importer on specified connection
+
+    Remote peer caches received modules in default ``ImporterCache`` unless
+    other cache is provided, or ``cache`` is False.
     """
-    importer = Importer (conn.hub)
+    importer = Importer (conn.hub, cache = ImporterCache () if cache is None else cache or None)
     try:
         yield conn (importer) (index)
 
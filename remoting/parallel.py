@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+import sys
+import itertools
+import collections
+
+from .hub import HubError
+from ..async import FutureSourcePair
+from ..observer import Observable
+from ..observer.utils import AnonymousObserver
+from ..disposable import Disposable
+
+__all__ = ('Map',)
+#------------------------------------------------------------------------------#
+# Map                                                                          #
+#------------------------------------------------------------------------------#
+class Map (Observable):
+    """Parallel map of function over items with multiple connections
+
+    Items are split into chunks of ``chunk_size`` items, each chunk is mapped
+    by single request to one of the connections, and at most ``window`` chunks
+    are in-flight per connection. Results are observed in order of items if
+    ``ordered`` is set, otherwise as soon as their chunk is completed. Chunks
+    of connection which has been disposed are mapped by remaining connections.
+    Function must be pickle-able, error raised by it is observed as error of
+    the map. Members of connection pool can be used as connections (see
+    ``ConnectionPool.Members``).
+    """
+    default_chunk_size = 16
+    default_window     = 2
+
+    def __init__ (self, fn, items, conns, chunk_size = None, window = None, ordered = True):
+        self.fn = fn
+        self.items = items
+        self.conns = tuple (conns)
+        self.chunk_size = chunk_size or self.default_chunk_size
+        self.window = window or self.default_window
+        self.ordered = ordered
+
+    #--------------------------------------------------------------------------#
+    # Observable                                                               #
+    #--------------------------------------------------------------------------#
+    def Subscribe (self, observer):
+        """Subscribe observer
+
+        Each subscription maps items on its own, disposing subscription stops
+        it and cancels its in-flight chunks.
+        """
+        return MapRun (self, observer)
+
+    #--------------------------------------------------------------------------#
+    # Awaitable                                                                #
+    #--------------------------------------------------------------------------#
+    def Await (self):
+        """Get awaiter
+
+        Resolves to list of all results.
+        """
+        future, source = FutureSourcePair ()
+        results = []
+        self.Subscribe (AnonymousObserver (results.append, source.TrySetError,
+            lambda: source.TrySetResult (results)))
+        return future
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [fn:{} conns:{} chunk:{} window:{}]>'.format (type (self).__name__,
+            self.fn, len (self.conns), self.chunk_size, self.window)
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+#------------------------------------------------------------------------------#
+# Map Run                                                                      #
+#------------------------------------------------------------------------------#
+class MapRun (object):
+    """Running parallel map
+    """
+    def __init__ (self, parallel, observer):
+        self.fn = parallel.fn
+        self.window = parallel.window
+        self.ordered = parallel.ordered
+        self.observer = observer
+
+        self.chunks = enumerate (map_chunks (parallel.items, parallel.chunk_size))
+        self.retry = collections.deque () # chunks of disposed connections
+        self.results = {} # completed but not yet observed chunks (ordered only)
+        self.index = 0    # index of next observed chunk (ordered only)
+        self.finished = False
+
+        self.peers = []
+        for conn in parallel.conns:
+            peer = MapPeer (conn)
+            self.peers.append (peer)
+            peer.watch = conn.dispose.Add (Disposable (lambda peer = peer: self.dead (peer)))
+        self.schedule ()
+
+    #--------------------------------------------------------------------------#
+    # Schedule                                                                 #
+    #--------------------------------------------------------------------------#
+    def schedule (self):
+        """Send chunks to connections with free window
+
+        Finishes map once there are no more chunks.
+        """
+        for peer in self.peers:
+            while not self.finished and peer.alive and len (peer.chunks) < self.window:
+                chunk = self.take ()
+                if chunk is None:
+                    break
+                self.send (peer, chunk)
+
+        if self.finished or any (peer.chunks for peer in self.peers):
+            return
+        chunk = self.take ()
+        if chunk is None:
+            self.finish ()
+        else:
+            self.retry.appendleft (chunk)
+            try:
+                raise ValueError ('All connections of parallel map have been disposed')
+            except ValueError:
+                self.finish (sys.exc_info ())
+
+    def take (self):
+        """Take next chunk to be sent
+
+        In ordered mode new chunks are not taken while too many completed
+        chunks are waiting to be observed.
+        """
+        if self.retry:
+            return self.retry.popleft ()
+        elif self.chunks is None:
+            return None
+        elif self.ordered and len (self.results) >= self.window * len (self.peers):
+            return None
+
+        chunk = next (self.chunks, None)
+        if chunk is None:
+            self.chunks = None
+        return chunk
+
+    def send (self, peer, chunk):
+        """Send chunk to connection
+        """
+        index, items = chunk
+        cancel, cancel_source = FutureSourcePair ()
+        peer.chunks [index] = items, cancel_source
+        try:
+            request = peer.conn (MapChunk) (self.fn, items).Await (cancel)
+        except HubError:
+            # connection is gone
+            peer.alive = False
+            self.reschedule (peer)
+            return
+
+        def request_cont (result, error):
+            if peer.chunks.pop (index, None) is None:
+                return # chunk has been rescheduled or map is finished
+            if error is None:
+                self.observe (index, result)
+                self.schedule ()
+            else:
+                self.finish (error)
+        request.Then (request_cont)
+
+    def dead (self, peer):
+        """Connection has been disposed, reschedule its chunks
+        """
+        peer.alive = False
+        if self.finished or not peer.chunks:
+            return
+        self.reschedule (peer)
+        self.schedule ()
+
+    def reschedule (self, peer):
+        """Move in-flight chunks of connection to retry queue
+
+        Requests of these chunks are canceled to free their reply slots.
+        """
+        chunks = sorted (peer.chunks.items (), key = lambda chunk: chunk [0])
+        peer.chunks.clear ()
+        for index, (items, cancel_source) in chunks:
+            self.retry.append ((index, items))
+            cancel_source.TrySetResult (None)
+
+    #--------------------------------------------------------------------------#
+    # Observe                                                                  #
+    #--------------------------------------------------------------------------#
+    def observe (self, index, values):
+        """Observe mapped chunk
+        """
+        if not self.ordered:
+            for value in values:
+                self.observer.OnNext (value)
+            return
+
+        self.results [index] = values
+        while self.index in self.results:
+            for value in self.results.pop (self.index):
+                self.observer.OnNext (value)
+            self.index += 1
+
+    def finish (self, error = None):
+        """Finish map, cancel in-flight chunks and notify observer
+        """
+        if self.finished:
+            return
+        self.finished = True
+
+        for peer in self.peers:
+            chunks = list (peer.chunks.values ())
+            peer.chunks.clear ()
+            for items, cancel_source in chunks:
+                cancel_source.TrySetResult (None)
+            if peer.watch is not None and not peer.watch.IsDisposed ():
+                peer.conn.dispose.Remove (peer.watch)
+
+        if error is None:
+            self.observer.OnCompleted ()
+        else:
+            self.observer.OnError (error)
+
+    #--------------------------------------------------------------------------#
+    # Disposable                                                               #
+    #--------------------------------------------------------------------------#
+    def Dispose (self):
+        """Stop map without notifying observer
+        """
+        self.observer = AnonymousObserver ()
+        self.finish ()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, et, eo, tb):
+        self.Dispose ()
+        return False
+
+#------------------------------------------------------------------------------#
+# Map Peer                                                                     #
+#------------------------------------------------------------------------------#
+class MapPeer (object):
+    """Connection with its in-flight chunks
+    """
+    __slots__ = ('conn', 'chunks', 'watch', 'alive',)
+
+    def __init__ (self, conn):
+        self.conn = conn
+        self.chunks = {} # index -> items, cancel source
+        self.watch = None
+        self.alive = True
+
+#------------------------------------------------------------------------------#
+# Chunks                                                                       #
+#------------------------------------------------------------------------------#
+def map_chunks (items, chunk_size):
+    """Split items into tuples of chunk_size items
+    """
+    iterator = iter (items)
+    while True:
+        chunk = tuple (itertools.islice (iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def MapChunk (fn, items):
+    """Map function over chunk of items (executed by remote side)
+    """
+    return [fn (item) for item in items]
+
+# vim: nu ft=python columns=120 :
@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
+import sys
 
-from .hub import ReceiverSenderPair
+from .hub import Sender, HubError, ReceiverSenderPair
 from .result import Result, ResultPrintException
 from .expr import (LoadArgExpr, LoadConstExpr, CallExpr, GetAttrExpr, SetAttrExpr,
-                   GetItemExpr, SetItemExpr, AwaitExpr, Code)
+                   GetItemExpr, SetItemExpr, AwaitExpr, Code, CodeTemplate, CodeCall)
+from ..async import Async, AsyncReturn, FutureSourcePair
+from ..observer import Observable
+from ..disposable import Disposable
 
-__all__ = ('Proxy', 'Proxify',)
+__all__ = ('Proxy', 'ProxyBatch', 'ProxyStream', 'Proxify',)
 #------------------------------------------------------------------------------#
 # Proxy                                                                        #
 #------------------------------------------------------------------------------#
@@ -25,21 +29,29 @@ class Proxy (object):
     #--------------------------------------------------------------------------#
     # Awaitable                                                                #
     #--------------------------------------------------------------------------#
-    def Await (self):
+    def Await (self, cancel = None, timeout = None):
         """Get awaitable
 
-        Resolves to result of expression execution.
+        Resolves to result of expression execution. If destination is under
+        pressure (see ``Sender.Ready``), request is postponed until it is ready
+        to accept more messages. Request can be canceled with ``cancel`` future
+        or ``timeout`` (see ``Sender.Request``).
         """
         if self.sender is None:
             raise ValueError ('Proxy is disposed')
 
-        # try to use cached code if any
+        # try to use cached code if any, constants are sent as arguments of
+        # shared template (see ``CodeTemplate``)
         if self.code is None:
             code = Code ()
             self.expr.Compile (code)
-            object.__setattr__ (self, 'code', code)
+            template, args = CodeTemplate (code)
+            object.__setattr__ (self, 'code', CodeCall (template, args) if args else code)
 
-        return self.sender.Request (self.code)
+        ready = self.sender.Ready ()
+        if ready is not None and not ready.IsCompleted ():
+            return ProxyRequestReady (self.sender, self.code, ready, cancel, timeout)
+        return self.sender.Request (self.code, cancel, timeout)
 
     #--------------------------------------------------------------------------#
     # Operations                                                               #
@@ -138,6 +150,273 @@ class Proxy (object):
             object.__setattr__ (self, 'sender', None)
         return False
 
+#------------------------------------------------------------------------------#
+# Request Ready                                                                #
+#------------------------------------------------------------------------------#
+@Async
+def ProxyRequestReady (sender, code, ready, cancel = None, timeout = None):
+    """Send request once destination is ready
+    """
+    while ready is not None and not ready.IsCompleted ():
+        # destination may become busy again by other postponed requests
+        yield ready
+        ready = sender.Ready ()
+    AsyncReturn ((yield sender.Request (code, cancel, timeout)))
+
+#------------------------------------------------------------------------------#
+# Proxy Batch                                                                  #
+#------------------------------------------------------------------------------#
+class ProxyBatch (object):
+    """Batch of proxy expressions
+
+    Expressions added to the batch are evaluated by single request, which is
+    sent once batch is awaited (or its scope is left). Each expression has its
+    own future resolved with result or error of this expression. All proxies
+    of the batch must have the same destination.
+    """
+    def __init__ (self, sender = None):
+        self.sender = sender
+        self.codes = []
+        self.sources = []
+
+    #--------------------------------------------------------------------------#
+    # Add                                                                      #
+    #--------------------------------------------------------------------------#
+    def __call__ (self, proxy):
+        """Add proxy expression to the batch
+
+        Returns future resolved with result of the expression.
+        """
+        if proxy.sender is None:
+            raise ValueError ('Proxy is disposed')
+        elif self.sender is None:
+            self.sender = proxy.sender
+        elif tuple (self.sender.dst) != tuple (proxy.sender.dst):
+            # senders are equal if their last hops are, full route must be compared
+            raise ValueError ('Proxy destination differs from batch destination')
+
+        code = proxy.code
+        if code is None:
+            code = Code.FromExpr (proxy.expr)
+        future, source = FutureSourcePair ()
+        self.codes.append (code)
+        self.sources.append (source)
+        return future
+
+    def __len__ (self):
+        return len (self.codes)
+
+    #--------------------------------------------------------------------------#
+    # Send                                                                     #
+    #--------------------------------------------------------------------------#
+    @Async
+    def Send (self):
+        """Send pending expressions of the batch with single request
+        """
+        codes, self.codes = self.codes, []
+        sources, self.sources = self.sources, []
+        if not codes:
+            return
+
+        try:
+            results = yield self.sender.Request (Code.FromExpr (AwaitExpr (CallExpr (
+                LoadConstExpr (ProxyBatchExecute), LoadArgExpr (0), *codes))))
+        except Exception:
+            for source in sources:
+                source.TrySetCurrentError ()
+            raise
+
+        for source, result in zip (sources, results):
+            try:
+                source.SetResult (result ())
+            except Exception:
+                source.SetCurrentError ()
+
+    #--------------------------------------------------------------------------#
+    # Awaitable                                                                #
+    #--------------------------------------------------------------------------#
+    def Await (self):
+        """Get awaiter
+        """
+        return self.Send ()
+
+    #--------------------------------------------------------------------------#
+    # Scope                                                                    #
+    #--------------------------------------------------------------------------#
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, et, eo, tb):
+        """Leave batch scope
+
+        Pending expressions are sent, unless scope is left with an error.
+        """
+        if et is None:
+            self.Send ().Traceback ('ProxyBatch::Send')
+        return False
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [addr:{} pending:{}]>'.format (type (self).__name__,
+            self.sender.dst if self.sender else None, len (self.codes))
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+@Async
+def ProxyBatchExecute (target, *codes):
+    """Execute codes of the batch
+
+    Returns tuple of results of each code.
+    """
+    futures = [code (target) for code in codes]
+    results = []
+    for future in futures:
+        try:
+            results.append (Result ().SetResult ((yield future)))
+        except Exception:
+            results.append (Result ().SetCurrentError ())
+    AsyncReturn (tuple (results))
+
+#------------------------------------------------------------------------------#
+# Proxy Stream                                                                 #
+#------------------------------------------------------------------------------#
+class ProxyStream (Observable):
+    """Stream of items of remote iterable
+
+    Proxy expression is evaluated to an iterable (i.g. generator) on remote
+    side, which pushes its items in chunks of ``chunk_size`` items. At most
+    ``window`` chunks are in-flight, as remote side waits for consumed chunks
+    to be acknowledged, so memory usage is bounded on both sides. Each
+    subscription starts its own iteration, which is stopped once subscription
+    is disposed.
+    """
+    default_chunk_size = 1024
+    default_window     = 4
+
+    def __init__ (self, proxy, chunk_size = None, window = None):
+        self.proxy = proxy
+        self.chunk_size = chunk_size or self.default_chunk_size
+        self.window = window or self.default_window
+
+    #--------------------------------------------------------------------------#
+    # Observable                                                               #
+    #--------------------------------------------------------------------------#
+    def Subscribe (self, observer):
+        """Subscribe observer
+        """
+        sender = self.proxy.sender
+        if sender is None:
+            raise ValueError ('Proxy is disposed')
+
+        receiver, consumer = ReceiverSenderPair (hub = getattr (sender, 'hub', None))
+        producer = [None] # credits sender of remote side
+        cancel, cancel_source = FutureSourcePair ()
+
+        def consumer_handler (msg, src, dst):
+            if cancel.IsCompleted ():
+                return False # disposed
+            if isinstance (msg, Sender):
+                producer [0] = msg
+                return True
+            try:
+                for item in msg:
+                    if cancel.IsCompleted ():
+                        return False # disposed by observer, chunk is not acknowledged
+                    observer.OnNext (item)
+            except Exception:
+                cancel_source.TrySetResult (None)
+                observer.OnError (sys.exc_info ())
+                return False
+            try:
+                producer [0].Send (1) # chunk has been consumed
+            except HubError: pass # remote side is gone
+            return True
+        receiver.On (consumer_handler)
+
+        def request_cont (result, error):
+            receiver.Off (consumer_handler)
+            if cancel.IsCompleted ():
+                return # disposed
+            cancel_source.TrySetResult (None)
+            if error is None:
+                observer.OnCompleted ()
+            else:
+                observer.OnError (error)
+
+        try:
+            Proxy (sender, AwaitExpr (CallExpr (LoadConstExpr (ProxyStreamExecute), self.proxy.expr,
+                consumer, self.chunk_size, self.window))).Await (cancel).Then (request_cont)
+        except Exception:
+            receiver.Off (consumer_handler)
+            raise
+        return Disposable (lambda: cancel_source.TrySetResult (None))
+
+    #--------------------------------------------------------------------------#
+    # To String                                                                #
+    #--------------------------------------------------------------------------#
+    def __str__ (self):
+        """String representation
+        """
+        return '<{} [chunk:{} window:{} proxy:{}]>'.format (type (self).__name__,
+            self.chunk_size, self.window, self.proxy)
+
+    def __repr__ (self):
+        """String representation
+        """
+        return str (self)
+
+@Async
+def ProxyStreamExecute (iterable, consumer, chunk_size, window):
+    """Push items of iterable to consumer
+
+    Consumer receives sender for acknowledgments first, and then chunks of
+    items. Each chunk costs one credit of the window, credits are returned
+    by acknowledgments.
+    """
+    receiver, producer = ReceiverSenderPair (hub = consumer.hub)
+    credit = [window, None] # available credits, source awaiting credits
+
+    def producer_handler (msg, src, dst):
+        credit [0] += msg
+        source, credit [1] = credit [1], None
+        if source is not None:
+            source.TrySetResult (None)
+        return True
+    receiver.On (producer_handler)
+
+    try:
+        consumer.Send (producer)
+        iterator = iter (iterable)
+        while True:
+            if not credit [0]:
+                future, credit [1] = FutureSourcePair ()
+                yield future
+                continue
+
+            chunk = []
+            try:
+                for item in iterator:
+                    chunk.append (item)
+                    if len (chunk) >= chunk_size:
+                        break
+            except Exception:
+                if chunk:
+                    consumer.Send (tuple (chunk)) # items preceding the error
+                raise
+            if not chunk:
+                break
+            credit [0] -= 1
+            consumer.Send (tuple (chunk))
+    finally:
+        receiver.Off (producer_handler)
+
 #------------------------------------------------------------------------------#
 # Proxify                                                                      #
 #------------------------------------------------------------------------------#
@@ -171,7 +450,10 @@ def Proxify (target, dispose = None, hub = None):
                 # exception has happened.
                 ResultPrintException (*error)
 
-        msg (target).Then (proxy_cont)
+        future = msg (target)
+        if src is not None:
+            src.hub.Pending (src, future) # can be canceled by requester
+        future.Then (proxy_cont)
         return True
 
     receiver.On (proxy_handler)
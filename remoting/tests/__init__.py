@@ -6,10 +6,10 @@ __all__ = tuple ()
 #------------------------------------------------------------------------------#
 def load_tests (loader, tests, pattern):
     from unittest import TestSuite
-    from . import hub, result, expr, proxy, conn
+    from . import hub, result, expr, proxy, conn, parallel
 
     suite = TestSuite ()
-    for test in (hub, result, expr, proxy, conn,):
+    for test in (hub, result, expr, proxy, conn, parallel,):
         suite.addTests (loader.loadTestsFromModule (test))
 
     return suite
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
 
 from ...async import Async, AsyncReturn, Event
 
-__all__ = ('Remote', 'RemoteError',)
+__all__ = ('Remote', 'RemoteError', 'CacheHome',)
 #------------------------------------------------------------------------------#
 # Remote                                                                       #
 #------------------------------------------------------------------------------#
@@ -45,6 +48,15 @@ class Remote (object):
     def Error (self, error):
         raise error
 
+    #--------------------------------------------------------------------------#
+    # Iterate                                                                  #
+    #--------------------------------------------------------------------------#
+    def Iterate (self, count, error = None):
+        for index in range (count):
+            yield index
+        if error is not None:
+            raise error
+
     #--------------------------------------------------------------------------#
     # Await                                                                    #
     #--------------------------------------------------------------------------#
@@ -55,4 +67,39 @@ class Remote (object):
     def Await (self):
         return self.event.Await ().ChainResult (lambda r: r [0])
 
+#------------------------------------------------------------------------------#
+# Cache Home                                                                   #
+#------------------------------------------------------------------------------#
+class CacheHome (object):
+    """Temporary cache home directory
+
+    Overrides ``XDG_CACHE_HOME`` (inherited by spawned peers) until disposed, so
+    bootstrap payloads and imported modules are not cached in user directory.
+    """
+    def __init__ (self):
+        self.path = tempfile.mkdtemp ()
+        self.env = os.environ.get ('XDG_CACHE_HOME')
+        os.environ ['XDG_CACHE_HOME'] = self.path
+
+    @property
+    def Path (self):
+        return self.path
+
+    def Dispose (self):
+        path, self.path = self.path, None
+        if path is None:
+            return
+        if self.env is None:
+            os.environ.pop ('XDG_CACHE_HOME', None)
+        else:
+            os.environ ['XDG_CACHE_HOME'] = self.env
+        shutil.rmtree (path)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, et, eo, tb):
+        self.Dispose ()
+        return False
+
 # vim: nu ft=python columns=120 :
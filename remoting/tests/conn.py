@@ -1,16 +1,44 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
+import pickle
+import socket
+import importlib
+import struct
+import shutil
+import tempfile
 import unittest
 
-from .common import Remote, RemoteError
-from ..conn import ForkConnection
-from ..conn.conn import ConnectionProxy
-from ..proxy import Proxy
-from ..hub import ReceiverSenderPair
-from ...async import Idle
+from .common import Remote, RemoteError, CacheHome
+from ..conn import (ForkConnection, ShellConnection, SocketConnection, SocketListener,
+                    SocketSecretPath, ConnectionPool, Zygote)
+from ..conn.conn import Connection, ConnectionProxy
+from ..conn.stream import BatchFrames
+from ..conn.compress import Compressor
+from ..conn.codes import CodeCache
+from ..conn.shared import SharedRingPair, SharedMemoryFile
+from ..proxy import Proxy, ProxyBatch, ProxyStream
+from ..expr import Code, CallExpr, LoadConstExpr
+from ..hub import Hub, ReceiverSenderPair
+from ..importer import Importer, ImporterCache, ImporterProxy
+from ...async import Idle, Future, Core, FutureSourcePair, FutureCanceled
 from ...async.tests import AsyncTest
+from ...config import ConfigDict
+from ...observer.utils import AnonymousObserver
 
 __all__ = ('ConnectionTest',)
+#------------------------------------------------------------------------------#
+# Module Fixture                                                               #
+#------------------------------------------------------------------------------#
+cache_home = None
+
+def setUpModule ():
+    global cache_home
+    cache_home = CacheHome ()
+
+def tearDownModule ():
+    cache_home.Dispose ()
+
 #------------------------------------------------------------------------------#
 # Connection Test                                                              #
 #------------------------------------------------------------------------------#
@@ -85,4 +113,515 @@ class ConnectionTest (unittest.TestCase):
         with (yield ForkConnection ()) as conn:
             self.assertEqual ((yield conn (s)), s)
 
+    @AsyncTest
+    def testBatch (self):
+        """Batched messages test
+        """
+        with (yield ForkConnection ()) as conn:
+            conn.batch_size = 256 # force some batches to be flushed early
+            futures = [conn (str) (index).Await () for index in range (1024)]
+            yield Future.All (futures)
+            self.assertEqual ([future.Result () for future in futures],
+                              [str (index) for index in range (1024)])
+
+    @AsyncTest
+    def testProxyBatch (self):
+        """Proxy batch over connection test
+        """
+        with (yield ForkConnection ()) as conn:
+            with (yield +conn (Remote) (1)) as first, (yield +conn (Remote) (2)) as second:
+                # connection batch only accepts proxies targeting connection
+                batch = conn.Batch ()
+                pid = batch (conn (os.getpid) ())
+                with self.assertRaises (ValueError):
+                    batch (first.Value ())
+                yield batch
+                self.assertEqual ((yield pid), conn.Process.pid)
+
+                # proxies of different remote objects cannot be mixed
+                batch = ProxyBatch ()
+                value = batch (first.Value ())
+                with self.assertRaises (ValueError):
+                    batch (second.Value ())
+                yield batch
+                self.assertEqual ((yield value), 1)
+
+    @AsyncTest
+    def testSerializer (self):
+        """Connection serializer test
+        """
+        with Connection () as conn:
+            serializer = conn.serializer
+            for protocol in range (serializer.Protocol (), pickle.HIGHEST_PROTOCOL + 1):
+                serializer.Protocol (protocol)
+                for msg in (('message', None, 1), [1, 'one'] * 2, {'key': conn.sender}):
+                    self.assertEqual (serializer.Load (*serializer.Dump (msg)), msg)
+
+            # serializer must be usable after failure
+            with self.assertRaises (Exception):
+                serializer.Dump (lambda: None)
+            with self.assertRaises (Exception):
+                serializer.Load (b'bad pickle')
+            self.assertEqual (serializer.Load (*serializer.Dump ('message')), 'message')
+
+        # negotiated protocol
+        with (yield ForkConnection ()) as conn:
+            self.assertEqual (conn.serializer.Protocol (), pickle.HIGHEST_PROTOCOL)
+            self.assertEqual ((yield conn.Proxy ().serializer.protocol), pickle.HIGHEST_PROTOCOL)
+
+    @AsyncTest
+    def testLargeMessage (self):
+        """Large message test
+        """
+        data = os.urandom (1 << 22)
+        with (yield ForkConnection ()) as conn:
+            self.assertEqual ((yield conn (bytes) (data)), data)
+            self.assertEqual ((yield conn (len) (data)), len (data))
+
+    def testBatchFrames (self):
+        """Batch frames decoding test
+        """
+        frames = [b'first', b'', b'third' * 1024]
+        batch = b''.join (struct.pack ('>IB', len (frame), index) + frame
+            for index, frame in enumerate (frames))
+        self.assertEqual ([(flags, frame.tobytes ()) for flags, frame in BatchFrames (batch)],
+                          list (enumerate (frames)))
+
+        with self.assertRaises (ValueError):
+            list (BatchFrames (batch [:-1]))
+
+    def testCompressor (self):
+        """Frame compressor test
+        """
+        compressor = Compressor (threshold = 1024, backoff = 2)
+        frame = b'frame' * 1024
+        self.assertEqual (compressor.Compress (frame), None) # disabled
+        compressor.Enable ()
+
+        # threshold
+        self.assertEqual (compressor.Compress (frame [:1023]), None)
+
+        # compressible
+        data = compressor.Compress (frame)
+        self.assertTrue (len (data) < len (frame))
+        self.assertEqual (compressor.Decompress (memoryview (data)), frame)
+        self.assertEqual (compressor.Saved, len (frame) - len (data))
+
+        # incompressible frames suspend compression
+        noise = os.urandom (4096)
+        self.assertEqual (compressor.Compress (noise), None)
+        self.assertEqual (compressor.frames_poor, 1)
+        self.assertEqual ([compressor.Compress (frame) for _ in range (2)], [None, None])
+        self.assertNotEqual (compressor.Compress (frame), None)
+
+    @AsyncTest
+    def testCompress (self):
+        """Compressed connection test
+        """
+        conn = ForkConnection ()
+        conn.compress = 1
+        with (yield conn):
+            data = b'data' * (1 << 16)
+            self.assertEqual ((yield conn (bytes) (data)), data)
+            self.assertTrue (conn.compressor.Saved > 0)
+            self.assertTrue ((yield conn.Proxy ().compressor.Saved) > 0)
+
+    @AsyncTest
+    def testCodeCache (self):
+        """Code cache test
+        """
+        with Connection () as conn:
+            code = Code.FromExpr (CallExpr (LoadConstExpr (pow), 2, 10))
+            frame, buffers = conn.handle (code, None, conn.sender.dst)
+            frame_cached, buffers = conn.handle (code, None, conn.sender.dst)
+            self.assertTrue (len (frame_cached) < len (frame))
+            for frame in (frame, frame_cached):
+                msg, src, dst = conn.serializer.Load (frame)
+                self.assertEqual ((yield msg ()), 1024)
+            self.assertTrue (msg is conn.serializer.Load (frame_cached) [0])
+
+            # code with mutable constants is not cached
+            code = Code.FromExpr (CallExpr (LoadConstExpr (len), []))
+            self.assertEqual (len (conn.handle (code, None, conn.sender.dst) [0]),
+                              len (conn.handle (code, None, conn.sender.dst) [0]))
+
+        # code evicted by remote peer is sent again, even though other sent
+        # codes have been collected
+        cache = CodeCache (capacity = 4)
+        code = Code.FromExpr (CallExpr (LoadConstExpr (pow), 2, 10))
+        cache.Unpack (*cache.Pack (code))
+        for index in range (32):
+            cache.Unpack (*cache.Pack (Code.FromExpr (CallExpr (LoadConstExpr (pow), 2, index))))
+        self.assertEqual (cache.Pack (code) [1], list (code))
+        self.assertEqual (cache.Unpack (*cache.Pack (code)), code)
+
+        with (yield ForkConnection ()) as conn:
+            method = conn (pow) (2, 10)
+            for _ in range (3):
+                self.assertEqual ((yield method), 1024)
+
+    @AsyncTest
+    def testBuffers (self):
+        """Out-of-band buffers test
+        """
+        with Connection () as conn:
+            conn.buffer_threshold = 16
+            data = (b'small', b'large' * 4, bytearray (b'mutable' * 4))
+            frame, buffers = conn.serializer.Dump (data)
+            self.assertEqual (buffers, list (data [1:]))
+            self.assertTrue (data [1] not in frame)
+            result = conn.serializer.Load (frame, buffers)
+            self.assertEqual (result, data)
+            self.assertEqual (type (result [2]), bytearray)
+
+        with (yield ForkConnection ()) as conn:
+            data = os.urandom (conn.buffer_threshold)
+            futures = [conn (len) (data).Await (), conn (str) (1).Await (),
+                       conn (bytearray) (data).Await (), conn (tuple) ((data, data)).Await ()]
+            yield Future.All (futures)
+            self.assertEqual ([future.Result () for future in futures],
+                              [len (data), '1', bytearray (data), (data, data)])
+
+    def testSharedRing (self):
+        """Shared memory ring test
+        """
+        fd = SharedMemoryFile (64)
+        try:
+            first_in, first_out = SharedRingPair (fd, 32, True)
+            second_in, second_out = SharedRingPair (fd, 32, False)
+        finally:
+            os.close (fd)
+
+        self.assertTrue (first_out.Write (b'0123456789'))
+        self.assertTrue (first_out.Write (bytearray (b'abcdefghij')))
+        self.assertFalse (first_out.Write (b'ring is full'))
+        self.assertEqual (second_in.Read (10), b'0123456789')
+        self.assertTrue (first_out.Write (b'wrapped')) # wraps around the end
+        self.assertEqual (second_in.Read (10), b'abcdefghij')
+        self.assertEqual (second_in.Read (7), b'wrapped')
+
+        # other direction
+        self.assertTrue (second_out.Write (b'reply'))
+        self.assertEqual (first_in.Read (5), b'reply')
+
+        # unaligned size
+        fd = SharedMemoryFile (66)
+        try:
+            with self.assertRaises (ValueError):
+                SharedRingPair (fd, 33, True)
+        finally:
+            os.close (fd)
+
+    @AsyncTest
+    def testShared (self):
+        """Shared memory fork connection test
+        """
+        with (yield ForkConnection (shared = 1 << 20)) as conn:
+            data = os.urandom (conn.shared_threshold)
+            for _ in range (8):
+                futures = [conn (bytes) (data).Await (), conn (bytearray) (data).Await (),
+                           conn (str) (1).Await ()]
+                yield Future.All (futures)
+                self.assertEqual ([future.Result () for future in futures],
+                                  [data, bytearray (data), '1'])
+            self.assertTrue (conn.shared_out.position > 0)
+            self.assertTrue (conn.shared_in.position > 0)
+
+            # larger than the ring
+            data = os.urandom (1 << 21)
+            self.assertEqual ((yield conn (bytes) (data)), data)
+
+    @AsyncTest
+    def testReady (self):
+        """Connection backpressure test
+        """
+        conn = ForkConnection ()
+        conn.high_watermark, conn.low_watermark = 1 << 20, 1 << 16
+        conn.ready_wait = True
+        with (yield conn):
+            self.assertTrue (conn.Ready ().IsCompleted ())
+
+            # first request exceeds high watermark, the rest are postponed
+            data = b'\x00' * (1 << 21)
+            futures = [conn (len) (data).Await () for _ in range (4)]
+            self.assertFalse (conn.Ready ().IsCompleted ())
+            self.assertTrue (conn.Pending < (1 << 21) + (1 << 20))
+
+            yield Future.All (futures)
+            self.assertEqual ([future.Result () for future in futures], [len (data)] * 4)
+            yield conn.Ready ()
+            self.assertTrue (conn.Pending <= conn.low_watermark)
+        self.assertFalse (conn.hub.gates)
+
+    @AsyncTest
+    def testPool (self):
+        """Connection pool test
+        """
+        with (yield ConnectionPool (size = 2)) as pool:
+            self.assertEqual (len (pool.Members), 2)
+            pids = set ((yield Future.All ([pool (os.getpid) ().Await () for _ in range (16)])))
+            self.assertEqual (pids, set (conn.Process.pid for conn in pool.Members))
+            self.assertEqual ([member.load for member in pool.members], [0, 0])
+
+            # dead member is replaced
+            dead = pool.Members [0]
+            dead.Dispose ()
+            for _ in range (100):
+                if len (pool.Members) == 2:
+                    break
+                yield Core.Instance ().TimeDelay (0.1)
+            self.assertEqual (len (pool.Members), 2)
+            self.assertFalse (dead in pool.Members)
+            self.assertEqual (len (set ((yield Future.All ([pool (os.getpid) ().Await ()
+                for _ in range (16)])))), 2)
+
+        self.assertFalse (pool.Members)
+        self.assertFalse (Hub.Instance ().handlers)
+
+    @AsyncTest
+    def testZygote (self):
+        """Zygote connection test
+        """
+        with (yield Zygote ()) as zygote:
+            conns = yield Future.All ([zygote.Connection ().Await () for _ in range (2)])
+            try:
+                for conn in conns:
+                    self.assertEqual ((yield conn (os.getpid) ()), conn.Pid)
+                    self.assertEqual ((yield conn (os.getppid) ()), zygote.Process.pid)
+                    with (yield +conn (Remote) (0)) as proxy:
+                        self.assertEqual ((yield proxy ('test')), 'test')
+                self.assertNotEqual (conns [0].Pid, conns [1].Pid)
+            finally:
+                for conn in conns:
+                    conn.Dispose ()
+
+        self.assertFalse (Hub.Instance ().handlers)
+
+    @AsyncTest
+    def testShellCache (self):
+        """Shell connection bootstrap cache test
+        """
+        with CacheHome () as cache_home:
+            cache = os.path.join (cache_home.Path, 'pretzel')
+            for cached in (False, True):
+                with (yield ShellConnection ()) as conn:
+                    self.assertEqual (conn.Cached, cached)
+                    self.assertEqual ((yield conn (os.getppid) ()), os.getpid ())
+            self.assertEqual (len ([entry for entry in os.listdir (cache)
+                if os.path.isfile (os.path.join (cache, entry))]), 1)
+
+    @AsyncTest
+    def testLazy (self):
+        """Lazy tomb connection test
+        """
+        package = __package__.partition ('.') [0]
+        name = '.'.join ((package, 'config'))
+        with (yield ForkConnection (lazy = True)) as conn:
+            self.assertEqual ((yield conn (tomb_has) (name)), False)
+            self.assertEqual ((yield conn (import_has) (name)), True)
+            self.assertEqual ((yield conn (tomb_has) (name)), True)
+
+        # peer cannot fall back to package sources on disk
+        command = ['/bin/sh', '-c', 'cd / && exec "$0" -E -', sys.executable]
+        with (yield ForkConnection (command = command, lazy = True)) as conn:
+            self.assertEqual ((yield conn (sources_visible) (package)), False)
+            self.assertEqual ((yield conn (os.getppid) ()), os.getpid ())
+            items, (future, source) = [], FutureSourcePair ()
+            ProxyStream (conn (range) (10)).Subscribe (
+                AnonymousObserver (items.append, source.TrySetError, lambda: source.TrySetResult (None)))
+            yield future
+            self.assertEqual (items, list (range (10)))
+
+        # concurrent calls share code which imports module on unpacking, second
+        # call carries only code id and must wait for the first one
+        with (yield ForkConnection (lazy = True)) as conn:
+            futures = [conn (getattr) (ConfigDict, '__name__').Await () for _ in range (2)]
+            yield Future.All (futures)
+            self.assertEqual ([future.Result () for future in futures], ['ConfigDict'] * 2)
+
+    @AsyncTest
+    def testRequestTimeout (self):
+        """Request timeout test
+        """
+        with (yield ForkConnection ()) as conn:
+            with self.assertRaises (FutureCanceled):
+                yield (~conn (hang) ()).Await (timeout = 0.1)
+            self.assertFalse (conn.hub.replies)
+
+            # remote execution has been canceled
+            self.assertEqual ((yield conn (pending_count) ()), 0)
+
+    @AsyncTest
+    def testSocket (self):
+        """Socket connection test
+        """
+        path = tempfile.mkdtemp ()
+        try:
+            for address in (os.path.join (path, 'socket'), ('127.0.0.1', 0)):
+                with (yield SocketListener (address)) as listener:
+                    for _ in range (2):
+                        with (yield SocketConnection (listener.Address)) as conn:
+                            self.assertEqual ((yield conn (os.getpid) ()), os.getpid ())
+                            self.assertEqual ((yield conn (str) (address)), str (address))
+                self.assertFalse (listener.Connections)
+            self.assertFalse (os.listdir (path))
+
+            # stale unix domain socket is replaced, live one is not
+            address = os.path.join (path, 'socket')
+            stale = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind (address)
+            stale.close ()
+            with (yield SocketListener (address)) as listener:
+                with (yield SocketConnection (address)) as conn:
+                    self.assertEqual ((yield conn (os.getpid) ()), os.getpid ())
+                with self.assertRaises (socket.error):
+                    yield SocketListener (address)
+                self.assertTrue (os.path.exists (address))
+
+            # tcp listener is bound to loopback address only
+            for host in ('0.0.0.0', '', 'localhost', '::'):
+                with self.assertRaises (ValueError):
+                    yield SocketListener ((host, 0))
+
+            # tcp peers are authenticated with secret stored in owner-only file
+            with (yield SocketListener (('127.0.0.1', 0))) as listener:
+                secret_path = SocketSecretPath (listener.Address)
+                self.assertEqual (os.stat (secret_path).st_mode & 0o777, 0o600)
+                with self.assertRaises (ValueError):
+                    yield SocketConnection (listener.Address, secret = b'wrong')
+                with (yield SocketConnection (listener.Address)) as conn:
+                    self.assertEqual ((yield conn (os.getpid) ()), os.getpid ())
+            self.assertFalse (os.path.exists (secret_path))
+
+            with (yield SocketListener (('127.0.0.1', 0), secret = b'secret')) as listener:
+                self.assertFalse (os.path.exists (SocketSecretPath (listener.Address)))
+                with (yield SocketConnection (listener.Address, secret = b'secret')) as conn:
+                    self.assertEqual ((yield conn (os.getpid) ()), os.getpid ())
+                with self.assertRaises (ValueError):
+                    yield SocketConnection (listener.Address, secret = b'wrong')
+        finally:
+            shutil.rmtree (path)
+
+    @AsyncTest
+    def testStream (self):
+        """Remote iterable streaming test
+        """
+        with (yield ForkConnection ()) as conn:
+            items, (future, source) = [], FutureSourcePair ()
+            ProxyStream (conn (range) (1000), chunk_size = 64, window = 2).Subscribe (
+                AnonymousObserver (items.append, source.TrySetError, lambda: source.TrySetResult (None)))
+            yield future
+            self.assertEqual (items, list (range (1000)))
+
+            # disposed in the middle of a chunk
+            items, subscription = [], []
+            disposed, disposed_source = FutureSourcePair ()
+            def on_next (item):
+                items.append (item)
+                if item == 10:
+                    subscription [0].Dispose ()
+                    disposed_source.TrySetResult (None)
+            subscription.append (ProxyStream (conn (range) (1000), chunk_size = 4, window = 2).Subscribe (
+                AnonymousObserver (on_next)))
+            yield disposed
+            for _ in range (4):
+                yield conn (os.getpid) () # chunks in-flight are delivered meanwhile
+            self.assertEqual (items, list (range (11)))
+
+    @AsyncTest
+    def testImporterPrefetch (self):
+        """Importer prefetch test
+        """
+        with Importer () as importer:
+            loaders = yield importer.sender.Request (__package__)
+            names = [loader.name for loader in loaders]
+            self.assertEqual (names [0], __package__)
+            self.assertTrue (__name__ in names)
+            self.assertEqual (len (names), len (set (names)))
+
+            # loaders are not sent twice
+            names_next = [loader.name for loader in (yield importer.sender.Request (__name__))]
+            self.assertEqual (names_next [0], __name__)
+            self.assertFalse (set (names_next [1:]) & set (names))
+
+            self.assertEqual ((yield importer.sender.Request ('no_such_module')), None)
+        self.assertFalse (Hub.Instance ().handlers)
+
+    @AsyncTest
+    def testImporterCache (self):
+        """Importer persistent cache test
+        """
+        path = tempfile.mkdtemp ()
+        try:
+            cache = ImporterCache (path)
+            with Importer () as importer:
+                loader = (yield importer.sender.Request (__name__)) [0]
+                loader.cache = cache
+                code = loader.get_code (__name__)
+            self.assertEqual (cache.Digests (__name__), {__name__: loader.digest})
+
+            # unchanged module is sent without source
+            with Importer () as importer:
+                stub = (yield importer.sender.Request ((__name__, cache.Digests (__name__)))) [0]
+                self.assertEqual (stub.source, None)
+                self.assertTrue (cache.Load (stub))
+                self.assertEqual (stub.source, loader.source)
+                self.assertEqual (stub.code, code)
+
+            # eviction
+            cache.limit = 1
+            cache.Store (stub)
+            self.assertTrue (os.listdir (path))
+            cache.Evict ()
+            self.assertFalse (os.listdir (path))
+            self.assertFalse (cache.Load (stub))
+        finally:
+            shutil.rmtree (path)
+        self.assertFalse (Hub.Instance ().handlers)
+
+        # remote peer cache
+        with (yield ForkConnection ()) as conn:
+            self.assertEqual ((yield conn (importer_cache) ()),
+                os.path.join (cache_home.Path, 'pretzel', 'import'))
+        with (yield ForkConnection (cache = False)) as conn:
+            self.assertEqual ((yield conn (importer_cache) ()), None)
+
+#------------------------------------------------------------------------------#
+# Helpers                                                                      #
+#------------------------------------------------------------------------------#
+def hang ():
+    """Future which is never resolved
+    """
+    return FutureSourcePair () [0]
+
+def pending_count ():
+    """Number of pending requests
+    """
+    return len (Hub.Instance ().pending)
+
+def tomb_has (name):
+    """Check if tomb has source of the module
+    """
+    for finder in sys.meta_path:
+        if hasattr (finder, 'TOMB_UUID'):
+            return name in finder.containments
+
+def import_has (name):
+    """Import module and check if it is imported
+    """
+    importlib.import_module (name)
+    return name in sys.modules
+
+def sources_visible (package):
+    """Check if package sources can be found on disk
+    """
+    return any (os.path.isdir (os.path.join (path or os.curdir, package)) for path in sys.path)
+
+def importer_cache ():
+    """Directory of importer cache (None if importer has no cache)
+    """
+    for finder in sys.meta_path:
+        if isinstance (finder, ImporterProxy):
+            return None if finder.cache is None else finder.cache.Path
+
 # vim: nu ft=python columns=120 :
@@ -2,6 +2,7 @@
 import unittest
 
 from ..expr import *
+from ..expr import OP_POP
 from ...async import Event
 
 __all__ = ('ExprTest',)
@@ -99,6 +100,34 @@ class ExprTest (unittest.TestCase):
         while_expr (cond, body).Result ()
         self.assertEqual (ctx, [0, 4])
 
+    def testCompiled (self):
+        get = Compile (CallExpr (GetAttrExpr (LoadArgExpr (0), 'get'), 'key'))
+        self.assertEqual (get ({'key': 'value'}).Result (), 'value')
+        self.assertTrue (callable (get.compiled))
+        self.assertEqual (get.interpret ({'key': 'value'}).Result (), 'value')
+
+        # code is interpreted if it awaits or jumps
+        self.assertEqual (CodeCompile (Compile (AwaitExpr (LoadArgExpr (0)))), None)
+        self.assertEqual (CodeCompile (Compile (IfExpr (LoadArgExpr (0), 1, 2))), None)
+
+        # emit resets compiled code
+        get.Emit (OP_POP)
+        self.assertEqual (get.compiled, None)
+
+    def testTemplate (self):
+        def call (target, *args, **keys):
+            return target, args, keys
+
+        first, first_args = CodeTemplate (Compile (CallExpr (call, LoadArgExpr (0), 1, key = [2])))
+        second, second_args = CodeTemplate (Compile (CallExpr (call, LoadArgExpr (0), 3, key = [4])))
+        self.assertTrue (first is second)
+        self.assertEqual (first_args, (1, 'key', [2]))
+        self.assertEqual (CodeCall (second, second_args) ('target').Result (), ('target', (3,), {'key': [4]}))
+
+        # code without constants is not a template
+        code = Compile (CallExpr (call, LoadArgExpr (0)))
+        self.assertEqual (CodeTemplate (code), (code, ()))
+
 #------------------------------------------------------------------------------#
 # Compile Helper                                                               #
 #------------------------------------------------------------------------------#
@@ -2,7 +2,9 @@
 import unittest
 import collections
 
-from ..hub import Hub, HubError, Address, Sender, ReceiverSenderPair
+from ..hub import Hub, HubError, Address, Sender, ReceiverSenderPair, RequestCancel
+from ..proxy import Proxify
+from ...async import FutureSourcePair, FutureCanceled
 
 __all__ = ('HubTest',)
 #------------------------------------------------------------------------------#
@@ -148,8 +150,49 @@ class HubTest (unittest.TestCase):
         with self.assertRaises (ValueError):
             f1.Result ()
 
+        # request without receiver
+        with self.assertRaises (HubError):
+            s0.Request ('none')
+
+        # hub
+        self.assertFalse (Hub.Instance ().handlers)
+        self.assertFalse (Hub.Instance ().replies)
+
+    def testRequestCancel (self):
+        """Request cancel tests
+        """
+        r0, s0 = ReceiverSenderPair ()
+        msgs = []
+
+        def handler (msg, src, dst):
+            msgs.append (msg)
+            return True
+        r0.On (handler)
+        try:
+            cancel, cancel_source = FutureSourcePair ()
+            f0 = s0.Request ('request', cancel)
+            self.assertFalse (f0.IsCompleted ())
+            cancel_source.SetResult (None)
+            with self.assertRaises (FutureCanceled):
+                f0.Result ()
+            self.assertTrue (isinstance (msgs [-1], RequestCancel))
+        finally:
+            r0.Off (handler)
+
+        # pending execution is canceled
+        pending, pending_source = FutureSourcePair ()
+        cancel, cancel_source = FutureSourcePair ()
+        with Proxify (pending) as proxy:
+            f1 = (~proxy).Await (cancel)
+            self.assertTrue (Hub.Instance ().pending)
+            cancel_source.SetResult (None)
+            with self.assertRaises (FutureCanceled):
+                f1.Result ()
+            self.assertFalse (Hub.Instance ().pending)
+
         # hub
         self.assertFalse (Hub.Instance ().handlers)
+        self.assertFalse (Hub.Instance ().replies)
 
     def testFaultyHandler (self):
         r, s = ReceiverSenderPair ()
@@ -187,6 +230,47 @@ class HubTest (unittest.TestCase):
 
             self.assertFalse (Hub.Instance ().handlers)
 
+    def testSingleHandler (self):
+        r, s = ReceiverSenderPair ()
+        results = []
+
+        def handler (msg, src, dst):
+            results.append (msg)
+            return msg != 'last'
+        r.On (handler)
+
+        any_future = Hub.Instance ().Await ()
+        s.Send ('first')
+        self.assertTrue (any_future.IsCompleted ())
+        s.Send ('last')
+        self.assertEqual (results, ['first', 'last'])
+
+        # handler returned False
+        with self.assertRaises (HubError):
+            s.Send ('none')
+        self.assertFalse (Hub.Instance ().handlers)
+
+    def testAny (self):
+        hub = Hub ()
+        r, s = ReceiverSenderPair (hub = hub)
+        r.On (lambda msg, src, dst: True)
+
+        messages = []
+        def handler (msg, src, dst):
+            messages.append (msg)
+            return True
+        hub.On (None, handler)
+        s.Send ('first')
+        self.assertTrue (hub.Off (None, handler))
+        self.assertFalse (hub.Off (None, handler))
+        s.Send ('second')
+        self.assertEqual (messages, ['first'])
+
+        any_future = hub.Await ()
+        s.Send ('third')
+        self.assertTrue (any_future.IsCompleted ())
+        self.assertEqual (hub.any_count, 0)
+
     def testReentrancy (self):
         r, s = ReceiverSenderPair ()
         results = []
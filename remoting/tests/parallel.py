@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import unittest
+
+from .common import CacheHome
+from ..conn import ForkConnection
+from ..parallel import Map
+from ...async import Core, Future, FutureSourcePair
+from ...async.tests import AsyncTest
+from ...observer.utils import AnonymousObserver
+
+__all__ = ('ParallelTest',)
+#------------------------------------------------------------------------------#
+# Module Fixture                                                               #
+#------------------------------------------------------------------------------#
+cache_home = None
+
+def setUpModule ():
+    global cache_home
+    cache_home = CacheHome ()
+
+def tearDownModule ():
+    cache_home.Dispose ()
+
+#------------------------------------------------------------------------------#
+# Parallel Test                                                                #
+#------------------------------------------------------------------------------#
+class ParallelTest (unittest.TestCase):
+    """Parallel unit tests
+    """
+    @AsyncTest
+    def testMap (self):
+        """Parallel map test
+        """
+        conns = [ForkConnection () for _ in range (2)]
+        try:
+            yield Future.All ([conn.Connect () for conn in conns])
+
+            # ordered
+            self.assertEqual ((yield Map (str, range (100), conns, chunk_size = 7)),
+                [str (item) for item in range (100)])
+
+            # as completed
+            results = yield Map (str, range (100), conns, chunk_size = 7, window = 3, ordered = False)
+            self.assertEqual (sorted (results), sorted (str (item) for item in range (100)))
+
+            # error of function
+            with self.assertRaises (ValueError):
+                yield Map (int, ['1', 'not a number', '3'], conns, chunk_size = 1)
+
+            # chunks are mapped by remaining connections
+            conns [1].Dispose ()
+            self.assertEqual ((yield Map (str, range (10), conns, chunk_size = 3)),
+                [str (item) for item in range (10)])
+
+            # no connections left
+            conns [0].Dispose ()
+            with self.assertRaises (ValueError):
+                yield Map (str, range (10), conns)
+
+        finally:
+            for conn in conns:
+                conn.Dispose ()
+
+    @AsyncTest
+    def testMapDisposed (self):
+        """Parallel map with connection disposed while its chunks are in-flight
+        """
+        conns = [ForkConnection () for _ in range (2)]
+        try:
+            yield Future.All ([conn.Connect () for conn in conns])
+            yield conns [1] (slow_enable) ()
+
+            results, (future, source) = [], FutureSourcePair ()
+            run = Map (slow_str, range (40), conns, chunk_size = 2).Subscribe (
+                AnonymousObserver (results.append, source.TrySetError, lambda: source.TrySetResult (None)))
+            yield Core.Instance ().TimeDelay (0.3)
+            self.assertTrue (run.peers [1].chunks)
+            self.assertFalse (future.IsCompleted ())
+
+            conns [1].Dispose ()
+            yield future
+            self.assertEqual (results, [str (item) for item in range (40)])
+
+        finally:
+            for conn in conns:
+                conn.Dispose ()
+
+    @AsyncTest
+    def testMapLazy (self):
+        """Parallel map with lazy connection which cannot see package sources
+        """
+        command = ['/bin/sh', '-c', 'cd / && exec "$0" -E -', sys.executable]
+        with (yield ForkConnection (command = command, lazy = True)) as conn:
+            self.assertEqual ((yield Map (str, range (10), [conn], chunk_size = 3)),
+                [str (item) for item in range (10)])
+
+#------------------------------------------------------------------------------#
+# Helpers                                                                      #
+#------------------------------------------------------------------------------#
+slow = False
+
+def slow_enable ():
+    """Make slow_str slow in this process
+    """
+    global slow
+    slow = True
+
+def slow_str (item):
+    """Convert item to string (slowly if enabled)
+    """
+    if slow:
+        time.sleep (0.5)
+    return str (item)
+
+# vim: nu ft=python columns=120 :
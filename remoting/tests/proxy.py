@@ -3,8 +3,10 @@ import unittest
 
 from .common import Remote, RemoteError
 from ..hub import Hub
-from ..proxy import Proxy, Proxify
+from ..proxy import Proxy, ProxyBatch, ProxyStream, Proxify
+from ...async import FutureSourcePair
 from ...async.tests import AsyncTest
+from ...observer.utils import AnonymousObserver
 
 __all__ = ('ProxyTest',)
 #------------------------------------------------------------------------------#
@@ -53,4 +55,50 @@ class ProxyTest (unittest.TestCase):
 
         self.assertFalse (Hub.Instance ().handlers)
 
+    @AsyncTest
+    def testBatch (self):
+        remote = Remote (0)
+        with Proxify (remote) as proxy:
+            batch = ProxyBatch ()
+            value = batch (proxy.value)
+            error = batch (proxy.Error (RemoteError ()))
+            items = batch (proxy.items)
+            self.assertEqual (len (batch), 3)
+            self.assertFalse (value.IsCompleted ())
+
+            yield batch
+            self.assertEqual (len (batch), 0)
+            self.assertEqual ((yield value), 0)
+            with self.assertRaises (RemoteError):
+                yield error
+            self.assertEqual ((yield items), {})
+
+            # scope
+            with ProxyBatch () as batch:
+                value = batch (proxy.Value (1))
+            self.assertEqual ((yield value), 0)
+            self.assertEqual (remote.value, 1)
+
+        self.assertFalse (Hub.Instance ().handlers)
+
+    @AsyncTest
+    def testStream (self):
+        def collect (stream):
+            items, (future, source) = [], FutureSourcePair ()
+            stream.Subscribe (AnonymousObserver (items.append, source.TrySetError,
+                lambda: source.TrySetResult (items)))
+            return future, items
+
+        remote = Remote (0)
+        with Proxify (remote) as proxy:
+            future, items = collect (ProxyStream (proxy.Iterate (10), chunk_size = 3, window = 2))
+            self.assertEqual ((yield future), list (range (10)))
+
+            future, items = collect (ProxyStream (proxy.Iterate (5, RemoteError ()), chunk_size = 2))
+            with self.assertRaises (RemoteError):
+                yield future
+            self.assertEqual (items, list (range (5)))
+
+        self.assertFalse (Hub.Instance ().handlers)
+
 # vim: nu ft=python columns=120 :
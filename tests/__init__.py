@@ -8,10 +8,10 @@ def load_tests (loader, tests, pattern):
     """Load test protocol
     """
     from unittest import TestSuite
-    from . import process, disposable, pool
+    from . import process, disposable, pool, bootstrap
 
     suite = TestSuite ()
-    for test in (process, disposable, pool):
+    for test in (process, disposable, pool, bootstrap):
         suite.addTests (loader.loadTestsFromModule (test))
     return suite
 
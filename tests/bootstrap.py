@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import zlib
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+from ..bootstrap import Tomb
+#------------------------------------------------------------------------------#
+# Tomb                                                                         #
+#------------------------------------------------------------------------------#
+class TombTests (unittest.TestCase):
+    """Tomb unit tests
+    """
+    def setUp (self):
+        self.path = tempfile.mkdtemp ()
+        self.package = os.path.join (self.path, 'tomb_test_package')
+        os.mkdir (self.package)
+        self.mtime = time.time ()
+        self.write ('__init__.py', 'value = 0\n')
+        sys.path.insert (0, self.path)
+
+    def tearDown (self):
+        sys.path.remove (self.path)
+        sys.modules.pop ('tomb_test_package', None)
+        shutil.rmtree (self.path)
+
+    def write (self, name, source):
+        """Write package file
+
+        Each write advances modification time, to be independent from file
+        system time stamps resolution.
+        """
+        filename = os.path.join (self.package, name)
+        with open (filename, 'w') as stream:
+            stream.write (source)
+        self.mtime += 1
+        os.utime (filename, (self.mtime, self.mtime))
+        os.utime (self.package, (self.mtime, self.mtime))
+
+    #--------------------------------------------------------------------------#
+    # Cache                                                                    #
+    #--------------------------------------------------------------------------#
+    def testCache (self):
+        """Test tomb cache
+        """
+        t0 = Tomb.FromModules (('tomb_test_package',))
+        t1 = Tomb.FromModules (('tomb_test_package',))
+        self.assertFalse (t0 is t1)
+        self.assertTrue (t0.ToBytes () is t1.ToBytes ())
+        self.assertTrue (t0.Bootstrap () is not None)
+        self.assertTrue (t0.dumps ['bootstrap'] is t1.dumps ['bootstrap'])
+
+        # modified copy does not affect cache
+        t1.AddSource ('tomb_test_extra', 'value = 1\n', 'extra.py')
+        self.assertTrue ('tomb_test_extra' in Tomb.FromBytes (t1.ToBytes ()).containments)
+        self.assertTrue (t0.ToBytes () is Tomb.FromModules (('tomb_test_package',)).ToBytes ())
+
+        # modified file
+        self.write ('__init__.py', 'value = 1\n')
+        t2 = Tomb.FromModules (('tomb_test_package',))
+        self.assertNotEqual (t0.ToBytes (), t2.ToBytes ())
+        self.assertTrue ('value = 1' in t2.containments ['tomb_test_package'][0])
+
+        # added file
+        self.write ('module.py', 'value = 2\n')
+        t3 = Tomb.FromModules (('tomb_test_package',))
+        self.assertTrue ('tomb_test_package.module' in t3.containments)
+
+    #--------------------------------------------------------------------------#
+    # Bytecode                                                                 #
+    #--------------------------------------------------------------------------#
+    def testBytecode (self):
+        """Test bytecode tomb
+        """
+        self.write ('module.py', 'value = 2\n')
+        tomb = Tomb.FromBytes (Tomb.FromModules (('tomb_test_package',), True).ToBytes ())
+        self.assertTrue (tomb.bytecode)
+        self.assertEqual (set (tomb.bytecodes), set (tomb.containments))
+
+        code = tomb.get_code ('tomb_test_package.module')
+        self.assertTrue (code is tomb.get_code ('tomb_test_package.module'))
+        self.assertFalse ('tomb_test_package.module' in tomb.bytecodes)
+        scope = {}
+        exec (code, scope)
+        self.assertEqual (scope ['value'], 2)
+
+        # incompatible interpreter falls back to source
+        state = json.loads (zlib.decompress (tomb.ToBytes ()).decode ('utf-8'))
+        state ['magic'] = '00000000'
+        tomb = Tomb.FromBytes (zlib.compress (json.dumps (state).encode ('utf-8')))
+        self.assertFalse (tomb.bytecodes)
+        scope = {}
+        exec (tomb.get_code ('tomb_test_package.module'), scope)
+        self.assertEqual (scope ['value'], 2)
+
+    #--------------------------------------------------------------------------#
+    # Lazy                                                                     #
+    #--------------------------------------------------------------------------#
+    def testLazy (self):
+        """Test lazy tomb
+        """
+        self.write ('module.py', 'value = 2\n')
+        source = Tomb.FromModules (('tomb_test_package',)).containments ['tomb_test_package.module'][0]
+        tomb = Tomb.FromBytes (Tomb.FromModules (('tomb_test_package',),
+            lazy = ('tomb_test_package.core',)).ToBytes ())
+        self.assertTrue ('tomb_test_package' in tomb.containments)
+        self.assertFalse ('tomb_test_package.module' in tomb.containments)
+        self.assertTrue ('tomb_test_package.module' in tomb.index)
+
+        # fetcher is required
+        self.assertEqual (tomb.find_module ('tomb_test_package.module'), None)
+        fetched = []
+        def fetcher (name):
+            fetched.append (name)
+            return source
+        tomb.Fetcher (fetcher)
+        self.assertTrue (tomb.find_module ('tomb_test_package.module') is tomb)
+        self.assertEqual (tomb.get_source ('tomb_test_package.module'), source)
+        self.assertEqual (tomb.get_source ('tomb_test_package.module'), source)
+        self.assertEqual (fetched, ['tomb_test_package.module'])
+
+        # fetcher may provide compiled code
+        code = compile (source, 'module.py', 'exec')
+        tomb = Tomb.FromBytes (Tomb.FromModules (('tomb_test_package',), lazy = ('none',)).ToBytes ())
+        tomb.Fetcher (lambda name: (source, code))
+        self.assertTrue (tomb.get_code ('tomb_test_package.module') is code)
+
+        # modified source
+        tomb = Tomb.FromBytes (Tomb.FromModules (('tomb_test_package',), lazy = ('none',)).ToBytes ())
+        tomb.Fetcher (lambda name: 'value = 3\n')
+        with self.assertRaises (ImportError):
+            tomb.get_code ('tomb_test_package.module')
+
+# vim: nu ft=python columns=120 :